@@ -20,12 +20,18 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.8_images_api'))
 
 from database_manager import DatabaseManager
 from models import db, User, Item, Message, Transaction, Review
+from migrations import run_migrations
+from items_service import ItemsService
+from items_search import ItemsSearch
+from conversation_summary import ConversationSummary
 from auth_routes import auth_bp
 from items_routes import items_bp
 from messages_routes import messages_bp
 from geolocation_routes import geolocation_bp
 from payments_routes import payments_bp
 from images_routes import images_bp
+from images_service import ImagesService
+from image_jobs import ImageJobQueue
 
 class FlaskApp:
     def __init__(self, db_type="sqlite", db_connection_string=None, db_path=None):
@@ -44,6 +50,10 @@ class FlaskApp:
         self.app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
         self.app.config['DEBUG'] = True  # Disabilita in produzione
         
+        # Dimensione massima di una richiesta: la più grande è l'upload multiplo
+        # di immagini (gli endpoint di upload applicano poi limiti propri)
+        self.app.config['MAX_CONTENT_LENGTH'] = ImagesService.max_request_size(ImagesService.MAX_IMAGES_PER_ITEM)
+        
         # Configurazione JWT
         self.app.config['JWT_SECRET_KEY'] = 'jwt-secret-key-change-in-production'
         self.app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
@@ -90,6 +100,21 @@ class FlaskApp:
         # Crea le tabelle se non esistono
         with self.app.app_context():
             db.create_all()
+            
+            # Allinea database esistenti (nuove colonne e indici)
+            applied = run_migrations()
+            if applied:
+                print(f"🔧 Migrazioni applicate: {', '.join(applied)}")
+            
+            # Popola la chiave spaziale degli items esistenti
+            ItemsService.backfill_geohashes()
+            
+            # Riepilogo conversazioni per i messaggi già presenti
+            ConversationSummary.backfill()
+            
+            # Indice full-text per la ricerca items
+            search_backend = ItemsSearch.install()
+            print(f"🔎 Ricerca items: {search_backend or 'ILIKE (senza indice)'}")
             print(f"✅ SQLAlchemy configurato con {self.db_type}")
     
     def _init_database(self):
@@ -174,7 +199,8 @@ class FlaskApp:
                         "conversations": "/api/messages/conversations (GET)",
                         "conversation": "/api/messages/conversation/<user_id> (GET)",
                         "mark_read": "/api/messages/<id>/read (PUT)",
-                        "unread_count": "/api/messages/unread-count (GET)"
+                        "unread_count": "/api/messages/unread-count (GET)",
+                        "stream": "/api/messages/stream (GET, SSE)"
                     },
                     "payments": {
                         "create_transaction": "/api/payments/transaction (POST)",
@@ -262,11 +288,29 @@ class FlaskApp:
                     "message": str(e)
                 }), 500
     
+    def resume_image_jobs(self):
+        """
+        Riprende le elaborazioni immagini interrotte
+        
+        Va chiamata all'avvio del server (run): creare o importare l'app non
+        avvia thread né prende in carico job.
+        
+        Returns:
+            int: numero di job ripresi
+        """
+        resumed = ImageJobQueue.resume_pending(self.app)
+        if resumed:
+            print(f"🖼️ Job immagini ripresi: {resumed}")
+        return resumed
+    
     def run(self, host='0.0.0.0', port=5000, debug=True):
         """Avvia l'applicazione Flask"""
         print(f"🚀 Avvio Flask su http://{host}:{port}")
         print(f"📊 Database: {self.db_type}")
         print(f"🔧 Debug mode: {debug}")
+        # Con il reloader (debug) i job sono ripresi solo dal processo che serve le richieste
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            self.resume_image_jobs()
         self.app.run(host=host, port=port, debug=debug)
     
     def get_app(self):
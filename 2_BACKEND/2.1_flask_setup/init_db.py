@@ -10,7 +10,10 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '1_PROGET
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
 
 from app import flask_app
-from models import db, User, Item, Message, Transaction, Review
+from models import db, User, Item, Message, Conversation, ImageJob, ImageBlob, ItemImage, Transaction, Review, GeocodeCacheEntry
+from migrations import run_migrations
+from images_service import ImagesService
+from geocode_cache import GeocodeCache
 
 def init_database():
     """Inizializza il database creando tutte le tabelle"""
@@ -25,10 +28,23 @@ def init_database():
         
         # Crea tutte le tabelle
         db.create_all()
+        run_migrations()
         print("✅ Tabelle create con successo:")
         
+        # Immagini caricate prima del blob store (cartelle item_<id>/)
+        migrated = ImagesService.migrate_legacy_uploads()
+        if migrated:
+            print(f"🖼️ Immagini spostate nel blob store: {migrated}")
+        completed = ImagesService.backfill_metadata()
+        if completed:
+            print(f"🖼️ Metadati immagini completati: {completed}")
+        
+        purged = GeocodeCache.purge_expired()
+        if purged:
+            print(f"🗺️ Risultati di geocoding scaduti eliminati: {purged}")
+        
         # Verifica tabelle create
-        tables = [User, Item, Message, Transaction, Review]
+        tables = [User, Item, Message, Conversation, ImageJob, ImageBlob, ItemImage, Transaction, Review, GeocodeCacheEntry]
         for table in tables:
             count = table.query.count()
             print(f"   - {table.__tablename__}: {count} record")
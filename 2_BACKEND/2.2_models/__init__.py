@@ -1,6 +1,6 @@
 """
 Package per i modelli SQLAlchemy
 """
-from .models import db, User, Item, Message, Transaction, Review
+from .models import db, User, Item, Message, Conversation, ImageJob, ImageBlob, ItemImage, Transaction, Review
 
-__all__ = ['db', 'User', 'Item', 'Message', 'Transaction', 'Review']
+__all__ = ['db', 'User', 'Item', 'Message', 'Conversation', 'ImageJob', 'ImageBlob', 'ItemImage', 'Transaction', 'Review']
@@ -0,0 +1,122 @@
+"""
+Paginazione keyset (a cursore)
+Alternativa a query.paginate(): niente OFFSET e COUNT(*) opzionale, costo
+costante anche sulle pagine profonde (scroll infinito)
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """
+    Crea un cursore opaco dalla chiave (timestamp, id) dell'ultima riga
+
+    Returns:
+        str: cursore base64 url-safe
+    """
+    payload = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decodifica un cursore creato da encode_cursor
+
+    Raises:
+        ValueError: cursore non valido
+
+    Returns:
+        tuple: (timestamp, id)
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Cursore non valido")
+
+
+def parse_cursor_args(args) -> Tuple[Optional[str], bool]:
+    """
+    Legge i parametri di paginazione a cursore dalla query string
+
+    Args:
+        args: request.args
+
+    Raises:
+        ValueError: cursore non valido
+
+    Returns:
+        tuple: (cursor, include_total) - cursor None = paginazione classica,
+               "" = prima pagina in modalità cursore
+    """
+    cursor = args.get('cursor', type=str)
+    include_total = args.get('include_total', 'true').lower() != 'false'
+
+    if cursor:
+        decode_cursor(cursor)
+
+    return cursor, include_total
+
+
+def paginate_keyset(query, sort_column, id_column, key: Callable,
+                    cursor: Optional[str] = None, per_page: int = 20,
+                    descending: bool = True, include_total: bool = True) -> dict:
+    """
+    Pagina una query ordinata per (sort_column, id_column)
+
+    Args:
+        query: Query da paginare (senza ORDER BY)
+        sort_column: Colonna temporale di ordinamento (created_at, timestamp)
+        id_column: Chiave primaria, spareggio per timestamp uguali
+        key: Funzione riga -> (timestamp, id) per costruire il cursore successivo
+        cursor: Cursore restituito dalla pagina precedente (None = prima pagina)
+        per_page: Righe per pagina
+        descending: True per i più recenti prima
+        include_total: Se False non esegue il COUNT(*)
+
+    Raises:
+        ValueError: cursore non valido
+
+    Returns:
+        dict: {'items', 'next_cursor', 'has_next', 'total'}
+    """
+    total = query.order_by(None).count() if include_total else None
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(or_(
+                sort_column < last_value,
+                and_(sort_column == last_value, id_column < last_id)
+            ))
+        else:
+            query = query.filter(or_(
+                sort_column > last_value,
+                and_(sort_column == last_value, id_column > last_id)
+            ))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    # Una riga in più dice se esiste una pagina successiva
+    rows = query.limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_cursor = None
+    if has_next and rows:
+        next_cursor = encode_cursor(*key(rows[-1]))
+
+    return {
+        'items': rows,
+        'next_cursor': next_cursor,
+        'has_next': has_next,
+        'total': total
+    }
@@ -0,0 +1,88 @@
+"""
+Migrazioni leggere dello schema
+Allinea i database esistenti ai modelli: db.create_all() crea solo le tabelle
+mancanti, quindi colonne e indici aggiunti in seguito vanno creati qui
+"""
+from sqlalchemy import inspect, text
+
+from models import db
+
+# Indici non più dichiarati nei modelli, da eliminare dai database esistenti
+# (es. su singola colonna, coperti da un indice composto che inizia con essa)
+OBSOLETE_INDEXES = {
+    'messages': ['ix_messages_sender_id', 'ix_messages_receiver_id'],
+}
+
+
+def _add_missing_columns(table, existing_columns: set) -> list:
+    """Aggiunge con ALTER TABLE le colonne del modello assenti nel database"""
+    added = []
+    for column in table.columns:
+        if column.name in existing_columns:
+            continue
+
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        db.session.execute(text(
+            f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+        ))
+        added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def _add_missing_indexes(table, existing_indexes: set) -> list:
+    """Crea gli indici dichiarati nel modello e assenti nel database"""
+    added = []
+    for index in table.indexes:
+        if index.name in existing_indexes:
+            continue
+
+        index.create(bind=db.engine, checkfirst=True)
+        added.append(index.name)
+    return added
+
+
+def _drop_obsolete_indexes(table, existing_indexes: set) -> list:
+    """Elimina gli indici di OBSOLETE_INDEXES ancora presenti nel database"""
+    dropped = []
+    for name in OBSOLETE_INDEXES.get(table.name, []):
+        if name not in existing_indexes:
+            continue
+
+        db.session.execute(text(f'DROP INDEX {name}'))
+        dropped.append(f'-{name}')
+    return dropped
+
+
+def run_migrations() -> list:
+    """
+    Applica le migrazioni idempotenti dello schema
+
+    Va chiamata dentro un app context, dopo db.create_all().
+
+    Returns:
+        Lista delle modifiche applicate (colonne e indici; '-' per gli
+        indici eliminati)
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    applied = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        applied.extend(_add_missing_columns(table, existing_columns))
+
+    db.session.commit()
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        applied.extend(_drop_obsolete_indexes(table, existing_indexes))
+        applied.extend(_add_missing_indexes(table, existing_indexes))
+
+    db.session.commit()
+    return applied
@@ -2,10 +2,42 @@
 Modelli SQLAlchemy per Progetto Autonomia
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+import math
+import sqlite3
 
 db = SQLAlchemy()
 
+
+# Funzioni matematiche usate nelle query geografiche (distanza Haversine in SQL).
+# PostgreSQL le ha native; SQLite solo se compilato con le math functions.
+_SQLITE_MATH_FUNCTIONS = {
+    'sin': math.sin,
+    'cos': math.cos,
+    'asin': math.asin,
+    'sqrt': math.sqrt,
+    'radians': math.radians,
+}
+
+
+@event.listens_for(Engine, 'connect')
+def _register_sqlite_math_functions(dbapi_connection, connection_record):
+    """Registra le funzioni matematiche mancanti sulle connessioni SQLite"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    try:
+        dbapi_connection.execute('SELECT sin(0), asin(0), radians(0)')
+    except sqlite3.OperationalError:
+        for name, function in _SQLITE_MATH_FUNCTIONS.items():
+            dbapi_connection.create_function(
+                name, 1,
+                lambda value, fn=function: None if value is None else fn(value),
+                deterministic=True
+            )
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -43,6 +75,7 @@ class Item(db.Model):
     image_url = db.Column(db.Text, nullable=True)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)  # Chiave spaziale per ricerche geografiche
     seller_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     is_sold = db.Column(db.Boolean, default=False, nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -51,6 +84,14 @@ class Item(db.Model):
     
     transactions = db.relationship('Transaction', backref='item', lazy='dynamic', cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='item', lazy='dynamic', cascade='all, delete-orphan')
+    # Galleria in ordine di visualizzazione (image_url resta l'immagine principale)
+    images = db.relationship('ItemImage', backref='item', cascade='all, delete-orphan',
+                             order_by='(ItemImage.position, ItemImage.id)')
+    
+    __table_args__ = (
+        # Ricerca per celle geohash con filtro su coordinate senza accesso alla tabella
+        db.Index('ix_items_geohash_lat_lon', 'geohash', 'latitude', 'longitude'),
+    )
     
     def __repr__(self):
         return f'<Item {self.title}>'
@@ -59,15 +100,123 @@ class Message(db.Model):
     __tablename__ = 'messages'
     
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Nessun indice su singola colonna: coperti dagli indici composti sotto
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     read = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        # Inbox: receiver_id = ? ORDER BY timestamp DESC
+        db.Index('ix_messages_receiver_timestamp', 'receiver_id', 'timestamp', 'id'),
+        # Inviati: sender_id = ? ORDER BY timestamp DESC
+        db.Index('ix_messages_sender_timestamp', 'sender_id', 'timestamp', 'id'),
+        # Thread: (sender_id, receiver_id) = (?, ?) ORDER BY timestamp
+        db.Index('ix_messages_pair_timestamp', 'sender_id', 'receiver_id', 'timestamp', 'id'),
+        # Non letti: receiver_id = ? AND read = false (indice parziale, solo righe non lette)
+        db.Index('ix_messages_receiver_unread', 'receiver_id', 'timestamp',
+                 sqlite_where=(read == False), postgresql_where=(read == False)),
+    )
+    
     def __repr__(self):
         return f'<Message from {self.sender_id} to {self.receiver_id}>'
 
+class Conversation(db.Model):
+    """Riepilogo di una chat tra due utenti, aggiornato a ogni messaggio"""
+    __tablename__ = 'conversations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Coppia ordinata: user_a_id < user_b_id
+    user_a_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    user_b_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id', ondelete='SET NULL'), nullable=True)
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+    message_count = db.Column(db.Integer, default=0, nullable=False)
+    unread_a = db.Column(db.Integer, default=0, nullable=False)  # Non letti ricevuti da user_a
+    unread_b = db.Column(db.Integer, default=0, nullable=False)  # Non letti ricevuti da user_b
+    
+    last_message = db.relationship('Message')
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_a_id', 'user_b_id', name='uq_conversations_pair'),
+        # Lista chat di un utente, più recenti prima
+        db.Index('ix_conversations_user_a_last', 'user_a_id', 'last_timestamp'),
+        db.Index('ix_conversations_user_b_last', 'user_b_id', 'last_timestamp'),
+    )
+    
+    def __repr__(self):
+        return f'<Conversation {self.user_a_id} - {self.user_b_id}>'
+
+class ImageJob(db.Model):
+    """Elaborazione in background di un'immagine caricata (varianti ridimensionate)"""
+    __tablename__ = 'image_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False, index=True)
+    path = db.Column(db.String(255), nullable=False)  # Percorso relativo dell'originale
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, done, failed
+    owner = db.Column(db.String(100), nullable=True)  # host:pid del processo che lo elabora
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Ripresa dei job non completati all'avvio
+        db.Index('ix_image_jobs_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f'<ImageJob {self.id} - {self.status}>'
+
+class ImageBlob(db.Model):
+    """Immagine salvata una sola volta, indirizzata dall'hash del contenuto"""
+    __tablename__ = 'image_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)  # sha256 dell'originale
+    extension = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # Byte dell'originale
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)  # Immagini di item che lo usano
+    # Varianti salvate: {dimensione: {estensione: sha256}}, NULL finché non sono generate
+    variants = db.Column(db.JSON(none_as_null=True), nullable=True)
+    # Segnaposto sfocato (data URI di pochi byte) da mostrare prima del thumbnail
+    placeholder = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def filename(self):
+        return f'{self.key}.{self.extension}'
+    
+    def __repr__(self):
+        return f'<ImageBlob {self.key[:12]} refs={self.ref_count}>'
+
+class ItemImage(db.Model):
+    """Immagine di un item: riferimento a un blob"""
+    __tablename__ = 'item_images'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('image_blobs.id'), nullable=False, index=True)
+    filename = db.Column(db.String(80), nullable=False)  # Nome pubblico: <hash>.<estensione>
+    position = db.Column(db.Integer, nullable=True)  # Ordine nella galleria, da 0
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    blob = db.relationship('ImageBlob')
+    
+    __table_args__ = (
+        # Stessa foto caricata due volte sullo stesso item: un solo riferimento
+        db.UniqueConstraint('item_id', 'filename', name='uq_item_images_item_filename'),
+        # Galleria di un item in ordine
+        db.Index('ix_item_images_item_position', 'item_id', 'position'),
+    )
+    
+    def __repr__(self):
+        return f'<ItemImage {self.item_id}/{self.filename}>'
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
     
@@ -98,3 +247,18 @@ class Review(db.Model):
     
     def __repr__(self):
         return f'<Review {self.rating} stars for item {self.item_id}>'
+
+class GeocodeCacheEntry(db.Model):
+    """Risposta di Nominatim già ottenuta (cache persistente del geocoding)"""
+    __tablename__ = 'geocode_cache'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Query normalizzata o coordinate arrotondate, es. "geocode:milano, italy"
+    key = db.Column(db.String(255), unique=True, nullable=False)
+    success = db.Column(db.Boolean, nullable=False)  # False = non trovato (cache negativa)
+    message = db.Column(db.String(255), nullable=False)
+    data = db.Column(db.JSON(none_as_null=True), nullable=True)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<GeocodeCacheEntry {self.key}>'
@@ -0,0 +1,37 @@
+"""
+Contatore di query SQL
+Registra gli statement eseguiti su un engine (usato nei test per verificare
+che una pagina venga servita con un numero costante di query)
+"""
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """
+    Context manager che conta gli statement SQL eseguiti
+
+    Esempio:
+        with QueryCounter(db.engine) as counter:
+            ItemsService.get_items()
+        assert counter.count == 2
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        """Numero di statement eseguiti"""
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return False
@@ -5,6 +5,7 @@ Endpoint per CRUD, ricerca, filtri e geolocalizzazione
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from items_service import ItemsService
+from keyset_pagination import parse_cursor_args
 
 # Crea blueprint per le routes items
 items_bp = Blueprint('items', __name__, url_prefix='/api/items')
@@ -28,8 +29,12 @@ def get_items():
         - latitude (float): Latitudine per ricerca geografica
         - longitude (float): Longitudine per ricerca geografica
         - radius_km (float): Raggio in km per ricerca geografica
-        - order_by (str): Campo ordinamento (created_at, price, name)
+        - order_by (str): Campo ordinamento (created_at, price, name, relevance)
         - order_dir (str): Direzione (asc, desc)
+        - cursor (str): Paginazione a cursore (vuoto = prima pagina, poi il
+          valore di pagination.next_cursor); solo con order_by=created_at
+          e senza radius_km
+        - include_total (bool): Con cursor, false evita il conteggio totale
     
     Returns:
         200: Lista items con paginazione
@@ -66,10 +71,10 @@ def get_items():
                 "message": "Numero pagina non valido"
             }), 400
         
-        if order_by not in ['created_at', 'price', 'name']:
+        if order_by not in ['created_at', 'price', 'name', 'relevance']:
             return jsonify({
                 "success": False,
-                "message": "Campo ordinamento non valido (usa: created_at, price, name)"
+                "message": "Campo ordinamento non valido (usa: created_at, price, name, relevance)"
             }), 400
         
         if order_dir not in ['asc', 'desc']:
@@ -78,6 +83,21 @@ def get_items():
                 "message": "Direzione ordinamento non valida (usa: asc, desc)"
             }), 400
         
+        # Paginazione a cursore
+        try:
+            cursor, include_total = parse_cursor_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
+        if cursor is not None and (order_by != 'created_at' or radius_km):
+            return jsonify({
+                "success": False,
+                "message": "Il cursore richiede order_by=created_at e nessun radius_km"
+            }), 400
+        
         # Ottieni items
         result = ItemsService.get_items(
             page=page,
@@ -90,7 +110,9 @@ def get_items():
             longitude=longitude,
             radius_km=radius_km,
             order_by=order_by,
-            order_dir=order_dir
+            order_dir=order_dir,
+            cursor=cursor,
+            include_total=include_total
         )
         
         return jsonify({
@@ -367,12 +389,14 @@ def get_my_items():
     Ottieni tutti gli items dell'utente corrente
     
     GET /api/items/my-items?page=1&per_page=20
+    GET /api/items/my-items?cursor=&include_total=false
     Headers: {
         "Authorization": "Bearer <access_token>"
     }
     
     Returns:
         200: Lista items dell'utente
+        400: Cursore non valido
         401: Non autenticato
     """
     try:
@@ -383,13 +407,23 @@ def get_my_items():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         
+        try:
+            cursor, include_total = parse_cursor_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
         # Ottieni items dell'utente
         result = ItemsService.get_items(
             page=page,
             per_page=per_page,
             seller_id=current_user_id,
             order_by='created_at',
-            order_dir='desc'
+            order_dir='desc',
+            cursor=cursor,
+            include_total=include_total
         )
         
         return jsonify({
@@ -0,0 +1,173 @@
+"""
+Ricerca full-text sugli Items
+Indice FTS5 su SQLite (sviluppo) e tsvector + GIN su PostgreSQL (produzione)
+"""
+import re
+import sys
+import os
+from typing import Optional
+
+from sqlalchemy import func, literal_column, table, column, text
+
+# Aggiungi path per import modelli
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+from models import db, Item
+
+
+class ItemsSearch:
+    """Indice full-text su titolo e descrizione degli items"""
+
+    BACKEND_FTS5 = 'fts5'
+    BACKEND_TSVECTOR = 'tsvector'
+
+    # Configurazione testuale PostgreSQL (nessuno stemming, prefissi prevedibili)
+    TS_CONFIG = 'simple'
+
+    # Peso del titolo rispetto alla descrizione nel ranking
+    TITLE_WEIGHT = 10.0
+    DESCRIPTION_WEIGHT = 1.0
+
+    # Backend disponibile per ogni database (cache per URL engine)
+    _backends = {}
+
+    _SQLITE_DDL = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            title, description,
+            content='items', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts(rowid, title, description)
+            VALUES (new.id, new.title, new.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts(items_fts, rowid, title, description)
+            VALUES ('delete', old.id, old.title, old.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF title, description ON items BEGIN
+            INSERT INTO items_fts(items_fts, rowid, title, description)
+            VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO items_fts(rowid, title, description)
+            VALUES (new.id, new.title, new.description);
+        END
+        """,
+    ]
+
+    _POSTGRES_DDL = [
+        f"""
+        ALTER TABLE items ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{TS_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{TS_CONFIG}', coalesce(description, '')), 'B')
+        ) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_items_search_vector ON items USING GIN (search_vector)",
+    ]
+
+    @staticmethod
+    def install() -> Optional[str]:
+        """
+        Crea (se mancano) le strutture full-text e le tiene sincronizzate
+
+        Su SQLite i trigger aggiornano items_fts a ogni insert/update/delete
+        di items; su PostgreSQL la colonna generata si aggiorna da sola.
+        Va chiamata dentro un app context, dopo db.create_all().
+
+        Returns:
+            Backend attivo ('fts5', 'tsvector') o None se non disponibile
+        """
+        dialect = db.engine.dialect.name
+        backend = None
+
+        try:
+            if dialect == 'sqlite':
+                existed = db.session.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'"
+                )).first() is not None
+
+                for statement in ItemsSearch._SQLITE_DDL:
+                    db.session.execute(text(statement))
+
+                # Indicizza gli items creati prima dell'indice full-text
+                if not existed:
+                    db.session.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+                backend = ItemsSearch.BACKEND_FTS5
+
+            elif dialect == 'postgresql':
+                for statement in ItemsSearch._POSTGRES_DDL:
+                    db.session.execute(text(statement))
+                backend = ItemsSearch.BACKEND_TSVECTOR
+
+            db.session.commit()
+
+        except Exception as e:
+            # SQLite senza FTS5 o PostgreSQL < 12: resta la ricerca con ILIKE
+            db.session.rollback()
+            print(f"⚠️  Ricerca full-text non disponibile: {str(e)}")
+            backend = None
+
+        ItemsSearch._backends[str(db.engine.url)] = backend
+        return backend
+
+    @staticmethod
+    def backend() -> Optional[str]:
+        """Backend full-text del database corrente (None = fallback ILIKE)"""
+        return ItemsSearch._backends.get(str(db.engine.url))
+
+    @staticmethod
+    def tokenize(search: str) -> list:
+        """Parole della ricerca, senza sintassi riservata dei motori full-text"""
+        return re.findall(r'\w+', search or '', re.UNICODE)
+
+    @staticmethod
+    def apply(query, search: str):
+        """
+        Applica il filtro di ricerca testuale a una query su Item
+
+        Ogni parola deve comparire (anche come prefisso) nel titolo o nella
+        descrizione.
+
+        Args:
+            query: Query su Item
+            search: Testo cercato
+
+        Returns:
+            (query filtrata, espressione di rilevanza o None)
+            La rilevanza è già orientata: ordinare in modo crescente.
+        """
+        tokens = ItemsSearch.tokenize(search)
+        backend = ItemsSearch.backend()
+
+        if tokens and backend == ItemsSearch.BACKEND_FTS5:
+            fts = table('items_fts', column('rowid'))
+            fts_table = literal_column('items_fts')
+            match_query = ' '.join(f'"{token}"*' for token in tokens)
+
+            query = query.join(fts, fts.c.rowid == Item.id).filter(fts_table.op('MATCH')(match_query))
+            # bm25: valori più bassi = più rilevante
+            rank = func.bm25(fts_table, ItemsSearch.TITLE_WEIGHT, ItemsSearch.DESCRIPTION_WEIGHT)
+            return query, rank
+
+        if tokens and backend == ItemsSearch.BACKEND_TSVECTOR:
+            vector = literal_column('items.search_vector')
+            ts_query = func.to_tsquery(ItemsSearch.TS_CONFIG, ' & '.join(f'{token}:*' for token in tokens))
+
+            query = query.filter(vector.op('@@')(ts_query))
+            rank = -func.ts_rank(vector, ts_query)
+            return query, rank
+
+        # Fallback: ricerca per sottostringa senza indice
+        search_pattern = f"%{search}%"
+        query = query.filter(
+            (Item.title.ilike(search_pattern)) |
+            (Item.description.ilike(search_pattern))
+        )
+        return query, None
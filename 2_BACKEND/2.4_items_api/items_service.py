@@ -6,11 +6,22 @@ import sys
 import os
 from datetime import datetime
 from typing import List, Optional, Tuple
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, cos
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
 
 # Aggiungi path per import modelli
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
-from models import db, Item, User
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.6_geolocation_api'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.8_images_api'))
+from models import db, Item, User, ItemImage
+from keyset_pagination import paginate_keyset
+from spatial_index import SpatialIndex
+from geolocation_service import GeolocationService
+from geo_distance import EARTH_RADIUS_KM, haversine_km, distances_km
+from item_geo_index import ItemGeoIndex
+from items_search import ItemsSearch
+from images_service import ImagesService
 
 
 class ItemsService:
@@ -94,25 +105,7 @@ class ItemsService:
         Returns:
             Distanza in km
         """
-        # Raggio della Terra in km
-        R = 6371.0
-        
-        # Converti in radianti
-        lat1_rad = radians(lat1)
-        lon1_rad = radians(lon1)
-        lat2_rad = radians(lat2)
-        lon2_rad = radians(lon2)
-        
-        # Differenze
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-        
-        # Formula Haversine
-        a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        
-        distance = R * c
-        return round(distance, 2)
+        return round(haversine_km(lat1, lon1, lat2, lon2), 2)
     
     @staticmethod
     def create_item(
@@ -156,6 +149,9 @@ class ItemsService:
             return False, "Venditore non trovato", None
         
         try:
+            lat_value = float(latitude) if latitude is not None else None
+            lon_value = float(longitude) if longitude is not None else None
+            
             new_item = Item(
                 title=title.strip(),
                 description=description.strip() if description else None,
@@ -164,13 +160,15 @@ class ItemsService:
                 condition=condition.strip() if condition else None,
                 location_name=location.strip() if location else None,
                 image_url=image.strip() if isinstance(image, str) and image.strip() else None,
-                latitude=float(latitude) if latitude is not None else None,
-                longitude=float(longitude) if longitude is not None else None,
+                latitude=lat_value,
+                longitude=lon_value,
+                geohash=SpatialIndex.encode_optional(lat_value, lon_value),
                 seller_id=seller_id
             )
             
             db.session.add(new_item)
             db.session.commit()
+            ItemGeoIndex.sync(new_item)
             
             return True, "Oggetto creato con successo", new_item
             
@@ -189,7 +187,12 @@ class ItemsService:
         Returns:
             Item object o None
         """
-        return Item.query.get(item_id)
+        return Item.query.options(ItemsService.gallery_loader()).get(item_id)
+
+    @staticmethod
+    def gallery_loader():
+        """Caricamento delle gallerie: una query per tutti gli items della pagina"""
+        return selectinload(Item.images).joinedload(ItemImage.blob)
 
     @staticmethod
     def serialize_item(item: Item, distance_km: Optional[float] = None) -> dict:
@@ -202,6 +205,9 @@ class ItemsService:
             if not seller_full_name:
                 seller_full_name = None
 
+        images = [ImagesService.serialize_item_image(image, item.image_url) for image in item.images]
+        primary = next((image for image in images if image['is_primary']), None)
+
         data = {
             'id': item.id,
             'title': item.title,
@@ -213,6 +219,8 @@ class ItemsService:
             'latitude': item.latitude,
             'longitude': item.longitude,
             'image': item.image_url,
+            'image_placeholder': primary['placeholder'] if primary else None,
+            'images': images,
             'seller_id': item.seller_id,
             'seller_username': seller.username if seller else None,
             'seller_full_name': seller_full_name,
@@ -300,14 +308,47 @@ class ItemsService:
                     
                 item.latitude = float(kwargs['latitude']) if kwargs['latitude'] is not None else None
                 item.longitude = float(kwargs['longitude']) if kwargs['longitude'] is not None else None
+                item.geohash = SpatialIndex.encode_optional(item.latitude, item.longitude)
             
             db.session.commit()
+            ItemGeoIndex.sync(item)
             return True, "Oggetto aggiornato con successo", item
             
         except Exception as e:
             db.session.rollback()
             return False, f"Errore durante l'aggiornamento: {str(e)}", None
     
+    @staticmethod
+    def backfill_geohashes(batch_size: int = 500) -> int:
+        """
+        Calcola il geohash degli items con coordinate che non lo hanno ancora
+        (items creati prima dell'introduzione della chiave spaziale)
+        
+        Args:
+            batch_size: Items aggiornati per commit
+            
+        Returns:
+            Numero di items aggiornati
+        """
+        updated = 0
+        while True:
+            items = Item.query.filter(
+                Item.geohash.is_(None),
+                Item.latitude.isnot(None),
+                Item.longitude.isnot(None)
+            ).limit(batch_size).all()
+            
+            if not items:
+                break
+            
+            for item in items:
+                item.geohash = SpatialIndex.encode(item.latitude, item.longitude)
+            
+            db.session.commit()
+            updated += len(items)
+        
+        return updated
+    
     @staticmethod
     def delete_item(item_id: int, seller_id: int) -> Tuple[bool, str]:
         """
@@ -330,23 +371,98 @@ class ItemsService:
             return False, "Non sei autorizzato a eliminare questo oggetto"
         
         try:
+            # Rilascia i riferimenti ai blob (file eliminati se non condivisi)
+            ImagesService.release_item_images(item_id)
             db.session.delete(item)
             db.session.commit()
+            ItemGeoIndex.remove(item_id)
             return True, "Oggetto eliminato con successo"
             
         except Exception as e:
             db.session.rollback()
             return False, f"Errore durante l'eliminazione: {str(e)}"
     
+    @staticmethod
+    def distance_expression(latitude: float, longitude: float):
+        """
+        Espressione SQL della distanza Haversine (km) tra un item e un punto
+        
+        Args:
+            latitude: Latitudine del punto di riferimento
+            longitude: Longitudine del punto di riferimento
+            
+        Returns:
+            Espressione SQLAlchemy (NULL per items senza coordinate)
+        """
+        half_dlat = func.radians(Item.latitude - latitude) / 2
+        half_dlon = func.radians(Item.longitude - longitude) / 2
+        
+        a = (
+            func.sin(half_dlat) * func.sin(half_dlat) +
+            cos(radians(latitude)) * func.cos(func.radians(Item.latitude)) *
+            func.sin(half_dlon) * func.sin(half_dlon)
+        )
+        
+        # Come haversine_km: per punti antipodali l'arrotondamento porta a
+        # oltre 1 e asin darebbe errore (funzione Python) o NULL (SQLite)
+        if db.engine.dialect.name == 'sqlite':
+            a = func.min(1.0, a)
+        else:
+            a = func.least(1.0, a)
+        
+        return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(a))
+    
+    @staticmethod
+    def apply_radius_filter(query, latitude: float, longitude: float, radius_km: float, distance):
+        """
+        Limita una query agli items entro il raggio, interamente in SQL
+        
+        Bounding box e celle geohash restringono i candidati usando gli indici,
+        poi la distanza esatta scarta gli angoli del box.
+        
+        Args:
+            query: Query su Item
+            latitude, longitude: Centro della ricerca
+            radius_km: Raggio in km
+            distance: Espressione SQL della distanza (da distance_expression)
+            
+        Returns:
+            Query filtrata
+        """
+        bbox = GeolocationService.find_nearby_coordinates(latitude, longitude, radius_km)
+        
+        query = query.filter(
+            Item.latitude.isnot(None),
+            Item.longitude.isnot(None),
+            Item.latitude >= bbox['min_lat'],
+            Item.latitude <= bbox['max_lat'],
+            Item.longitude >= bbox['min_lon'],
+            Item.longitude <= bbox['max_lon']
+        )
+        
+        cells_filter = SpatialIndex.prefix_filter(Item.geohash, SpatialIndex.covering_cells(bbox))
+        if cells_filter is not None:
+            query = query.filter(cells_filter)
+        
+        return query.filter(distance <= radius_km)
+    
     @staticmethod
     def get_items(page: int = 1, per_page: int = 20, 
                  min_price: float = None, max_price: float = None,
                  search: str = None, seller_id: int = None,
                  latitude: float = None, longitude: float = None, radius_km: float = None,
-                 order_by: str = 'created_at', order_dir: str = 'desc') -> dict:
+                 order_by: str = 'created_at', order_dir: str = 'desc',
+                 cursor: str = None, include_total: bool = True) -> dict:
         """
         Ottieni lista items con filtri e paginazione
         
+        Con radius_km filtro per raggio, distanza e ordinamento per distanza
+        avvengono nel database, prima della paginazione, così ogni pagina è
+        piena e i totali contano solo gli items nel raggio. Con latitude/longitude
+        senza raggio la distanza serve solo per gli items restituiti: è
+        calcolata dopo la paginazione, in una passata per tutta la pagina
+        (geo_distance.distances_km).
+        
         Args:
             page: Numero pagina (default 1)
             per_page: Items per pagina (default 20, max 100)
@@ -357,8 +473,12 @@ class ItemsService:
             latitude: Latitudine per ricerca per distanza
             longitude: Longitudine per ricerca per distanza
             radius_km: Raggio in km per ricerca geografica
-            order_by: Campo per ordinamento (created_at, price, name)
+            order_by: Campo per ordinamento (created_at, price, name, relevance)
             order_dir: Direzione ordinamento (asc, desc)
+            cursor: Cursore keyset su (created_at, id); se non None ("" = prima
+                    pagina) sostituisce page e richiede order_by=created_at
+                    senza radius_km
+            include_total: In modalità cursore, se False salta il COUNT(*)
             
         Returns:
             Dict con items, paginazione e metadati
@@ -366,8 +486,18 @@ class ItemsService:
         # Limita per_page
         per_page = min(per_page, 100)
         
-        # Query base
-        query = Item.query
+        geographic = latitude is not None and longitude is not None
+        # Distanza nel database solo se serve a filtrare e ordinare
+        distance_in_sql = geographic and bool(radius_km)
+        
+        # Query base (venditore nella stessa query, gallerie in una query: niente N+1 in serialize_item)
+        query = Item.query.options(joinedload(Item.seller), ItemsService.gallery_loader())
+        
+        # Distanza calcolata dal database
+        distance = None
+        if distance_in_sql:
+            distance = ItemsService.distance_expression(latitude, longitude).label('distance_km')
+            query = query.add_columns(distance)
         
         # Filtro per venditore
         if seller_id:
@@ -379,64 +509,92 @@ class ItemsService:
         if max_price is not None:
             query = query.filter(Item.price <= max_price)
         
-        # Ricerca testuale
+        # Ricerca testuale (indice full-text se disponibile)
+        relevance = None
         if search:
-            search_pattern = f"%{search}%"
-            query = query.filter(
-                (Item.title.ilike(search_pattern)) |
-                (Item.description.ilike(search_pattern))
+            query, relevance = ItemsSearch.apply(query, search)
+        
+        # Filtro per raggio (prima della paginazione) e ordinamento per distanza
+        if distance_in_sql:
+            query = ItemsService.apply_radius_filter(query, latitude, longitude, radius_km, distance)
+            query = query.order_by(distance.asc())
+        
+        if cursor is not None:
+            # Paginazione keyset su (created_at, id): niente OFFSET
+            def keyset_key(row):
+                item = row[0] if distance_in_sql else row
+                return item.created_at, item.id
+            
+            keyset = paginate_keyset(
+                query, Item.created_at, Item.id,
+                key=keyset_key,
+                cursor=cursor or None,
+                per_page=per_page,
+                descending=order_dir == 'desc',
+                include_total=include_total
             )
-        
-        # Ordinamento
-        if order_by == 'price':
-            query = query.order_by(Item.price.desc() if order_dir == 'desc' else Item.price.asc())
-        elif order_by == 'name':
-            query = query.order_by(Item.title.desc() if order_dir == 'desc' else Item.title.asc())
-        else:  # default: created_at
-            query = query.order_by(Item.created_at.desc() if order_dir == 'desc' else Item.created_at.asc())
-        
-        # Paginazione
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        items = pagination.items
-
-        items_serialized: List[dict] = []
-        if latitude is not None and longitude is not None:
-            for item in items:
-                distance_value: Optional[float] = None
-                if item.latitude is not None and item.longitude is not None:
-                    distance_value = ItemsService.calculate_distance(
-                        latitude,
-                        longitude,
-                        item.latitude,
-                        item.longitude
-                    )
-                    if radius_km and distance_value > radius_km:
-                        continue
-
-                serialized = ItemsService.serialize_item(item, distance_km=distance_value)
-                items_serialized.append(serialized)
-
-            if radius_km:
-                items_serialized.sort(key=lambda x: x.get('distance_km') if x.get('distance_km') is not None else float('inf'))
+            rows = keyset['items']
+            pagination_data = {
+                'per_page': per_page,
+                'next_cursor': keyset['next_cursor'],
+                'has_next': keyset['has_next'],
+                'total_items': keyset['total']
+            }
         else:
-            items_serialized = [ItemsService.serialize_item(item) for item in items]
-        
-        return {
-            'items': items_serialized,
-            'pagination': {
+            # Ordinamento
+            if order_by == 'price':
+                query = query.order_by(Item.price.desc() if order_dir == 'desc' else Item.price.asc())
+            elif order_by == 'name':
+                query = query.order_by(Item.title.desc() if order_dir == 'desc' else Item.title.asc())
+            elif order_by == 'relevance' and relevance is not None:
+                # Più rilevanti prima, a parità di punteggio i più recenti
+                query = query.order_by(relevance.asc(), Item.created_at.desc())
+            else:  # default: created_at (anche per relevance senza ricerca full-text)
+                query = query.order_by(Item.created_at.desc() if order_dir == 'desc' else Item.created_at.asc())
+            
+            # Paginazione
+            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            rows = pagination.items
+            pagination_data = {
                 'page': page,
                 'per_page': per_page,
                 'total_items': pagination.total,
                 'total_pages': pagination.pages,
                 'has_next': pagination.has_next,
                 'has_prev': pagination.has_prev
-            },
+            }
+        
+        items_serialized: List[dict] = []
+        if distance_in_sql:
+            for item, distance_value in rows:
+                if distance_value is not None:
+                    distance_value = round(distance_value, 2)
+                items_serialized.append(ItemsService.serialize_item(item, distance_km=distance_value))
+        elif geographic:
+            located = [item for item in rows if item.latitude is not None and item.longitude is not None]
+            page_distances = dict(zip(
+                (item.id for item in located),
+                distances_km(latitude, longitude,
+                             [item.latitude for item in located],
+                             [item.longitude for item in located])
+            ))
+            for item in rows:
+                distance_value = page_distances.get(item.id)
+                if distance_value is not None:
+                    distance_value = round(distance_value, 2)
+                items_serialized.append(ItemsService.serialize_item(item, distance_km=distance_value))
+        else:
+            items_serialized = [ItemsService.serialize_item(item) for item in rows]
+        
+        return {
+            'items': items_serialized,
+            'pagination': pagination_data,
             'filters_applied': {
                 'min_price': min_price,
                 'max_price': max_price,
                 'search': search,
                 'seller_id': seller_id,
-                'geographic_search': latitude is not None and longitude is not None,
+                'geographic_search': geographic,
                 'radius_km': radius_km
             }
         }
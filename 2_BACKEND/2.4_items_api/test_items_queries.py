@@ -0,0 +1,194 @@
+"""
+Test per le query della lista Items
+Verifica filtri geografici in SQL, paginazione e ordinamenti
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.1_flask_setup'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.4_items_api'))
+
+from app import FlaskApp
+from models import db, User, Item, ImageBlob, ItemImage
+from query_counter import QueryCounter
+from items_service import ItemsService
+from items_search import ItemsSearch
+
+
+class TestItemsQueries(unittest.TestCase):
+    """Test per ItemsService.get_items"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(cls.tmp_dir, 'test.db'))
+        cls.app = cls.flask_app.get_app()
+        cls.client = cls.app.test_client()
+
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+        seller = User(username='items_seller', email='items@test.com', password_hash='x',
+                      first_name='Mario', last_name='Rossi', phone='000')
+        db.session.add(seller)
+        db.session.commit()
+        cls.seller_id = seller.id
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        db.session.remove()
+        db.drop_all()
+        cls.app_context.pop()
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup prima di ogni test"""
+        Item.query.delete()
+        db.session.commit()
+
+    def _create(self, title, latitude=None, longitude=None, price=10.0, description=None):
+        success, message, item = ItemsService.create_item(
+            seller_id=self.seller_id, title=title, price=price, description=description,
+            latitude=latitude, longitude=longitude
+        )
+        self.assertTrue(success, message)
+        return item
+
+    def test_01_radius_filter_before_pagination(self):
+        """Test: il raggio è applicato prima della paginazione"""
+        # 3 items a Milano, 5 a Roma (fuori raggio)
+        for index in range(3):
+            self._create(f'Milano {index}', 45.4642 + index * 0.01, 9.1900)
+        for index in range(5):
+            self._create(f'Roma {index}', 41.9028, 12.4964)
+
+        result = ItemsService.get_items(page=1, per_page=2, latitude=45.4642,
+                                        longitude=9.1900, radius_km=20)
+
+        self.assertEqual(result['pagination']['total_items'], 3)
+        self.assertEqual(result['pagination']['total_pages'], 2)
+        self.assertEqual([item['title'] for item in result['items']], ['Milano 0', 'Milano 1'])
+        self.assertEqual(result['items'][0]['distance_km'], 0.0)
+        print("✅ Test filtro raggio prima della paginazione OK")
+
+    def test_02_distance_without_radius(self):
+        """Test: senza raggio la distanza è calcolata ma nessun item è escluso"""
+        self._create('Con coordinate', 45.0703, 7.6869)
+        self._create('Senza coordinate')
+
+        result = ItemsService.get_items(latitude=45.4642, longitude=9.1900)
+        distances = {item['title']: item.get('distance_km') for item in result['items']}
+
+        self.assertEqual(result['pagination']['total_items'], 2)
+        self.assertAlmostEqual(distances['Con coordinate'],
+                               ItemsService.calculate_distance(45.4642, 9.1900, 45.0703, 7.6869),
+                               delta=0.01)
+        self.assertIsNone(distances['Senza coordinate'])
+        print("✅ Test distanza senza raggio OK")
+
+    def test_03_full_text_search_in_sync(self):
+        """Test: l'indice full-text segue creazione, modifica ed eliminazione"""
+        self.assertEqual(ItemsSearch.backend(), ItemsSearch.BACKEND_FTS5)
+
+        bike = self._create('Bicicletta da corsa', description='Telaio in carbonio')
+        lamp = self._create('Lampada', description='Perfetta accanto alla bici')
+
+        result = ItemsService.get_items(search='bici')
+        self.assertEqual({item['title'] for item in result['items']}, {'Bicicletta da corsa', 'Lampada'})
+
+        ItemsService.update_item(lamp.id, self.seller_id, title='Lampada', description='Da tavolo')
+        result = ItemsService.get_items(search='bici')
+        self.assertEqual([item['id'] for item in result['items']], [bike.id])
+
+        ItemsService.delete_item(bike.id, self.seller_id)
+        result = ItemsService.get_items(search='bici')
+        self.assertEqual(result['items'], [])
+        print("✅ Test sincronizzazione indice full-text OK")
+
+    def test_04_relevance_ordering(self):
+        """Test: order_by=relevance privilegia le corrispondenze nel titolo"""
+        self._create('Divano', description='Comodo divano, ideale per leggere un libro')
+        self._create('Libro di cucina', description='Ricette regionali')
+
+        response = self.client.get('/api/items?search=libro&order_by=relevance')
+
+        self.assertEqual(response.status_code, 200)
+        titles = [item['title'] for item in response.get_json()['data']]
+        self.assertEqual(titles, ['Libro di cucina', 'Divano'])
+        print("✅ Test ordinamento per rilevanza OK")
+
+    def test_05_constant_queries_per_page(self):
+        """Test: una pagina è servita con un numero costante di query"""
+        def page_queries(items_count):
+            ItemImage.query.delete()
+            ImageBlob.query.delete()
+            Item.query.delete()
+            User.query.filter(User.id != self.seller_id).delete()
+            db.session.commit()
+            for index in range(items_count):
+                seller = User(username=f'seller_{index}', email=f'seller_{index}@test.com',
+                              password_hash='x', first_name='S', last_name=str(index), phone='0')
+                db.session.add(seller)
+                db.session.flush()
+                item = Item(title=f'Item {index}', price=1.0, seller_id=seller.id)
+                blob = ImageBlob(key=f'{index:064x}', extension='jpg', size=100, width=4, height=3, ref_count=1)
+                db.session.add_all([item, blob])
+                db.session.flush()
+                db.session.add(ItemImage(item_id=item.id, blob_id=blob.id, filename=blob.filename, position=0))
+            db.session.commit()
+            db.session.expunge_all()
+
+            with QueryCounter(db.engine) as counter:
+                response = self.client.get(f'/api/items?per_page={items_count}')
+            self.assertEqual(len(response.get_json()['data']), items_count)
+            self.assertTrue(all(item['seller_username'] for item in response.get_json()['data']))
+            self.assertTrue(all(item['images'][0]['width'] == 4 for item in response.get_json()['data']))
+            return counter.count
+
+        self.assertEqual(page_queries(2), page_queries(25))
+        self.assertLessEqual(page_queries(5), 3)  # COUNT + SELECT con JOIN + gallerie
+        print("✅ Test query costanti per pagina OK")
+
+    def test_06_cursor_pagination(self):
+        """Test: la paginazione a cursore attraversa tutti gli items senza duplicati"""
+        created = [self._create(f'Item {index}').id for index in range(7)]
+
+        seen = []
+        response = self.client.get('/api/items?cursor=&per_page=3&include_total=false')
+        while True:
+            body = response.get_json()
+            self.assertIsNone(body['pagination']['total_items'])
+            seen.extend(item['id'] for item in body['data'])
+            if not body['pagination']['has_next']:
+                break
+            response = self.client.get(
+                f"/api/items?cursor={body['pagination']['next_cursor']}&per_page=3&include_total=false"
+            )
+
+        self.assertEqual(seen, sorted(created, reverse=True))
+        self.assertEqual(self.client.get('/api/items?cursor=invalido').status_code, 400)
+        self.assertEqual(self.client.get('/api/items?cursor=&order_by=price').status_code, 400)
+        print("✅ Test paginazione a cursore OK")
+
+    def test_07_antipodal_distance(self):
+        """Test: la distanza SQL tra punti antipodali non supera il dominio di asin"""
+        # Con queste coordinate il termine a calcolato in SQL vale 1.0000000000000002
+        self._create('Antipodi', 2.5, 9.19)
+
+        distance = db.session.query(ItemsService.distance_expression(-2.5, -170.81)).scalar()
+
+        self.assertAlmostEqual(distance,
+                               ItemsService.calculate_distance(2.5, 9.19, -2.5, -170.81),
+                               delta=0.01)
+        print("✅ Test distanza tra punti antipodali OK")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,130 @@
+"""
+Benchmark indici composti sui messaggi
+Confronta piano di esecuzione (EXPLAIN QUERY PLAN) e tempi delle query più
+frequenti su un database SQLite senza gli indici composti (schema precedente)
+e dopo la migrazione che li crea.
+
+Uso:
+    python benchmark_message_indexes.py [numero_messaggi]
+"""
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.1_flask_setup'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+
+from sqlalchemy import and_, or_, text
+
+from app import FlaskApp
+from models import db, User, Message
+from migrations import run_migrations
+
+COMPOSITE_INDEXES = [
+    'ix_messages_receiver_timestamp',
+    'ix_messages_sender_timestamp',
+    'ix_messages_pair_timestamp',
+    'ix_messages_receiver_unread',
+]
+
+USERS = 200
+REPEAT = 50
+
+
+def hot_queries(user_id: int, other_user_id: int) -> dict:
+    """Query usate da MessagesService (unread-count, inbox, thread)"""
+    return {
+        'non letti': Message.query.with_entities(Message.id).filter(
+            Message.receiver_id == user_id, Message.read == False
+        ),
+        'inbox': Message.query.filter(
+            Message.receiver_id == user_id
+        ).order_by(Message.timestamp.desc()).limit(20),
+        'thread': Message.query.filter(
+            or_(
+                and_(Message.sender_id == user_id, Message.receiver_id == other_user_id),
+                and_(Message.sender_id == other_user_id, Message.receiver_id == user_id)
+            )
+        ).order_by(Message.timestamp.asc()).limit(50),
+    }
+
+
+def seed(messages_count: int):
+    """Popola utenti e messaggi casuali"""
+    users = [User(username=f'bench_{i}', email=f'bench_{i}@test.com', password_hash='x',
+                  first_name='Bench', last_name=str(i), phone='0') for i in range(USERS)]
+    db.session.add_all(users)
+    db.session.commit()
+    ids = [user.id for user in users]
+
+    start = datetime.utcnow() - timedelta(days=365)
+    rows = []
+    for index in range(messages_count):
+        sender_id, receiver_id = random.sample(ids, 2)
+        rows.append({
+            'sender_id': sender_id,
+            'receiver_id': receiver_id,
+            'content': f'Messaggio {index}',
+            'timestamp': start + timedelta(seconds=index * 30),
+            'read': random.random() < 0.9
+        })
+    db.session.execute(Message.__table__.insert(), rows)
+    db.session.commit()
+    return ids
+
+
+def report(title: str, queries: dict):
+    """Stampa piano e tempo medio di ogni query"""
+    print(f"\n=== {title} ===")
+    for name, query in queries.items():
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            query.all()
+        elapsed_ms = (time.perf_counter() - started) / REPEAT * 1000
+
+        print(f"\n{name}: {elapsed_ms:.2f} ms")
+        for row in plan:
+            print(f"   {row[-1]}")
+
+
+def main():
+    messages_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    random.seed(42)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(tmp_dir, 'bench.db'))
+        with flask_app.get_app().app_context():
+            # Schema precedente: solo gli indici su singola colonna
+            for name in COMPOSITE_INDEXES:
+                db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            for column in ('sender_id', 'receiver_id'):
+                db.session.execute(text(f'CREATE INDEX ix_messages_{column} ON messages ({column})'))
+            db.session.commit()
+
+            print(f"📦 Inserimento di {messages_count} messaggi...")
+            ids = seed(messages_count)
+            db.session.execute(text('ANALYZE'))
+
+            queries = hot_queries(ids[0], ids[1])
+            report('Senza indici composti', queries)
+
+            applied = run_migrations()
+            db.session.execute(text('ANALYZE'))
+            print(f"\n🔧 Migrazioni applicate: {', '.join(applied)}")
+
+            report('Con indici composti', queries)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Riepilogo denormalizzato delle conversazioni
+Tiene aggiornata la tabella conversations nella stessa transazione dei
+messaggi: lista chat e conteggio non letti leggono una riga per conversazione
+invece di aggregare tutti i messaggi
+"""
+import sys
+import os
+from typing import Tuple
+
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.exc import IntegrityError
+
+# Aggiungi path per import modelli
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+from models import db, Message, Conversation
+
+
+class ConversationSummary:
+    """
+    Aggiornamento incrementale della tabella conversations
+
+    I metodi record_* vanno chiamati dopo il flush del messaggio e prima del
+    commit: i contatori sono incrementati lato SQL, quindi richieste
+    concorrenti non si sovrascrivono a vicenda.
+    """
+
+    @staticmethod
+    def pair(user_id: int, other_user_id: int) -> Tuple[int, int]:
+        """Coppia ordinata (user_a_id, user_b_id) di una conversazione"""
+        return min(user_id, other_user_id), max(user_id, other_user_id)
+
+    @staticmethod
+    def _pair_filter(user_id: int, other_user_id: int):
+        user_a_id, user_b_id = ConversationSummary.pair(user_id, other_user_id)
+        return and_(Conversation.user_a_id == user_a_id, Conversation.user_b_id == user_b_id)
+
+    @staticmethod
+    def _unread_column(receiver_id: int, sender_id: int):
+        """Contatore dei non letti del destinatario"""
+        return Conversation.unread_a if receiver_id < sender_id else Conversation.unread_b
+
+    @staticmethod
+    def _ensure(user_id: int, other_user_id: int):
+        """Crea la riga della conversazione se manca"""
+        pair_filter = ConversationSummary._pair_filter(user_id, other_user_id)
+        if db.session.query(Conversation.id).filter(pair_filter).first() is not None:
+            return
+
+        user_a_id, user_b_id = ConversationSummary.pair(user_id, other_user_id)
+        try:
+            with db.session.begin_nested():
+                db.session.add(Conversation(
+                    user_a_id=user_a_id,
+                    user_b_id=user_b_id,
+                    message_count=0,
+                    unread_a=0,
+                    unread_b=0
+                ))
+        except IntegrityError:
+            pass  # Creata nel frattempo da una richiesta concorrente
+
+    @staticmethod
+    def record_message(message: Message):
+        """
+        Registra un nuovo messaggio: ultimo messaggio, totale e non letti
+
+        Args:
+            message: Messaggio appena inserito (con id e timestamp)
+        """
+        ConversationSummary._ensure(message.sender_id, message.receiver_id)
+
+        unread = ConversationSummary._unread_column(message.receiver_id, message.sender_id)
+        is_latest = or_(
+            Conversation.last_timestamp == None,
+            Conversation.last_timestamp <= message.timestamp
+        )
+
+        Conversation.query.filter(
+            ConversationSummary._pair_filter(message.sender_id, message.receiver_id)
+        ).update({
+            Conversation.last_message_id: case((is_latest, message.id), else_=Conversation.last_message_id),
+            Conversation.last_timestamp: case((is_latest, message.timestamp), else_=Conversation.last_timestamp),
+            Conversation.message_count: Conversation.message_count + 1,
+            unread: unread + (0 if message.read else 1)
+        }, synchronize_session=False)
+
+    @staticmethod
+    def record_read(receiver_id: int, sender_id: int, count: int):
+        """
+        Registra messaggi segnati come letti
+
+        Args:
+            receiver_id: Utente che ha letto i messaggi
+            sender_id: Mittente dei messaggi
+            count: Numero di messaggi passati da non letti a letti
+        """
+        if count <= 0:
+            return
+
+        unread = ConversationSummary._unread_column(receiver_id, sender_id)
+        Conversation.query.filter(
+            ConversationSummary._pair_filter(receiver_id, sender_id)
+        ).update({
+            unread: case((unread > count, unread - count), else_=0)
+        }, synchronize_session=False)
+
+    @staticmethod
+    def record_delete(message: Message):
+        """
+        Registra l'eliminazione di un messaggio (dopo il flush del DELETE)
+
+        Se era l'ultimo messaggio della chat lo sostituisce con il precedente;
+        se la chat resta vuota elimina la conversazione.
+
+        Args:
+            message: Messaggio eliminato
+        """
+        pair_filter = ConversationSummary._pair_filter(message.sender_id, message.receiver_id)
+
+        values = {Conversation.message_count: Conversation.message_count - 1}
+        if not message.read:
+            unread = ConversationSummary._unread_column(message.receiver_id, message.sender_id)
+            values[unread] = case((unread > 0, unread - 1), else_=0)
+        Conversation.query.filter(pair_filter).update(values, synchronize_session=False)
+
+        # Con ON DELETE SET NULL il riferimento può essere già stato azzerato
+        last_message_id = db.session.query(Conversation.last_message_id).filter(pair_filter).scalar()
+        if last_message_id not in (None, message.id):
+            return
+
+        latest = Message.query.filter(
+            or_(
+                and_(Message.sender_id == message.sender_id, Message.receiver_id == message.receiver_id),
+                and_(Message.sender_id == message.receiver_id, Message.receiver_id == message.sender_id)
+            )
+        ).order_by(Message.timestamp.desc(), Message.id.desc()).first()
+
+        if latest is None:
+            Conversation.query.filter(pair_filter).delete(synchronize_session=False)
+        else:
+            Conversation.query.filter(pair_filter).update({
+                Conversation.last_message_id: latest.id,
+                Conversation.last_timestamp: latest.timestamp
+            }, synchronize_session=False)
+
+    @staticmethod
+    def backfill() -> int:
+        """
+        Crea le conversazioni aggregando i messaggi esistenti
+
+        Serve per i database creati prima della tabella conversations: se la
+        tabella contiene già righe non fa nulla. Va chiamata dentro un app
+        context.
+
+        Returns:
+            Numero di conversazioni create
+        """
+        if db.session.query(Conversation.id).first() is not None:
+            return 0
+
+        user_a_id = case((Message.sender_id < Message.receiver_id, Message.sender_id), else_=Message.receiver_id)
+        user_b_id = case((Message.sender_id < Message.receiver_id, Message.receiver_id), else_=Message.sender_id)
+        partition = (user_a_id, user_b_id)
+
+        ranked = db.session.query(
+            Message.id.label('message_id'),
+            Message.timestamp.label('timestamp'),
+            user_a_id.label('user_a_id'),
+            user_b_id.label('user_b_id'),
+            func.row_number().over(
+                partition_by=partition,
+                order_by=(Message.timestamp.desc(), Message.id.desc())
+            ).label('position'),
+            func.count(Message.id).over(partition_by=partition).label('message_count'),
+            func.sum(case(
+                (and_(Message.receiver_id == user_a_id, Message.read == False), 1), else_=0
+            )).over(partition_by=partition).label('unread_a'),
+            func.sum(case(
+                (and_(Message.receiver_id == user_b_id, Message.read == False), 1), else_=0
+            )).over(partition_by=partition).label('unread_b')
+        ).subquery()
+
+        rows = db.session.query(ranked).filter(ranked.c.position == 1).all()
+
+        for row in rows:
+            db.session.add(Conversation(
+                user_a_id=row.user_a_id,
+                user_b_id=row.user_b_id,
+                last_message_id=row.message_id,
+                last_timestamp=row.timestamp,
+                message_count=row.message_count,
+                unread_a=int(row.unread_a or 0),
+                unread_b=int(row.unread_b or 0)
+            ))
+
+        db.session.commit()
+        return len(rows)
@@ -0,0 +1,103 @@
+"""
+Eventi in tempo reale per la chat
+Pub/sub in-process che alimenta lo stream SSE dei messaggi: send_message
+pubblica, ogni connessione aperta riceve gli eventi del proprio utente
+"""
+import json
+import queue
+import threading
+from typing import Dict, Optional, Set
+
+
+class Subscription:
+    """
+    Iscrizione di una connessione agli eventi di un utente
+
+    La coda è limitata: se il client non la svuota abbastanza in fretta
+    l'iscrizione viene marcata overflowed e lo stream va chiuso, il client
+    si riconnette ripartendo dall'ultimo id visto.
+    """
+
+    def __init__(self, user_id: int, max_queue: int):
+        self.user_id = user_id
+        self.events = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        """Prossimo evento, None se non arriva nulla entro timeout"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InProcessBroker:
+    """
+    Broker pub/sub nel processo corrente
+
+    Basta con un solo processo Flask. Con più worker va sostituito (vedi
+    set_broker) da un broker locale con la stessa interfaccia:
+    subscribe, unsubscribe, publish.
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.max_queue)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id: int, event: Dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+
+    def subscriber_count(self, user_id: int) -> int:
+        with self._lock:
+            return len(self._subscriptions.get(user_id, ()))
+
+
+_broker = InProcessBroker()
+
+
+def get_broker():
+    """Broker in uso"""
+    return _broker
+
+
+def set_broker(broker):
+    """Sostituisce il broker (es. uno condiviso tra più processi)"""
+    global _broker
+    _broker = broker
+
+
+def format_sse(event: Dict) -> str:
+    """
+    Serializza un evento nel formato Server-Sent Events
+
+    Solo gli eventi "message" e "resync" hanno un id: è quello che il
+    browser rimanda in Last-Event-ID alla riconnessione.
+    """
+    lines = []
+    if event.get('id') is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'])}")
+    return '\n'.join(lines) + '\n\n'
@@ -2,9 +2,19 @@
 Routes API per gestione Messaggi (chat tra utenti)
 Endpoint per invio, ricezione, conversazioni, notifiche
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from messages_service import MessagesService
+from message_events import get_broker, format_sse
+from keyset_pagination import parse_cursor_args
+
+# Secondi senza eventi dopo cui lo stream invia un commento keep-alive
+STREAM_HEARTBEAT_SECONDS = 15
+# Messaggi letti per query nel recupero dopo una disconnessione
+STREAM_BACKLOG_BATCH = 100
+# Messaggi recuperati al massimo dallo stream: oltre, evento "resync" e il
+# client ricarica dalle API REST
+STREAM_BACKLOG_MAX = 500
 
 # Crea blueprint per le routes messaggi
 messages_bp = Blueprint('messages', __name__, url_prefix='/api/messages')
@@ -101,9 +111,13 @@ def get_inbox():
         - page (int): Numero pagina (default: 1)
         - per_page (int): Messaggi per pagina (default: 20)
         - unread_only (bool): Solo messaggi non letti (default: false)
+        - cursor (str): Paginazione a cursore (vuoto = prima pagina, poi
+          pagination.next_cursor)
+        - include_total (bool): Con cursor, false evita il conteggio totale
     
     Returns:
         200: Lista messaggi ricevuti
+        400: Cursore non valido
         401: Non autenticato
     """
     try:
@@ -113,11 +127,21 @@ def get_inbox():
         per_page = request.args.get('per_page', 20, type=int)
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
         
+        try:
+            cursor, include_total = parse_cursor_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
         result = MessagesService.get_inbox(
             user_id=user_id,
             page=page,
             per_page=per_page,
-            unread_only=unread_only
+            unread_only=unread_only,
+            cursor=cursor,
+            include_total=include_total
         )
         
         return jsonify({
@@ -140,12 +164,14 @@ def get_sent():
     Ottieni messaggi inviati
     
     GET /api/messages/sent?page=1&per_page=20
+    GET /api/messages/sent?cursor=&include_total=false
     Headers: {
         "Authorization": "Bearer <access_token>"
     }
     
     Returns:
         200: Lista messaggi inviati
+        400: Cursore non valido
         401: Non autenticato
     """
     try:
@@ -154,10 +180,20 @@ def get_sent():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         
+        try:
+            cursor, include_total = parse_cursor_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
         result = MessagesService.get_sent_messages(
             user_id=user_id,
             page=page,
-            per_page=per_page
+            per_page=per_page,
+            cursor=cursor,
+            include_total=include_total
         )
         
         return jsonify({
@@ -180,10 +216,15 @@ def get_conversations():
     Ottieni lista conversazioni con ultimo messaggio e non letti
     
     GET /api/messages/conversations
+    GET /api/messages/conversations?page=1&per_page=20
     Headers: {
         "Authorization": "Bearer <access_token>"
     }
     
+    Query Parameters:
+        - page (int): Numero pagina (default: 1)
+        - per_page (int): Conversazioni per pagina (default: tutte)
+    
     Returns:
         200: Lista conversazioni
         401: Non autenticato
@@ -191,12 +232,33 @@ def get_conversations():
     try:
         user_id = int(get_jwt_identity())
         
-        conversations = MessagesService.get_conversations_list(user_id)
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', type=int)
+        
+        conversations = MessagesService.get_conversations_list(user_id, page=page, per_page=per_page)
+        
+        if not per_page:
+            return jsonify({
+                "success": True,
+                "data": conversations,
+                "total": len(conversations)
+            }), 200
+        
+        total = MessagesService.count_conversations(user_id)
+        pages = (total + per_page - 1) // per_page
         
         return jsonify({
             "success": True,
             "data": conversations,
-            "total": len(conversations)
+            "total": total,
+            "pagination": {
+                "page": page,
+                "per_page": per_page,
+                "total": total,
+                "pages": pages,
+                "has_next": page < pages,
+                "has_prev": page > 1
+            }
         }), 200
         
     except Exception as e:
@@ -213,12 +275,14 @@ def get_conversation(other_user_id):
     Ottieni thread conversazione con un utente specifico
     
     GET /api/messages/conversation/5?page=1&per_page=50
+    GET /api/messages/conversation/5?cursor=&include_total=false
     Headers: {
         "Authorization": "Bearer <access_token>"
     }
     
     Returns:
         200: Thread conversazione
+        400: Cursore non valido
         401: Non autenticato
         404: Utente non trovato
     """
@@ -228,11 +292,21 @@ def get_conversation(other_user_id):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 50, type=int)
         
+        try:
+            cursor, include_total = parse_cursor_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
         result = MessagesService.get_conversation(
             user_id=user_id,
             other_user_id=other_user_id,
             page=page,
-            per_page=per_page
+            per_page=per_page,
+            cursor=cursor,
+            include_total=include_total
         )
         
         if 'error' in result:
@@ -415,3 +489,109 @@ def get_unread_count():
             "success": False,
             "message": f"Errore server: {str(e)}"
         }), 500
+
+
+@messages_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_messages():
+    """
+    Stream in tempo reale dei messaggi (Server-Sent Events)
+    
+    Sostituisce il polling di conversation/:id e unread-count: invia un
+    evento "message" per ogni messaggio inviato o ricevuto e un evento
+    "read" quando dei messaggi vengono segnati come letti.
+    
+    GET /api/messages/stream?jwt=<access_token>&last_event_id=120
+    Headers: {
+        "Authorization": "Bearer <access_token>"   (oppure ?jwt=, EventSource
+                                                    non permette header)
+        "Last-Event-ID": "120"                     (inviato dal browser alla
+                                                    riconnessione)
+    }
+    
+    Query Parameters:
+        - last_event_id (int): Ultimo id messaggio visto; i messaggi
+          successivi (al massimo STREAM_BACKLOG_MAX, poi un evento
+          "resync") vengono inviati prima degli eventi in tempo reale
+    
+    Returns:
+        200: text/event-stream
+        400: last_event_id non valido
+        401: Non autenticato
+    """
+    user_id = int(get_jwt_identity())
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return jsonify({
+                "success": False,
+                "message": "last_event_id non valido"
+            }), 400
+    
+    # Iscrizione prima del recupero: nessun messaggio cade tra i due
+    broker = get_broker()
+    subscription = broker.subscribe(user_id)
+    app = current_app._get_current_object()
+    
+    def backlog():
+        """
+        Eventi persi dopo last_event_id, letti a lotti mentre vengono inviati
+        
+        Ogni lotto usa un proprio app context: la connessione al database
+        non resta occupata per tutta la durata dello stream.
+        """
+        last_id = last_event_id
+        sent = 0
+        while sent < STREAM_BACKLOG_MAX:
+            with app.app_context():
+                batch = [MessagesService.serialize_event_message(msg)
+                         for msg in MessagesService.get_messages_since(user_id, last_id, STREAM_BACKLOG_BATCH)]
+            for data in batch:
+                yield {'type': 'message', 'id': data['id'], 'data': data}
+            if len(batch) < STREAM_BACKLOG_BATCH:
+                return
+            sent += len(batch)
+            last_id = batch[-1]['id']
+        
+        # Troppi messaggi persi: il client ricarica dalle API REST e lo
+        # stream riparte dall'ultimo messaggio (id = nuovo Last-Event-ID)
+        with app.app_context():
+            latest_id = MessagesService.get_latest_message_id(user_id)
+        if latest_id is not None and latest_id > last_id:
+            yield {'type': 'resync', 'id': latest_id, 'data': {
+                'last_event_id': latest_id,
+                'inbox': '/api/messages/inbox',
+                'conversations': '/api/messages/conversations'
+            }}
+    
+    def generate():
+        last_sent = last_event_id or 0
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id is not None:
+                for event in backlog():
+                    last_sent = event['id']
+                    yield format_sse(event)
+            
+            while not subscription.overflowed:
+                event = subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.get('id') is not None:
+                    # Già inviato dal recupero (o da ricaricare dopo "resync")
+                    if event['id'] <= last_sent:
+                        continue
+                    last_sent = event['id']
+                yield format_sse(event)
+            # Coda piena: il client si riconnette con Last-Event-ID
+        finally:
+            broker.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
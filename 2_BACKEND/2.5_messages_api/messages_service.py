@@ -6,11 +6,15 @@ import sys
 import os
 from datetime import datetime
 from typing import List, Optional, Tuple, Dict
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, case, func
+from sqlalchemy.orm import joinedload
 
 # Aggiungi path per import modelli
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
-from models import db, Message, User
+from models import db, Message, User, Conversation
+from keyset_pagination import paginate_keyset
+from conversation_summary import ConversationSummary
+from message_events import get_broker
 
 
 class MessagesService:
@@ -35,6 +39,51 @@ class MessagesService:
         
         return True, ""
     
+    @staticmethod
+    def _paginate(query, page: int, per_page: int, cursor: Optional[str],
+                  include_total: bool, descending: bool = True) -> Tuple[list, Dict]:
+        """
+        Pagina una query sui messaggi ordinata per timestamp
+        
+        Args:
+            query: Query su Message senza ordinamento
+            page: Numero pagina (paginazione classica)
+            per_page: Messaggi per pagina
+            cursor: Cursore keyset su (timestamp, id); None = paginazione classica
+            include_total: Con cursore, se False salta il COUNT(*)
+            descending: True per i più recenti prima
+            
+        Returns:
+            (messaggi, dati di paginazione)
+        """
+        if cursor is not None:
+            keyset = paginate_keyset(
+                query, Message.timestamp, Message.id,
+                key=lambda msg: (msg.timestamp, msg.id),
+                cursor=cursor or None,
+                per_page=per_page,
+                descending=descending,
+                include_total=include_total
+            )
+            return keyset['items'], {
+                'per_page': per_page,
+                'next_cursor': keyset['next_cursor'],
+                'has_next': keyset['has_next'],
+                'total': keyset['total']
+            }
+        
+        order = Message.timestamp.desc() if descending else Message.timestamp.asc()
+        pagination = query.order_by(order).paginate(page=page, per_page=per_page, error_out=False)
+        
+        return pagination.items, {
+            'page': page,
+            'per_page': per_page,
+            'total': pagination.total,
+            'pages': pagination.pages,
+            'has_next': pagination.has_next,
+            'has_prev': pagination.has_prev
+        }
+    
     @staticmethod
     def send_message(sender_id: int, receiver_id: int, content: str) -> Tuple[bool, str, Optional[Message]]:
         """
@@ -76,14 +125,109 @@ class MessagesService:
             )
             
             db.session.add(new_message)
+            db.session.flush()
+            
+            # Riepilogo conversazione nella stessa transazione
+            ConversationSummary.record_message(new_message)
             db.session.commit()
             
+            MessagesService.publish_message(new_message)
             return True, "Messaggio inviato con successo", new_message
             
         except Exception as e:
             db.session.rollback()
             return False, f"Errore durante l'invio: {str(e)}", None
     
+    @staticmethod
+    def serialize_event_message(message: Message) -> Dict:
+        """Dati di un messaggio negli eventi dello stream"""
+        return {
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'receiver_id': message.receiver_id,
+            'content': message.content,
+            'timestamp': message.timestamp.isoformat(),
+            'read': message.read
+        }
+    
+    @staticmethod
+    def publish_message(message: Message):
+        """
+        Notifica un nuovo messaggio a destinatario e mittente (altre schede)
+        
+        Va chiamato dopo il commit: chi riceve l'evento deve poter già
+        rileggere il messaggio dal database.
+        """
+        event = {
+            'type': 'message',
+            'id': message.id,
+            'data': MessagesService.serialize_event_message(message)
+        }
+        broker = get_broker()
+        broker.publish(message.receiver_id, event)
+        broker.publish(message.sender_id, event)
+    
+    @staticmethod
+    def publish_read(reader_id: int, sender_id: int, count: int, message_id: Optional[int] = None):
+        """
+        Notifica messaggi segnati come letti: il lettore aggiorna il badge
+        dei non letti, il mittente le conferme di lettura
+        
+        Args:
+            reader_id: Utente che ha letto (destinatario dei messaggi)
+            sender_id: Mittente dei messaggi letti
+            count: Messaggi segnati come letti
+            message_id: Singolo messaggio letto (None = tutta la conversazione)
+        """
+        event = {
+            'type': 'read',
+            'data': {
+                'reader_id': reader_id,
+                'sender_id': sender_id,
+                'message_id': message_id,
+                'count': count
+            }
+        }
+        broker = get_broker()
+        broker.publish(reader_id, event)
+        broker.publish(sender_id, event)
+    
+    @staticmethod
+    def get_messages_since(user_id: int, last_id: int, limit: int = 100) -> List[Message]:
+        """
+        Messaggi inviati o ricevuti dall'utente dopo last_id
+        
+        Usato dallo stream per recuperare quanto perso durante una
+        disconnessione (gli id crescono con l'ordine di inserimento).
+        
+        Args:
+            user_id: ID utente
+            last_id: Ultimo id già ricevuto dal client
+            limit: Massimo numero di messaggi
+            
+        Returns:
+            Lista messaggi in ordine di id
+        """
+        return Message.query.filter(
+            or_(Message.receiver_id == user_id, Message.sender_id == user_id),
+            Message.id > last_id
+        ).order_by(Message.id.asc()).limit(limit).all()
+    
+    @staticmethod
+    def get_latest_message_id(user_id: int) -> Optional[int]:
+        """
+        Id dell'ultimo messaggio inviato o ricevuto dall'utente
+        
+        Args:
+            user_id: ID utente
+            
+        Returns:
+            int o None se l'utente non ha messaggi
+        """
+        return db.session.query(func.max(Message.id)).filter(
+            or_(Message.receiver_id == user_id, Message.sender_id == user_id)
+        ).scalar()
+    
     @staticmethod
     def get_message_by_id(message_id: int) -> Optional[Message]:
         """
@@ -123,8 +267,17 @@ class MessagesService:
             return True, "Messaggio già letto"
         
         try:
-            message.read = True
+            # Solo se ancora non letto: due richieste concorrenti non scalano due volte
+            updated = Message.query.filter(
+                Message.id == message_id,
+                Message.read == False
+            ).update({Message.read: True})
+            
+            ConversationSummary.record_read(user_id, message.sender_id, updated)
             db.session.commit()
+            
+            if updated:
+                MessagesService.publish_read(user_id, message.sender_id, updated, message_id)
             return True, "Messaggio segnato come letto"
             
         except Exception as e:
@@ -144,25 +297,25 @@ class MessagesService:
             (success, message, count_marked)
         """
         try:
-            # Trova tutti i messaggi non letti ricevuti dall'altro utente
-            unread_messages = Message.query.filter(
+            # Un solo UPDATE per tutti i non letti ricevuti dall'altro utente,
+            # senza caricare i messaggi
+            count = Message.query.filter(
                 and_(
                     Message.receiver_id == user_id,
                     Message.sender_id == other_user_id,
                     Message.read == False
                 )
-            ).all()
-            
-            count = len(unread_messages)
+            ).update({Message.read: True})
             
             if count == 0:
+                db.session.rollback()
                 return True, "Nessun messaggio da segnare come letto", 0
             
-            # Segna tutti come letti
-            for msg in unread_messages:
-                msg.read = True
-            
+            # Scala i non letti della conversazione di quanti ne ha aggiornati l'UPDATE
+            ConversationSummary.record_read(user_id, other_user_id, count)
             db.session.commit()
+            
+            MessagesService.publish_read(user_id, other_user_id, count)
             return True, f"{count} messaggi segnati come letti", count
             
         except Exception as e:
@@ -192,6 +345,9 @@ class MessagesService:
         
         try:
             db.session.delete(message)
+            db.session.flush()
+            
+            ConversationSummary.record_delete(message)
             db.session.commit()
             return True, "Messaggio eliminato con successo"
             
@@ -201,7 +357,8 @@ class MessagesService:
     
     @staticmethod
     def get_inbox(user_id: int, page: int = 1, per_page: int = 20, 
-                 unread_only: bool = False) -> Dict:
+                 unread_only: bool = False, cursor: str = None,
+                 include_total: bool = True) -> Dict:
         """
         Ottieni inbox messaggi ricevuti
         
@@ -210,18 +367,19 @@ class MessagesService:
             page: Numero pagina
             per_page: Messaggi per pagina
             unread_only: Se True, mostra solo non letti
+            cursor: Cursore keyset (timestamp, id); se non None ("" = prima
+                    pagina) sostituisce page
+            include_total: Con cursore, se False salta il COUNT(*)
             
         Returns:
             Dict con messaggi e paginazione
         """
-        query = Message.query.filter(Message.receiver_id == user_id)
+        query = Message.query.options(joinedload(Message.sender)).filter(Message.receiver_id == user_id)
         
         if unread_only:
             query = query.filter(Message.read == False)
         
-        query = query.order_by(Message.timestamp.desc())
-        
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        rows, pagination = MessagesService._paginate(query, page, per_page, cursor, include_total)
         
         messages = [{
             'id': msg.id,
@@ -230,22 +388,16 @@ class MessagesService:
             'content': msg.content,
             'timestamp': msg.timestamp.isoformat(),
             'read': msg.read
-        } for msg in pagination.items]
+        } for msg in rows]
         
         return {
             'messages': messages,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination
         }
     
     @staticmethod
-    def get_sent_messages(user_id: int, page: int = 1, per_page: int = 20) -> Dict:
+    def get_sent_messages(user_id: int, page: int = 1, per_page: int = 20,
+                          cursor: str = None, include_total: bool = True) -> Dict:
         """
         Ottieni messaggi inviati
         
@@ -253,14 +405,15 @@ class MessagesService:
             user_id: ID utente
             page: Numero pagina
             per_page: Messaggi per pagina
+            cursor: Cursore keyset (timestamp, id); se non None sostituisce page
+            include_total: Con cursore, se False salta il COUNT(*)
             
         Returns:
             Dict con messaggi e paginazione
         """
-        query = Message.query.filter(Message.sender_id == user_id)
-        query = query.order_by(Message.timestamp.desc())
+        query = Message.query.options(joinedload(Message.receiver)).filter(Message.sender_id == user_id)
         
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        rows, pagination = MessagesService._paginate(query, page, per_page, cursor, include_total)
         
         messages = [{
             'id': msg.id,
@@ -269,23 +422,17 @@ class MessagesService:
             'content': msg.content,
             'timestamp': msg.timestamp.isoformat(),
             'read': msg.read
-        } for msg in pagination.items]
+        } for msg in rows]
         
         return {
             'messages': messages,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination
         }
     
     @staticmethod
     def get_conversation(user_id: int, other_user_id: int, 
-                        page: int = 1, per_page: int = 50) -> Dict:
+                        page: int = 1, per_page: int = 50,
+                        cursor: str = None, include_total: bool = True) -> Dict:
         """
         Ottieni thread conversazione tra due utenti
         
@@ -294,6 +441,9 @@ class MessagesService:
             other_user_id: ID altro utente
             page: Numero pagina
             per_page: Messaggi per pagina
+            cursor: Cursore keyset (timestamp, id) in ordine cronologico;
+                    se non None sostituisce page
+            include_total: Con cursore, se False salta il COUNT(*)
             
         Returns:
             Dict con messaggi della conversazione
@@ -320,9 +470,12 @@ class MessagesService:
                 and_(Message.sender_id == user_id, Message.receiver_id == other_user_id),
                 and_(Message.sender_id == other_user_id, Message.receiver_id == user_id)
             )
-        ).order_by(Message.timestamp.asc())  # Ordine cronologico
+        )
         
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Ordine cronologico
+        rows, pagination = MessagesService._paginate(
+            query, page, per_page, cursor, include_total, descending=False
+        )
         
         messages = [{
             'id': msg.id,
@@ -332,7 +485,7 @@ class MessagesService:
             'timestamp': msg.timestamp.isoformat(),
             'read': msg.read,
             'is_mine': msg.sender_id == user_id  # Helper per frontend
-        } for msg in pagination.items]
+        } for msg in rows]
         
         return {
             'messages': messages,
@@ -341,98 +494,113 @@ class MessagesService:
                 'username': other_user.username,
                 'email': other_user.email
             },
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            }
+            'pagination': pagination
         }
     
     @staticmethod
-    def get_conversations_list(user_id: int) -> List[Dict]:
+    def get_conversations_list(user_id: int, page: int = 1, per_page: Optional[int] = None) -> List[Dict]:
         """
         Ottieni lista di tutte le conversazioni dell'utente
         Con ultimo messaggio e conteggio non letti
         
+        Legge la tabella conversations (una riga per chat) con ultimo
+        messaggio e interlocutore in JOIN: una sola query.
+        
         Args:
             user_id: ID utente
+            page: Numero pagina (usato solo con per_page)
+            per_page: Conversazioni per pagina (None = tutte)
             
         Returns:
-            Lista conversazioni con metadati
+            Lista conversazioni con metadati, più recenti prima
         """
-        # Ottieni tutti i messaggi dell'utente (inviati e ricevuti)
-        messages = Message.query.filter(
+        other_user_id = case(
+            (Conversation.user_a_id == user_id, Conversation.user_b_id),
+            else_=Conversation.user_a_id
+        )
+        unread_count = case(
+            (Conversation.user_a_id == user_id, Conversation.unread_a),
+            else_=Conversation.unread_b
+        )
+        
+        query = db.session.query(
+            other_user_id.label('other_user_id'),
+            Conversation.message_count,
+            unread_count.label('unread_count'),
+            func.substr(Message.content, 1, 100).label('preview'),  # Preview
+            Message.timestamp,
+            Message.sender_id,
+            User.username,
+            User.email
+        ).select_from(Conversation).join(
+            Message, Message.id == Conversation.last_message_id
+        ).join(
+            User, User.id == other_user_id
+        ).filter(
             or_(
-                Message.sender_id == user_id,
-                Message.receiver_id == user_id
+                Conversation.user_a_id == user_id,
+                Conversation.user_b_id == user_id
             )
-        ).order_by(Message.timestamp.desc()).all()
+        ).order_by(
+            Conversation.last_timestamp.desc(), Conversation.id.desc()
+        )
         
-        # Raggruppa per conversazione (altro utente)
-        conversations = {}
+        if per_page:
+            query = query.limit(per_page).offset((max(page, 1) - 1) * per_page)
         
-        for msg in messages:
-            # Determina l'altro utente
-            other_user_id = msg.receiver_id if msg.sender_id == user_id else msg.sender_id
-            
-            if other_user_id not in conversations:
-                conversations[other_user_id] = {
-                    'other_user_id': other_user_id,
-                    'other_user': None,  # Sarà popolato dopo
-                    'last_message': None,
-                    'last_message_timestamp': None,
-                    'unread_count': 0,
-                    'total_messages': 0
-                }
-            
-            conv = conversations[other_user_id]
-            conv['total_messages'] += 1
-            
-            # Ultimo messaggio (più recente)
-            if conv['last_message'] is None:
-                conv['last_message'] = msg.content[:100]  # Preview
-                conv['last_message_timestamp'] = msg.timestamp
-                conv['last_message_sender'] = 'me' if msg.sender_id == user_id else 'them'
+        return [{
+            'other_user_id': row.other_user_id,
+            'other_user': {
+                'id': row.other_user_id,
+                'username': row.username,
+                'email': row.email
+            },
+            'last_message': row.preview,
+            'last_message_timestamp': row.timestamp.isoformat(),
+            'last_message_sender': 'me' if row.sender_id == user_id else 'them',
+            'unread_count': row.unread_count,
+            'total_messages': row.message_count
+        } for row in query.all()]
+    
+    @staticmethod
+    def count_conversations(user_id: int) -> int:
+        """
+        Conta gli interlocutori con cui l'utente ha almeno un messaggio
+        
+        Args:
+            user_id: ID utente
             
-            # Conta non letti (solo messaggi ricevuti)
-            if msg.receiver_id == user_id and not msg.read:
-                conv['unread_count'] += 1
-        
-        # Aggiungi info altri utenti
-        result = []
-        for other_user_id, conv in conversations.items():
-            other_user = User.query.get(other_user_id)
-            if other_user:
-                conv['other_user'] = {
-                    'id': other_user.id,
-                    'username': other_user.username,
-                    'email': other_user.email
-                }
-                conv['last_message_timestamp'] = conv['last_message_timestamp'].isoformat()
-                result.append(conv)
-        
-        # Ordina per timestamp ultimo messaggio (più recenti prima)
-        result.sort(key=lambda x: x['last_message_timestamp'], reverse=True)
-        
-        return result
+        Returns:
+            Numero di conversazioni
+        """
+        return Conversation.query.filter(
+            or_(
+                Conversation.user_a_id == user_id,
+                Conversation.user_b_id == user_id
+            )
+        ).count()
     
     @staticmethod
     def get_unread_count(user_id: int) -> int:
         """
         Conta messaggi non letti totali
         
+        Somma i contatori delle conversazioni dell'utente.
+        
         Args:
             user_id: ID utente
             
         Returns:
             Numero messaggi non letti
         """
-        return Message.query.filter(
-            and_(
-                Message.receiver_id == user_id,
-                Message.read == False
+        unread_count = case(
+            (Conversation.user_a_id == user_id, Conversation.unread_a),
+            else_=Conversation.unread_b
+        )
+        total = db.session.query(func.sum(unread_count)).filter(
+            or_(
+                Conversation.user_a_id == user_id,
+                Conversation.user_b_id == user_id
             )
-        ).count()
+        ).scalar()
+        return int(total or 0)
@@ -0,0 +1,285 @@
+"""
+Test per le query dei Messaggi
+Verifica paginazione, conversazioni e contatori non letti
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.1_flask_setup'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.5_messages_api'))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import inspect, text
+from app import FlaskApp
+from models import db, User, Message, Conversation
+from migrations import run_migrations
+from query_counter import QueryCounter
+from messages_service import MessagesService
+from conversation_summary import ConversationSummary
+from message_events import get_broker
+import messages_routes
+
+
+class TestMessagesQueries(unittest.TestCase):
+    """Test per MessagesService"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(cls.tmp_dir, 'test.db'))
+        cls.app = cls.flask_app.get_app()
+        cls.client = cls.app.test_client()
+
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+        users = []
+        for name in ('alice', 'bob', 'carol'):
+            user = User(username=name, email=f'{name}@test.com', password_hash='x',
+                        first_name=name.title(), last_name='Test', phone='000')
+            db.session.add(user)
+            users.append(user)
+        db.session.commit()
+        cls.alice_id, cls.bob_id, cls.carol_id = [user.id for user in users]
+        cls.alice_headers = {'Authorization': f'Bearer {create_access_token(identity=str(cls.alice_id))}'}
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        db.session.remove()
+        db.drop_all()
+        cls.app_context.pop()
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup prima di ogni test"""
+        Conversation.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+    def _send(self, sender_id, receiver_id, content):
+        success, message, msg = MessagesService.send_message(sender_id, receiver_id, content)
+        self.assertTrue(success, message)
+        return msg
+
+    def test_01_cursor_pagination_inbox(self):
+        """Test: l'inbox a cursore restituisce tutti i messaggi, più recenti prima"""
+        sent = [self._send(self.bob_id, self.alice_id, f'Messaggio {index}').id for index in range(5)]
+
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            result = MessagesService.get_inbox(self.alice_id, per_page=2, cursor=cursor,
+                                               include_total=False)
+            self.assertIsNone(result['pagination']['total'])
+            seen.extend(msg['id'] for msg in result['messages'])
+            cursor = result['pagination']['next_cursor']
+
+        self.assertEqual(seen, sorted(sent, reverse=True))
+        print("✅ Test inbox a cursore OK")
+
+    def test_02_cursor_pagination_conversation(self):
+        """Test: la conversazione a cursore è in ordine cronologico"""
+        sent = [
+            self._send(self.alice_id, self.bob_id, 'Ciao').id,
+            self._send(self.bob_id, self.alice_id, 'Ciao Alice').id,
+            self._send(self.alice_id, self.bob_id, 'È disponibile?').id,
+        ]
+
+        response = self.client.get(f'/api/messages/conversation/{self.bob_id}?cursor=&per_page=2',
+                                    headers=self.alice_headers)
+        first = response.get_json()
+        response = self.client.get(
+            f"/api/messages/conversation/{self.bob_id}?cursor={first['pagination']['next_cursor']}&per_page=2",
+            headers=self.alice_headers
+        )
+        second = response.get_json()
+
+        self.assertEqual(first['pagination']['total'], 3)
+        self.assertEqual([msg['id'] for msg in first['data'] + second['data']], sent)
+        self.assertFalse(second['pagination']['has_next'])
+        print("✅ Test conversazione a cursore OK")
+
+    def test_03_conversations_list_single_query(self):
+        """Test: la lista conversazioni è calcolata con una sola query"""
+        self._send(self.bob_id, self.alice_id, 'Primo da Bob')
+        self._send(self.alice_id, self.bob_id, 'Risposta a Bob')
+        self._send(self.bob_id, self.alice_id, 'Ultimo da Bob')
+        self._send(self.carol_id, self.alice_id, 'x' * 150)
+        db.session.expunge_all()
+
+        with QueryCounter(db.engine) as counter:
+            conversations = MessagesService.get_conversations_list(self.alice_id)
+        self.assertEqual(counter.count, 1)
+
+        carol, bob = conversations
+        self.assertEqual(carol['other_user']['username'], 'carol')
+        self.assertEqual(len(carol['last_message']), 100)
+        self.assertEqual(bob['last_message'], 'Ultimo da Bob')
+        self.assertEqual(bob['last_message_sender'], 'them')
+        self.assertEqual((bob['total_messages'], bob['unread_count']), (3, 2))
+
+        response = self.client.get('/api/messages/conversations?page=2&per_page=1',
+                                   headers=self.alice_headers)
+        body = response.get_json()
+        self.assertEqual([c['other_user_id'] for c in body['data']], [self.bob_id])
+        self.assertEqual(body['pagination']['total'], 2)
+        self.assertFalse(body['pagination']['has_next'])
+        print("✅ Test lista conversazioni aggregata OK")
+
+    def _summary(self, user_id, other_user_id):
+        user_a_id, user_b_id = ConversationSummary.pair(user_id, other_user_id)
+        db.session.expire_all()
+        return Conversation.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).first()
+
+    def test_04_conversation_counters_follow_messages(self):
+        """Test: invio, lettura ed eliminazione aggiornano il riepilogo conversazione"""
+        first = self._send(self.bob_id, self.alice_id, 'Primo')
+        second = self._send(self.bob_id, self.alice_id, 'Secondo')
+        self._send(self.alice_id, self.bob_id, 'Risposta')
+        self._send(self.carol_id, self.alice_id, 'Ciao da Carol')
+
+        summary = self._summary(self.alice_id, self.bob_id)
+        self.assertEqual(summary.message_count, 3)
+        self.assertEqual(MessagesService.get_unread_count(self.alice_id), 3)
+        self.assertEqual(MessagesService.get_unread_count(self.bob_id), 1)
+
+        MessagesService.mark_as_read(first.id, self.alice_id)
+        MessagesService.mark_as_read(first.id, self.alice_id)
+        self.assertEqual(MessagesService.get_unread_count(self.alice_id), 2)
+
+        reply_id = self._summary(self.alice_id, self.bob_id).last_message_id
+        MessagesService.delete_message(reply_id, self.alice_id)
+        summary = self._summary(self.alice_id, self.bob_id)
+        self.assertEqual((summary.message_count, summary.last_message_id), (2, second.id))
+        self.assertEqual(MessagesService.get_unread_count(self.bob_id), 0)
+
+        MessagesService.mark_conversation_as_read(self.alice_id, self.bob_id)
+        self.assertEqual(MessagesService.get_unread_count(self.alice_id), 1)
+
+        MessagesService.delete_message(first.id, self.bob_id)
+        MessagesService.delete_message(second.id, self.bob_id)
+        self.assertIsNone(self._summary(self.alice_id, self.bob_id))
+        self.assertEqual(MessagesService.count_conversations(self.alice_id), 1)
+        print("✅ Test contatori conversazione OK")
+
+    def test_05_conversation_backfill(self):
+        """Test: il backfill ricostruisce le conversazioni dai messaggi esistenti"""
+        self._send(self.bob_id, self.alice_id, 'Primo')
+        self._send(self.alice_id, self.bob_id, 'Risposta')
+        self._send(self.carol_id, self.bob_id, 'Ciao Bob')
+        expected = MessagesService.get_conversations_list(self.bob_id)
+
+        Conversation.query.delete()
+        db.session.commit()
+
+        self.assertEqual(ConversationSummary.backfill(), 2)
+        self.assertEqual(ConversationSummary.backfill(), 0)
+        self.assertEqual(MessagesService.get_conversations_list(self.bob_id), expected)
+        self.assertEqual(MessagesService.get_unread_count(self.bob_id), 2)
+        print("✅ Test backfill conversazioni OK")
+
+    def test_06_mark_conversation_as_read_bulk(self):
+        """Test: segnare una chat come letta esegue un solo UPDATE"""
+        for index in range(30):
+            self._send(self.bob_id, self.alice_id, f'Messaggio {index}')
+        self._send(self.carol_id, self.alice_id, 'Non toccare')
+        db.session.expunge_all()
+
+        with QueryCounter(db.engine) as counter:
+            success, _, count = MessagesService.mark_conversation_as_read(self.alice_id, self.bob_id)
+        updates = [sql for sql in counter.statements if sql.lstrip().upper().startswith('UPDATE MESSAGES')]
+
+        self.assertTrue(success)
+        self.assertEqual(count, 30)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(MessagesService.get_unread_count(self.alice_id), 1)
+        self.assertEqual(MessagesService.mark_conversation_as_read(self.alice_id, self.bob_id)[2], 0)
+        print("✅ Test lettura conversazione in blocco OK")
+
+    def test_07_stream_push_and_resume(self):
+        """Test: lo stream recupera dopo last_event_id e riceve i nuovi messaggi"""
+        seen = self._send(self.bob_id, self.alice_id, 'Già visto')
+        missed = self._send(self.bob_id, self.alice_id, 'Perso durante la disconnessione')
+        self._send(self.bob_id, self.carol_id, 'Non per Alice')
+
+        token = create_access_token(identity=str(self.alice_id))
+        response = self.client.get(f'/api/messages/stream?jwt={token}',
+                                   headers={'Last-Event-ID': str(seen.id)}, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        self.assertIn(f'id: {missed.id}\nevent: message\n'.encode(), next(chunks))
+
+        live = self._send(self.bob_id, self.alice_id, 'In tempo reale')
+        self.assertIn(f'id: {live.id}\n'.encode(), next(chunks))
+
+        MessagesService.mark_conversation_as_read(self.alice_id, self.bob_id)
+        self.assertIn(b'event: read\n', next(chunks))
+
+        response.close()
+        self.assertEqual(get_broker().subscriber_count(self.alice_id), 0)
+        print("✅ Test stream messaggi OK")
+
+    def test_08_stream_rejects_bad_last_event_id(self):
+        """Test: last_event_id non numerico restituisce 400"""
+        response = self.client.get('/api/messages/stream?last_event_id=abc',
+                                   headers=self.alice_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(get_broker().subscriber_count(self.alice_id), 0)
+        print("✅ Test stream last_event_id non valido OK")
+
+
+    def test_09_stream_backlog_capped(self):
+        """Test: il recupero si ferma a STREAM_BACKLOG_MAX con un evento resync"""
+        sent = [self._send(self.bob_id, self.alice_id, f'Perso {index}').id for index in range(7)]
+
+        token = create_access_token(identity=str(self.alice_id))
+        with mock.patch.object(messages_routes, 'STREAM_BACKLOG_BATCH', 2), \
+                mock.patch.object(messages_routes, 'STREAM_BACKLOG_MAX', 4):
+            response = self.client.get(f'/api/messages/stream?jwt={token}&last_event_id=0',
+                                       buffered=False)
+            chunks = iter(response.response)
+            self.assertTrue(next(chunks).startswith(b'retry:'))
+            for message_id in sent[:4]:
+                self.assertIn(f'id: {message_id}\nevent: message\n'.encode(), next(chunks))
+
+            resync = next(chunks)
+            self.assertIn(f'id: {sent[-1]}\nevent: resync\n'.encode(), resync)
+            self.assertIn(b'/api/messages/inbox', resync)
+
+            live = self._send(self.bob_id, self.alice_id, 'Dopo il resync')
+            self.assertIn(f'id: {live.id}\nevent: message\n'.encode(), next(chunks))
+            response.close()
+
+        self.assertEqual(get_broker().subscriber_count(self.alice_id), 0)
+        print("✅ Test recupero stream limitato OK")
+    def test_10_single_column_indexes_dropped(self):
+        """Test: la migrazione elimina gli indici su singola colonna coperti dai composti"""
+        for column in ('sender_id', 'receiver_id'):
+            db.session.execute(text(f'CREATE INDEX ix_messages_{column} ON messages ({column})'))
+        db.session.commit()
+
+        applied = run_migrations()
+
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('messages')}
+        self.assertIn('-ix_messages_sender_id', applied)
+        self.assertNotIn('ix_messages_sender_id', indexes)
+        self.assertNotIn('ix_messages_receiver_id', indexes)
+        self.assertIn('ix_messages_sender_timestamp', indexes)
+        self.assertIn('ix_messages_receiver_timestamp', indexes)
+        self.assertEqual(run_migrations(), [])
+        print("✅ Test indici su singola colonna eliminati OK")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
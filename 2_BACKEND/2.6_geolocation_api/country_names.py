@@ -0,0 +1,260 @@
+"""
+2.6 - Country Names
+Nomi delle nazioni per codice ISO 3166-1 alpha-2 (inglese, come in GeoNames
+countryInfo, e italiano), usati dal geocoder offline
+"""
+
+
+COUNTRY_NAMES = {
+    'AD': ['Andorra'],
+    'AE': ['United Arab Emirates', 'Emirati Arabi Uniti', 'UAE'],
+    'AF': ['Afghanistan'],
+    'AG': ['Antigua and Barbuda', 'Antigua e Barbuda'],
+    'AI': ['Anguilla'],
+    'AL': ['Albania'],
+    'AM': ['Armenia'],
+    'AO': ['Angola'],
+    'AQ': ['Antarctica', 'Antartide'],
+    'AR': ['Argentina'],
+    'AS': ['American Samoa', 'Samoa Americane'],
+    'AT': ['Austria'],
+    'AU': ['Australia'],
+    'AW': ['Aruba'],
+    'AX': ['Aland Islands', 'Isole Aland'],
+    'AZ': ['Azerbaijan', 'Azerbaigian'],
+    'BA': ['Bosnia and Herzegovina', 'Bosnia ed Erzegovina', 'Bosnia'],
+    'BB': ['Barbados'],
+    'BD': ['Bangladesh'],
+    'BE': ['Belgium', 'Belgio'],
+    'BF': ['Burkina Faso'],
+    'BG': ['Bulgaria'],
+    'BH': ['Bahrain'],
+    'BI': ['Burundi'],
+    'BJ': ['Benin'],
+    'BL': ['Saint Barthelemy', 'Saint-Barthelemy'],
+    'BM': ['Bermuda'],
+    'BN': ['Brunei'],
+    'BO': ['Bolivia'],
+    'BQ': ['Caribbean Netherlands', 'Paesi Bassi caraibici'],
+    'BR': ['Brazil', 'Brasile'],
+    'BS': ['Bahamas'],
+    'BT': ['Bhutan'],
+    'BV': ['Bouvet Island', 'Isola Bouvet'],
+    'BW': ['Botswana'],
+    'BY': ['Belarus', 'Bielorussia'],
+    'BZ': ['Belize'],
+    'CA': ['Canada'],
+    'CC': ['Cocos Islands', 'Isole Cocos'],
+    'CD': ['Democratic Republic of the Congo', 'DR Congo', 'Repubblica Democratica del Congo'],
+    'CF': ['Central African Republic', 'Repubblica Centrafricana'],
+    'CG': ['Republic of the Congo', 'Congo', 'Repubblica del Congo'],
+    'CH': ['Switzerland', 'Svizzera'],
+    'CI': ['Ivory Coast', "Cote d'Ivoire", "Costa d'Avorio"],
+    'CK': ['Cook Islands', 'Isole Cook'],
+    'CL': ['Chile', 'Cile'],
+    'CM': ['Cameroon', 'Camerun'],
+    'CN': ['China', 'Cina'],
+    'CO': ['Colombia'],
+    'CR': ['Costa Rica'],
+    'CU': ['Cuba'],
+    'CV': ['Cabo Verde', 'Cape Verde', 'Capo Verde'],
+    'CW': ['Curacao'],
+    'CX': ['Christmas Island', 'Isola di Natale'],
+    'CY': ['Cyprus', 'Cipro'],
+    'CZ': ['Czechia', 'Czech Republic', 'Repubblica Ceca', 'Cechia'],
+    'DE': ['Germany', 'Germania'],
+    'DJ': ['Djibouti', 'Gibuti'],
+    'DK': ['Denmark', 'Danimarca'],
+    'DM': ['Dominica'],
+    'DO': ['Dominican Republic', 'Repubblica Dominicana'],
+    'DZ': ['Algeria'],
+    'EC': ['Ecuador'],
+    'EE': ['Estonia'],
+    'EG': ['Egypt', 'Egitto'],
+    'EH': ['Western Sahara', 'Sahara Occidentale'],
+    'ER': ['Eritrea'],
+    'ES': ['Spain', 'Spagna'],
+    'ET': ['Ethiopia', 'Etiopia'],
+    'FI': ['Finland', 'Finlandia'],
+    'FJ': ['Fiji', 'Figi'],
+    'FK': ['Falkland Islands', 'Isole Falkland'],
+    'FM': ['Micronesia'],
+    'FO': ['Faroe Islands', 'Isole Faroe', 'Isole Far Oer'],
+    'FR': ['France', 'Francia'],
+    'GA': ['Gabon'],
+    'GB': ['United Kingdom', 'Great Britain', 'UK', 'Regno Unito', 'Gran Bretagna', 'England', 'Inghilterra'],
+    'GD': ['Grenada'],
+    'GE': ['Georgia'],
+    'GF': ['French Guiana', 'Guyana francese'],
+    'GG': ['Guernsey'],
+    'GH': ['Ghana'],
+    'GI': ['Gibraltar', 'Gibilterra'],
+    'GL': ['Greenland', 'Groenlandia'],
+    'GM': ['Gambia'],
+    'GN': ['Guinea'],
+    'GP': ['Guadeloupe', 'Guadalupa'],
+    'GQ': ['Equatorial Guinea', 'Guinea Equatoriale'],
+    'GR': ['Greece', 'Grecia'],
+    'GS': ['South Georgia and the South Sandwich Islands', 'Georgia del Sud e isole Sandwich australi'],
+    'GT': ['Guatemala'],
+    'GU': ['Guam'],
+    'GW': ['Guinea-Bissau'],
+    'GY': ['Guyana'],
+    'HK': ['Hong Kong'],
+    'HM': ['Heard Island and McDonald Islands', 'Isole Heard e McDonald'],
+    'HN': ['Honduras'],
+    'HR': ['Croatia', 'Croazia'],
+    'HT': ['Haiti'],
+    'HU': ['Hungary', 'Ungheria'],
+    'ID': ['Indonesia'],
+    'IE': ['Ireland', 'Irlanda'],
+    'IL': ['Israel', 'Israele'],
+    'IM': ['Isle of Man', 'Isola di Man'],
+    'IN': ['India'],
+    'IO': ['British Indian Ocean Territory', "Territorio britannico dell'Oceano Indiano"],
+    'IQ': ['Iraq'],
+    'IR': ['Iran'],
+    'IS': ['Iceland', 'Islanda'],
+    'IT': ['Italy', 'Italia'],
+    'JE': ['Jersey'],
+    'JM': ['Jamaica', 'Giamaica'],
+    'JO': ['Jordan', 'Giordania'],
+    'JP': ['Japan', 'Giappone'],
+    'KE': ['Kenya'],
+    'KG': ['Kyrgyzstan', 'Kirghizistan'],
+    'KH': ['Cambodia', 'Cambogia'],
+    'KI': ['Kiribati'],
+    'KM': ['Comoros', 'Comore'],
+    'KN': ['Saint Kitts and Nevis', 'Saint Kitts e Nevis'],
+    'KP': ['North Korea', 'Corea del Nord'],
+    'KR': ['South Korea', 'Corea del Sud'],
+    'KW': ['Kuwait'],
+    'KY': ['Cayman Islands', 'Isole Cayman'],
+    'KZ': ['Kazakhstan', 'Kazakistan'],
+    'LA': ['Laos'],
+    'LB': ['Lebanon', 'Libano'],
+    'LC': ['Saint Lucia'],
+    'LI': ['Liechtenstein'],
+    'LK': ['Sri Lanka'],
+    'LR': ['Liberia'],
+    'LS': ['Lesotho'],
+    'LT': ['Lithuania', 'Lituania'],
+    'LU': ['Luxembourg', 'Lussemburgo'],
+    'LV': ['Latvia', 'Lettonia'],
+    'LY': ['Libya', 'Libia'],
+    'MA': ['Morocco', 'Marocco'],
+    'MC': ['Monaco', 'Principato di Monaco'],
+    'MD': ['Moldova', 'Moldavia'],
+    'ME': ['Montenegro'],
+    'MF': ['Saint Martin'],
+    'MG': ['Madagascar'],
+    'MH': ['Marshall Islands', 'Isole Marshall'],
+    'MK': ['North Macedonia', 'Macedonia del Nord', 'Macedonia'],
+    'ML': ['Mali'],
+    'MM': ['Myanmar', 'Burma', 'Birmania'],
+    'MN': ['Mongolia'],
+    'MO': ['Macao', 'Macau'],
+    'MP': ['Northern Mariana Islands', 'Isole Marianne Settentrionali'],
+    'MQ': ['Martinique', 'Martinica'],
+    'MR': ['Mauritania'],
+    'MS': ['Montserrat'],
+    'MT': ['Malta'],
+    'MU': ['Mauritius'],
+    'MV': ['Maldives', 'Maldive'],
+    'MW': ['Malawi'],
+    'MX': ['Mexico', 'Messico'],
+    'MY': ['Malaysia', 'Malesia'],
+    'MZ': ['Mozambique', 'Mozambico'],
+    'NA': ['Namibia'],
+    'NC': ['New Caledonia', 'Nuova Caledonia'],
+    'NE': ['Niger'],
+    'NF': ['Norfolk Island', 'Isola Norfolk'],
+    'NG': ['Nigeria'],
+    'NI': ['Nicaragua'],
+    'NL': ['Netherlands', 'The Netherlands', 'Holland', 'Paesi Bassi', 'Olanda'],
+    'NO': ['Norway', 'Norvegia'],
+    'NP': ['Nepal'],
+    'NR': ['Nauru'],
+    'NU': ['Niue'],
+    'NZ': ['New Zealand', 'Nuova Zelanda'],
+    'OM': ['Oman'],
+    'PA': ['Panama'],
+    'PE': ['Peru', 'Perù'],
+    'PF': ['French Polynesia', 'Polinesia francese'],
+    'PG': ['Papua New Guinea', 'Papua Nuova Guinea'],
+    'PH': ['Philippines', 'Filippine'],
+    'PK': ['Pakistan'],
+    'PL': ['Poland', 'Polonia'],
+    'PM': ['Saint Pierre and Miquelon', 'Saint-Pierre e Miquelon'],
+    'PN': ['Pitcairn'],
+    'PR': ['Puerto Rico', 'Porto Rico'],
+    'PS': ['Palestine', 'Palestina'],
+    'PT': ['Portugal', 'Portogallo'],
+    'PW': ['Palau'],
+    'PY': ['Paraguay'],
+    'QA': ['Qatar'],
+    'RE': ['Reunion', 'Riunione'],
+    'RO': ['Romania'],
+    'RS': ['Serbia'],
+    'RU': ['Russia', 'Russian Federation', 'Federazione Russa'],
+    'RW': ['Rwanda', 'Ruanda'],
+    'SA': ['Saudi Arabia', 'Arabia Saudita'],
+    'SB': ['Solomon Islands', 'Isole Salomone'],
+    'SC': ['Seychelles'],
+    'SD': ['Sudan'],
+    'SE': ['Sweden', 'Svezia'],
+    'SG': ['Singapore'],
+    'SH': ['Saint Helena', "Sant'Elena"],
+    'SI': ['Slovenia'],
+    'SJ': ['Svalbard and Jan Mayen', 'Svalbard e Jan Mayen'],
+    'SK': ['Slovakia', 'Slovacchia'],
+    'SL': ['Sierra Leone'],
+    'SM': ['San Marino'],
+    'SN': ['Senegal'],
+    'SO': ['Somalia'],
+    'SR': ['Suriname'],
+    'SS': ['South Sudan', 'Sudan del Sud'],
+    'ST': ['Sao Tome and Principe', 'Sao Tome e Principe'],
+    'SV': ['El Salvador'],
+    'SX': ['Sint Maarten'],
+    'SY': ['Syria', 'Siria'],
+    'SZ': ['Eswatini', 'Swaziland'],
+    'TC': ['Turks and Caicos Islands', 'Isole Turks e Caicos'],
+    'TD': ['Chad', 'Ciad'],
+    'TF': ['French Southern Territories', 'Terre australi e antartiche francesi'],
+    'TG': ['Togo'],
+    'TH': ['Thailand', 'Thailandia'],
+    'TJ': ['Tajikistan', 'Tagikistan'],
+    'TK': ['Tokelau'],
+    'TL': ['Timor-Leste', 'East Timor', 'Timor Est'],
+    'TM': ['Turkmenistan'],
+    'TN': ['Tunisia'],
+    'TO': ['Tonga'],
+    'TR': ['Turkey', 'Turkiye', 'Turchia'],
+    'TT': ['Trinidad and Tobago', 'Trinidad e Tobago'],
+    'TV': ['Tuvalu'],
+    'TW': ['Taiwan'],
+    'TZ': ['Tanzania'],
+    'UA': ['Ukraine', 'Ucraina'],
+    'UG': ['Uganda'],
+    'UM': ['United States Minor Outlying Islands', 'Isole minori esterne degli Stati Uniti'],
+    'US': ['United States', 'United States of America', 'USA', 'Stati Uniti', "Stati Uniti d'America"],
+    'UY': ['Uruguay'],
+    'UZ': ['Uzbekistan'],
+    'VA': ['Vatican', 'Vatican City', 'Holy See', 'Città del Vaticano', 'Vaticano'],
+    'VC': ['Saint Vincent and the Grenadines', 'Saint Vincent e Grenadine'],
+    'VE': ['Venezuela'],
+    'VG': ['British Virgin Islands', 'Isole Vergini britanniche'],
+    'VI': ['U.S. Virgin Islands', 'Isole Vergini americane'],
+    'VN': ['Vietnam'],
+    'VU': ['Vanuatu'],
+    'WF': ['Wallis and Futuna', 'Wallis e Futuna'],
+    'WS': ['Samoa'],
+    'XK': ['Kosovo'],
+    'YE': ['Yemen'],
+    'YT': ['Mayotte'],
+    'ZA': ['South Africa', 'Sudafrica'],
+    'ZM': ['Zambia'],
+    'ZW': ['Zimbabwe'],
+}
+
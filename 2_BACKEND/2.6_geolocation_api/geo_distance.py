@@ -0,0 +1,96 @@
+"""
+2.6 - Geo Distance
+Distanze Haversine tra un punto e molti punti in una sola passata
+(NumPy se installato, altrimenti Python puro)
+"""
+
+import math
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Raggio medio della Terra in km
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Distanza tra due punti con la formula di Haversine
+
+    Args:
+        lat1, lon1: coordinate primo punto (gradi)
+        lat2, lon2: coordinate secondo punto (gradi)
+
+    Returns:
+        float: distanza in km
+    """
+    half_dlat = math.radians(lat2 - lat1) / 2
+    half_dlon = math.radians(lon2 - lon1) / 2
+    a = math.sin(half_dlat) ** 2 + \
+        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(half_dlon) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _distances(latitude, longitude, latitudes, longitudes):
+    if np is not None:
+        lats = np.radians(np.asarray(latitudes, dtype=float))
+        lons = np.radians(np.asarray(longitudes, dtype=float))
+        lat0 = math.radians(latitude)
+        a = np.sin((lats - lat0) / 2) ** 2 + \
+            math.cos(lat0) * np.cos(lats) * np.sin((lons - math.radians(longitude)) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+    # Senza NumPy: i termini del centro calcolati una volta sola
+    lat0 = math.radians(latitude)
+    lon0 = math.radians(longitude)
+    cos_lat0 = math.cos(lat0)
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+    diameter = 2 * EARTH_RADIUS_KM
+    distances = []
+    for lat, lon in zip(latitudes, longitudes):
+        lat = radians(lat)
+        a = sin((lat - lat0) / 2) ** 2 + cos_lat0 * cos(lat) * sin((radians(lon) - lon0) / 2) ** 2
+        distances.append(diameter * asin(sqrt(min(1.0, a))))
+    return distances
+
+
+def distances_km(latitude: float, longitude: float,
+                 latitudes: Sequence[float], longitudes: Sequence[float]) -> List[float]:
+    """
+    Distanze da un punto a una serie di punti
+
+    Args:
+        latitude, longitude: punto di riferimento
+        latitudes, longitudes: coordinate dei punti (stessa lunghezza, senza None)
+
+    Returns:
+        list: distanze in km, nello stesso ordine dei punti
+    """
+    distances = _distances(latitude, longitude, latitudes, longitudes)
+    return distances.tolist() if np is not None else distances
+
+
+def within_radius(latitude: float, longitude: float,
+                  latitudes: Sequence[float], longitudes: Sequence[float],
+                  radius_km: float) -> List[Tuple[int, float]]:
+    """
+    Punti entro un raggio: distanze e filtro in una sola passata
+
+    Args:
+        latitude, longitude: centro
+        latitudes, longitudes: coordinate dei candidati (senza None)
+        radius_km: raggio in km
+
+    Returns:
+        list: (indice del candidato, distanza in km) dei punti nel raggio,
+              nell'ordine dei candidati
+    """
+    distances = _distances(latitude, longitude, latitudes, longitudes)
+    if np is not None:
+        indexes = np.flatnonzero(distances <= radius_km)
+        return list(zip(indexes.tolist(), distances[indexes].tolist()))
+    return [(index, distance) for index, distance in enumerate(distances) if distance <= radius_km]
@@ -0,0 +1,236 @@
+"""
+2.6 - Geocode Cache
+Cache a due livelli delle risposte di Nominatim: LRU in memoria e tabella
+geocode_cache nel database
+"""
+
+import hashlib
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy.exc import IntegrityError
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+
+from models import db, GeocodeCacheEntry
+
+
+class GeocodeCache:
+    """
+    Cache dei risultati di geocoding, chiavi = query normalizzate o
+    coordinate arrotondate
+
+    Livello 1: dizionario LRU nel processo, riletto dal database dopo
+    MEMORY_TTL. Livello 2: tabella geocode_cache, condivisa da processi e
+    riavvii.
+
+    Anche i "non trovato" sono salvati (cache negativa, per NEGATIVE_TTL);
+    gli errori di rete o del servizio no. Un risultato scaduto da meno di
+    STALE_TTL viene restituito subito e aggiornato in background
+    (stale-while-revalidate); se Nominatim non risponde si usa il risultato
+    scaduto, se c'è.
+    """
+
+    # Validità dei risultati trovati e dei "non trovato"
+    FRESH_TTL = timedelta(days=30)
+    NEGATIVE_TTL = timedelta(days=1)
+    # Oltre la validità: servito scaduto mentre si aggiorna
+    STALE_TTL = timedelta(days=60)
+
+    # LRU in memoria
+    MEMORY_MAX_ENTRIES = 1024
+    MEMORY_TTL = timedelta(minutes=10)
+
+    # Coordinate del reverse geocoding arrotondate a 4 decimali (~11 m)
+    COORDINATE_DECIMALS = 4
+
+    _memory = OrderedDict()
+    _lock = threading.Lock()
+    _executor = None
+    _refreshing = {}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Forma canonica di una query: minuscole, spazi e virgole uniformi"""
+        text = unicodedata.normalize('NFKC', text).casefold()
+        text = re.sub(r'\s*,\s*', ', ', text)
+        return re.sub(r'\s+', ' ', text).strip(' ,')
+
+    @staticmethod
+    def query_key(kind: str, query: str, *params) -> str:
+        """
+        Chiave di una ricerca testuale, es. "geocode:milano, italy"
+
+        Args:
+            kind: tipo di richiesta ('geocode', 'search', ...)
+            query: testo cercato
+            params: altri parametri che cambiano il risultato (es. limit)
+        """
+        prefix = ':'.join([kind, *(str(param) for param in params)])
+        key = f"{prefix}:{GeocodeCache.normalize(query)}"
+        if len(key) > 255:
+            key = f"{prefix}:sha256:{hashlib.sha256(key.encode()).hexdigest()}"
+        return key
+
+    @staticmethod
+    def coordinates_key(kind: str, latitude: float, longitude: float) -> str:
+        """Chiave di una richiesta per coordinate, es. "reverse:45.4642,9.1900\""""
+        decimals = GeocodeCache.COORDINATE_DECIMALS
+        return f"{kind}:{latitude:.{decimals}f},{longitude:.{decimals}f}"
+
+    @classmethod
+    def lookup(cls, key: str, fetch: Callable[[], Tuple]) -> Tuple:
+        """
+        Risultato dalla cache, o da fetch() se manca o è scaduto
+
+        Args:
+            key: chiave (query_key o coordinates_key)
+            fetch: funzione che interroga Nominatim e restituisce
+                   (success, message, data); solleva eccezione per gli errori
+                   da non salvare
+
+        Returns:
+            tuple: (success, message, data)
+        """
+        entry = cls._get(key)
+        if entry is not None:
+            result, fetched_at = entry
+            age = datetime.utcnow() - fetched_at
+            ttl = cls.FRESH_TTL if result[0] else cls.NEGATIVE_TTL
+            if age <= ttl:
+                return result
+            if age <= ttl + cls.STALE_TTL:
+                cls._revalidate(key, fetch)
+                return result
+
+        try:
+            result = fetch()
+        except Exception:
+            if entry is not None:
+                return entry[0]
+            raise
+        cls._put(key, result)
+        return result
+
+    @classmethod
+    def _get(cls, key: str) -> Optional[Tuple]:
+        now = datetime.utcnow()
+        with cls._lock:
+            cached = cls._memory.get(key)
+            if cached is not None and now - cached[2] <= cls.MEMORY_TTL:
+                cls._memory.move_to_end(key)
+                return cached[0], cached[1]
+
+        if not has_app_context():
+            return None
+        row = GeocodeCacheEntry.query.filter_by(key=key).first()
+        if row is None:
+            return None
+        result = (row.success, row.message, row.data)
+        cls._remember(key, result, row.fetched_at)
+        return result, row.fetched_at
+
+    @classmethod
+    def _put(cls, key: str, result: Tuple):
+        fetched_at = datetime.utcnow()
+        cls._remember(key, result, fetched_at)
+        if not has_app_context():
+            return
+
+        success, message, data = result
+        for _ in range(2):
+            row = GeocodeCacheEntry.query.filter_by(key=key).first()
+            if row is None:
+                row = GeocodeCacheEntry(key=key)
+                db.session.add(row)
+            row.success = success
+            row.message = message
+            row.data = data
+            row.fetched_at = fetched_at
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Stessa chiave inserita da un altro processo: aggiorna la sua riga
+                db.session.rollback()
+
+    @classmethod
+    def _remember(cls, key: str, result: Tuple, fetched_at: datetime):
+        with cls._lock:
+            cls._memory[key] = (result, fetched_at, datetime.utcnow())
+            cls._memory.move_to_end(key)
+            while len(cls._memory) > cls.MEMORY_MAX_ENTRIES:
+                cls._memory.popitem(last=False)
+
+    @classmethod
+    def _revalidate(cls, key: str, fetch: Callable[[], Tuple]):
+        """Aggiorna una chiave in background (una volta sola per chiave)"""
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def refresh():
+            try:
+                if app is None:
+                    cls._put(key, fetch())
+                else:
+                    with app.app_context():
+                        cls._put(key, fetch())
+            except Exception:
+                # Nominatim non raggiungibile: resta il risultato scaduto
+                pass
+            finally:
+                with cls._lock:
+                    cls._refreshing.pop(key, None)
+
+        with cls._lock:
+            if key in cls._refreshing:
+                return
+            if cls._executor is None:
+                # Un solo worker: gli aggiornamenti rispettano comunque il rate limit
+                cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geocode-refresh')
+            cls._refreshing[key] = cls._executor.submit(refresh)
+
+    @classmethod
+    def wait(cls, key: str, timeout: Optional[float] = None):
+        """Attende l'aggiornamento in background di una chiave, se in corso"""
+        with cls._lock:
+            future = cls._refreshing.get(key)
+        if future is not None:
+            future.result(timeout)
+
+    @classmethod
+    def clear_memory(cls):
+        """Svuota il livello in memoria (il database resta)"""
+        with cls._lock:
+            cls._memory.clear()
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        """
+        Elimina dal database le righe troppo vecchie anche per essere servite
+        scadute
+
+        Va chiamata dentro un app context.
+
+        Returns:
+            int: righe eliminate
+        """
+        now = datetime.utcnow()
+        deleted = GeocodeCacheEntry.query.filter(
+            db.or_(
+                GeocodeCacheEntry.fetched_at < now - cls.FRESH_TTL - cls.STALE_TTL,
+                db.and_(
+                    GeocodeCacheEntry.success.is_(False),
+                    GeocodeCacheEntry.fetched_at < now - cls.NEGATIVE_TTL - cls.STALE_TTL
+                )
+            )
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
@@ -5,6 +5,7 @@ API endpoints per servizi di geolocalizzazione avanzati
 
 from flask import Blueprint, request, jsonify
 # Nota: per gli endpoint geolocation consentiamo accesso pubblico
+import math
 import sys
 import os
 
@@ -12,12 +13,39 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
 
 from models import db, Item, User
-from geolocation_service import GeolocationService
+from geolocation_service import GeolocationService, GeocodingBusy
+from item_geo_index import ItemGeoIndex
 
 # Crea blueprint
 geolocation_bp = Blueprint('geolocation', __name__, url_prefix='/api/geo')
 
 
+def _busy_response(error):
+    """Risposta 503 con Retry-After quando il rate limit di Nominatim non concede un turno in tempo"""
+    response = jsonify({
+        "success": False,
+        "message": str(error)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(math.ceil(GeolocationService.MIN_REQUEST_INTERVAL))
+    return response
+
+
+def _serialize_geo_item(item, distance):
+    """Item dell'indice geografico con la distanza dal centro"""
+    return {
+        'id': item.id,
+        'title': item.title,
+        'name': item.title,
+        'price': item.price,
+        'latitude': item.latitude,
+        'longitude': item.longitude,
+        'distance_km': round(distance, 2),
+        'seller_id': item.seller_id,
+        'created_at': item.created_at.isoformat() if item.created_at else None
+    }
+
+
 @geolocation_bp.route('/geocode', methods=['GET'])
 def geocode():
     """
@@ -32,6 +60,7 @@ def geocode():
         200: Coordinate trovate
         400: Parametri mancanti
         404: Indirizzo non trovato
+        503: Rate limit di Nominatim esaurito
     """
     try:
         address = request.args.get('address', '').strip()
@@ -56,6 +85,8 @@ def geocode():
             "data": data
         }), 200
         
+    except GeocodingBusy as e:
+        return _busy_response(e)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -78,6 +109,7 @@ def reverse_geocode():
         200: Indirizzo trovato
         400: Parametri non validi
         404: Coordinate non trovate
+        503: Rate limit di Nominatim esaurito
     """
     try:
         lat = request.args.get('lat')
@@ -112,6 +144,8 @@ def reverse_geocode():
             "data": data
         }), 200
         
+    except GeocodingBusy as e:
+        return _busy_response(e)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -133,6 +167,7 @@ def search_address():
     Returns:
         200: Risultati trovati
         400: Parametri non validi
+        503: Rate limit di Nominatim esaurito
     """
     try:
         query = request.args.get('q', '').strip()
@@ -165,6 +200,8 @@ def search_address():
             "results": results or []
         }), 200
         
+    except GeocodingBusy as e:
+        return _busy_response(e)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -228,7 +265,8 @@ def calculate_distance():
 @geolocation_bp.route('/nearby', methods=['GET'])
 def find_nearby_items():
     """
-    Trova items nelle vicinanze di coordinate specifiche
+    Trova items nelle vicinanze di coordinate specifiche (attivi e non
+    venduti, dall'indice in memoria)
     
     GET /api/geo/nearby?lat=<lat>&lon=<lon>&radius=<km>
     
@@ -264,42 +302,9 @@ def find_nearby_items():
                 "message": "Parametri non validi"
             }), 400
         
-        # Calcola bounding box
-        bbox = GeolocationService.find_nearby_coordinates(latitude, longitude, radius_km)
-        
-        # Query items con coordinate nel bounding box
-        items = Item.query.filter(
-            Item.latitude.isnot(None),
-            Item.longitude.isnot(None),
-            Item.latitude >= bbox['min_lat'],
-            Item.latitude <= bbox['max_lat'],
-            Item.longitude >= bbox['min_lon'],
-            Item.longitude <= bbox['max_lon']
-        ).all()
-        
-        # Filtra per distanza esatta e calcola distanza
-        nearby_items = []
-        for item in items:
-            distance = GeolocationService.calculate_distance(
-                latitude, longitude,
-                item.latitude, item.longitude
-            )
-            
-            if distance <= radius_km:
-                nearby_items.append({
-                    'id': item.id,
-                    'title': item.title,
-                    'name': item.title,
-                    'price': item.price,
-                    'latitude': item.latitude,
-                    'longitude': item.longitude,
-                    'distance_km': round(distance, 2),
-                    'seller_id': item.seller_id,
-                    'created_at': item.created_at.isoformat()
-                })
-        
-        # Ordina per distanza
-        nearby_items.sort(key=lambda x: x['distance_km'])
+        # Indice in memoria: nessuna query né oggetto ORM per richiesta
+        nearby = ItemGeoIndex.for_app().nearby(latitude, longitude, radius_km)
+        nearby_items = [_serialize_geo_item(item, distance) for item, distance in nearby]
         
         return jsonify({
             "success": True,
@@ -319,6 +324,63 @@ def find_nearby_items():
         }), 500
 
 
+@geolocation_bp.route('/nearest', methods=['GET'])
+def find_nearest_items():
+    """
+    Trova i k items più vicini a coordinate specifiche, a qualunque distanza
+    
+    GET /api/geo/nearest?lat=<lat>&lon=<lon>&k=<n>
+    
+    Query Parameters:
+        lat: latitudine centro
+        lon: longitudine centro
+        k: numero di items (default: 10, max: 100)
+    
+    Returns:
+        200: Items trovati, ordinati per distanza
+        400: Parametri non validi
+    """
+    try:
+        lat = request.args.get('lat')
+        lon = request.args.get('lon')
+        
+        if not lat or not lon:
+            return jsonify({
+                "success": False,
+                "message": "Parametri 'lat' e 'lon' obbligatori"
+            }), 400
+        
+        try:
+            latitude = float(lat)
+            longitude = float(lon)
+            k = min(max(1, int(request.args.get('k', '10'))), 100)
+        except ValueError:
+            return jsonify({
+                "success": False,
+                "message": "Parametri non validi"
+            }), 400
+        
+        nearest = ItemGeoIndex.for_app().nearest(latitude, longitude, k)
+        nearest_items = [_serialize_geo_item(item, distance) for item, distance in nearest]
+        
+        return jsonify({
+            "success": True,
+            "center": {
+                "latitude": latitude,
+                "longitude": longitude
+            },
+            "k": k,
+            "count": len(nearest_items),
+            "items": nearest_items
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Errore: {str(e)}"
+        }), 500
+
+
 @geolocation_bp.route('/city/<city_name>', methods=['GET'])
 def get_city_info(city_name):
     """
@@ -332,6 +394,7 @@ def get_city_info(city_name):
     Returns:
         200: Informazioni città
         404: Città non trovata
+        503: Rate limit di Nominatim esaurito
     """
     try:
         country = request.args.get('country', 'Italy')
@@ -351,6 +414,8 @@ def get_city_info(city_name):
             "data": data
         }), 200
         
+    except GeocodingBusy as e:
+        return _busy_response(e)
     except Exception as e:
         return jsonify({
             "success": False,
@@ -5,8 +5,24 @@ Servizio avanzato per gestione geolocalizzazione con geocoding e reverse geocodi
 
 import requests
 import math
+import os
+import tempfile
+import threading
 from typing import Tuple, Optional, List, Dict
-import time
+
+from geocode_cache import GeocodeCache
+from rate_limiter import TokenBucket
+from offline_geocoder import OfflineGeocoder
+from geo_distance import haversine_km
+
+
+class GeocodingError(Exception):
+    """Nominatim non raggiungibile o in errore (risultato da non mettere in cache)"""
+
+
+class GeocodingBusy(GeocodingError):
+    """Nessun turno di Nominatim entro MAX_QUEUE_WAIT: riprovare più tardi"""
+
 
 class GeolocationService:
     """Servizio per operazioni di geolocalizzazione avanzate"""
@@ -15,26 +31,50 @@ class GeolocationService:
     NOMINATIM_URL = "https://nominatim.openstreetmap.org"
     USER_AGENT = "AutonomiaApp/1.0"
     
-    # Rate limiting (1 richiesta al secondo per Nominatim)
+    # Rate limiting (1 richiesta al secondo per Nominatim), comune a tutti i
+    # thread e processi che usano lo stesso file di stato
     MIN_REQUEST_INTERVAL = 1.0
-    last_request_time = 0
+    RATE_LIMIT_FILE = os.getenv(
+        'NOMINATIM_RATE_LIMIT_FILE',
+        os.path.join(tempfile.gettempdir(), 'autonomia_nominatim.bucket')
+    )
+    # Attesa massima del proprio turno: oltre, la richiesta fallisce subito
+    MAX_QUEUE_WAIT = 3.0
+    BUSY_MESSAGE = "Servizio di geocoding occupato, riprova tra poco"
+    
+    # TokenBucket; None = creato al primo uso su RATE_LIMIT_FILE
+    RATE_LIMITER = None
+    _rate_limiter_lock = threading.Lock()
+    
+    # Provider: 'nominatim' o 'offline' (dump GeoNames in GEOCODER_CITIES_FILE
+    # e/o GEOCODER_POSTCODES_FILE). Con 'offline' Nominatim è usato solo per
+    # le richieste che il dizionario locale non risolve, se GEOCODER_FALLBACK
+    # non è 'none'
+    PROVIDER = os.getenv('GEOCODER_PROVIDER', 'nominatim').lower()
+    NOMINATIM_FALLBACK = os.getenv('GEOCODER_FALLBACK', 'nominatim').lower() != 'none'
+    
+    # OfflineGeocoder; None = caricato al primo uso
+    OFFLINE_GEOCODER = None
+    _offline_lock = threading.Lock()
     
     @staticmethod
-    def _wait_for_rate_limit():
-        """Rispetta il rate limiting di Nominatim"""
-        current_time = time.time()
-        elapsed = current_time - GeolocationService.last_request_time
-        
-        if elapsed < GeolocationService.MIN_REQUEST_INTERVAL:
-            time.sleep(GeolocationService.MIN_REQUEST_INTERVAL - elapsed)
-        
-        GeolocationService.last_request_time = time.time()
+    def get_rate_limiter() -> TokenBucket:
+        """Rate limiter di Nominatim, creato al primo accesso"""
+        with GeolocationService._rate_limiter_lock:
+            if GeolocationService.RATE_LIMITER is None:
+                GeolocationService.RATE_LIMITER = TokenBucket(
+                    GeolocationService.RATE_LIMIT_FILE,
+                    rate=1 / GeolocationService.MIN_REQUEST_INTERVAL
+                )
+            return GeolocationService.RATE_LIMITER
     
     @staticmethod
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
         Calcola distanza tra due punti usando formula di Haversine
         
+        Per molti punti usare geo_distance.distances_km / within_radius.
+        
         Args:
             lat1, lon1: coordinate primo punto
             lat2, lon2: coordinate secondo punto
@@ -42,24 +82,103 @@ class GeolocationService:
         Returns:
             float: distanza in km
         """
-        R = 6371  # Raggio Terra in km
+        return haversine_km(lat1, lon1, lat2, lon2)
+    
+    @staticmethod
+    def get_offline_geocoder() -> Optional[OfflineGeocoder]:
+        """Geocoder offline se PROVIDER è 'offline', caricato al primo accesso"""
+        if GeolocationService.PROVIDER != 'offline':
+            return None
+        with GeolocationService._offline_lock:
+            if GeolocationService.OFFLINE_GEOCODER is None:
+                cities = os.getenv('GEOCODER_CITIES_FILE')
+                postcodes = os.getenv('GEOCODER_POSTCODES_FILE')
+                if not cities and not postcodes:
+                    raise ValueError("GEOCODER_PROVIDER=offline richiede GEOCODER_CITIES_FILE o GEOCODER_POSTCODES_FILE")
+                GeolocationService.OFFLINE_GEOCODER = OfflineGeocoder.from_files(cities, postcodes)
+            return GeolocationService.OFFLINE_GEOCODER
+    
+    @staticmethod
+    def _offline_first(lookup) -> Optional[Tuple]:
+        """
+        Risultato del geocoder offline, se configurato
+        
+        Args:
+            lookup: funzione che riceve l'OfflineGeocoder e lo interroga
+            
+        Returns:
+            tuple: (success, message, data), o None se va chiesto a Nominatim
+        """
+        geocoder = GeolocationService.get_offline_geocoder()
+        if geocoder is None:
+            return None
+        result = lookup(geocoder)
+        if result[0] or not GeolocationService.NOMINATIM_FALLBACK:
+            return result
+        return None
+    
+    @staticmethod
+    def _request(endpoint: str, params: Dict):
+        """
+        Richiesta GET a Nominatim (con rate limiting)
         
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        delta_lat = math.radians(lat2 - lat1)
-        delta_lon = math.radians(lon2 - lon1)
+        Se il turno per la richiesta arriverebbe dopo MAX_QUEUE_WAIT secondi
+        non si attende: GeocodingBusy con BUSY_MESSAGE.
         
-        a = math.sin(delta_lat/2)**2 + \
-            math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        Args:
+            endpoint: 'search' o 'reverse'
+            params: query string (format e addressdetails aggiunti qui)
+            
+        Returns:
+            JSON della risposta
+            
+        Raises:
+            GeocodingBusy: nessun turno entro MAX_QUEUE_WAIT
+            GeocodingError: servizio non raggiungibile o risposta non 200
+        """
+        if not GeolocationService.get_rate_limiter().acquire(GeolocationService.MAX_QUEUE_WAIT):
+            raise GeocodingBusy(GeolocationService.BUSY_MESSAGE)
         
-        return R * c
+        try:
+            response = requests.get(
+                f"{GeolocationService.NOMINATIM_URL}/{endpoint}",
+                params={**params, 'format': 'json', 'addressdetails': 1},
+                headers={'User-Agent': GeolocationService.USER_AGENT},
+                timeout=10
+            )
+        except requests.RequestException as e:
+            raise GeocodingError(f"Errore connessione: {str(e)}") from e
+        
+        if response.status_code != 200:
+            raise GeocodingError(f"Errore servizio: {response.status_code}")
+        
+        return response.json()
+    
+    @staticmethod
+    def _cached(key: str, fetch) -> Tuple[bool, str, Optional[object]]:
+        """
+        Risultato di fetch passando dalla GeocodeCache, errori come tuple
+        
+        GeocodingBusy non diventa una tupla: il chiamante risponde 503.
+        """
+        try:
+            return GeocodeCache.lookup(key, fetch)
+        except GeocodingBusy:
+            raise
+        except GeocodingError as e:
+            return False, str(e), None
+        except Exception as e:
+            return False, f"Errore: {str(e)}", None
     
     @staticmethod
     def geocode(address: str) -> Tuple[bool, str, Optional[Dict]]:
         """
         Converte un indirizzo in coordinate geografiche (Geocoding)
         
+        Con il provider offline località e CAP sono risolti localmente; le
+        risposte di Nominatim sono in cache per query normalizzata
+        (GeocodeCache).
+        
         Args:
             address: indirizzo da convertire
             
@@ -71,63 +190,49 @@ class GeolocationService:
                        'display_name': str,
                        'address': dict
                    }
-        """
-        try:
-            if not address or len(address.strip()) < 3:
-                return False, "Indirizzo troppo corto", None
-            
-            # Rate limiting
-            GeolocationService._wait_for_rate_limit()
-            
-            # Request a Nominatim
-            params = {
-                'q': address,
-                'format': 'json',
-                'limit': 1,
-                'addressdetails': 1
-            }
-            
-            headers = {
-                'User-Agent': GeolocationService.USER_AGENT
-            }
-            
-            response = requests.get(
-                f"{GeolocationService.NOMINATIM_URL}/search",
-                params=params,
-                headers=headers,
-                timeout=10
-            )
             
-            if response.status_code != 200:
-                return False, f"Errore servizio: {response.status_code}", None
-            
-            results = response.json()
-            
-            if not results or len(results) == 0:
-                return False, "Indirizzo non trovato", None
-            
-            result = results[0]
-            
-            data = {
-                'latitude': float(result['lat']),
-                'longitude': float(result['lon']),
-                'display_name': result['display_name'],
-                'address': result.get('address', {}),
-                'importance': result.get('importance', 0)
-            }
-            
-            return True, "Geocoding completato", data
-            
-        except requests.RequestException as e:
-            return False, f"Errore connessione: {str(e)}", None
-        except Exception as e:
-            return False, f"Errore: {str(e)}", None
+        Raises:
+            GeocodingBusy: Nominatim occupato (nessun turno entro MAX_QUEUE_WAIT)
+        """
+        if not address or len(address.strip()) < 3:
+            return False, "Indirizzo troppo corto", None
+        
+        result = GeolocationService._offline_first(lambda geocoder: geocoder.geocode(address))
+        if result is not None:
+            return result
+        
+        return GeolocationService._cached(
+            GeocodeCache.query_key('geocode', address),
+            lambda: GeolocationService._fetch_geocode(address)
+        )
+    
+    @staticmethod
+    def _fetch_geocode(address: str) -> Tuple[bool, str, Optional[Dict]]:
+        results = GeolocationService._request('search', {'q': address, 'limit': 1})
+        
+        if not results:
+            return False, "Indirizzo non trovato", None
+        
+        result = results[0]
+        
+        data = {
+            'latitude': float(result['lat']),
+            'longitude': float(result['lon']),
+            'display_name': result['display_name'],
+            'address': result.get('address', {}),
+            'importance': result.get('importance', 0)
+        }
+        
+        return True, "Geocoding completato", data
     
     @staticmethod
     def reverse_geocode(latitude: float, longitude: float) -> Tuple[bool, str, Optional[Dict]]:
         """
         Converte coordinate geografiche in indirizzo (Reverse Geocoding)
         
+        Con il provider offline restituisce località e CAP più vicini; le
+        risposte di Nominatim sono in cache per coordinate arrotondate (~11 m).
+        
         Args:
             latitude: latitudine
             longitude: longitudine
@@ -140,68 +245,57 @@ class GeolocationService:
                        'city': str,
                        'country': str
                    }
-        """
-        try:
-            # Validazione coordinate
-            if not (-90 <= latitude <= 90):
-                return False, "Latitudine non valida", None
-            if not (-180 <= longitude <= 180):
-                return False, "Longitudine non valida", None
-            
-            # Rate limiting
-            GeolocationService._wait_for_rate_limit()
-            
-            # Request a Nominatim
-            params = {
-                'lat': latitude,
-                'lon': longitude,
-                'format': 'json',
-                'addressdetails': 1
-            }
-            
-            headers = {
-                'User-Agent': GeolocationService.USER_AGENT
-            }
-            
-            response = requests.get(
-                f"{GeolocationService.NOMINATIM_URL}/reverse",
-                params=params,
-                headers=headers,
-                timeout=10
-            )
             
-            if response.status_code != 200:
-                return False, f"Errore servizio: {response.status_code}", None
-            
-            result = response.json()
-            
-            if 'error' in result:
-                return False, "Coordinate non trovate", None
-            
-            address = result.get('address', {})
-            
-            data = {
-                'display_name': result['display_name'],
-                'address': address,
-                'city': address.get('city') or address.get('town') or address.get('village', ''),
-                'country': address.get('country', ''),
-                'postcode': address.get('postcode', ''),
-                'road': address.get('road', ''),
-                'house_number': address.get('house_number', '')
-            }
-            
-            return True, "Reverse geocoding completato", data
-            
-        except requests.RequestException as e:
-            return False, f"Errore connessione: {str(e)}", None
-        except Exception as e:
-            return False, f"Errore: {str(e)}", None
+        Raises:
+            GeocodingBusy: Nominatim occupato (nessun turno entro MAX_QUEUE_WAIT)
+        """
+        # Validazione coordinate
+        if not (-90 <= latitude <= 90):
+            return False, "Latitudine non valida", None
+        if not (-180 <= longitude <= 180):
+            return False, "Longitudine non valida", None
+        
+        result = GeolocationService._offline_first(lambda geocoder: geocoder.reverse(latitude, longitude))
+        if result is not None:
+            return result
+        
+        key = GeocodeCache.coordinates_key('reverse', latitude, longitude)
+        # Stessa richiesta per tutte le coordinate con la stessa chiave
+        decimals = GeocodeCache.COORDINATE_DECIMALS
+        latitude, longitude = round(latitude, decimals), round(longitude, decimals)
+        return GeolocationService._cached(
+            key,
+            lambda: GeolocationService._fetch_reverse(latitude, longitude)
+        )
+    
+    @staticmethod
+    def _fetch_reverse(latitude: float, longitude: float) -> Tuple[bool, str, Optional[Dict]]:
+        result = GeolocationService._request('reverse', {'lat': latitude, 'lon': longitude})
+        
+        if 'error' in result:
+            return False, "Coordinate non trovate", None
+        
+        address = result.get('address', {})
+        
+        data = {
+            'display_name': result['display_name'],
+            'address': address,
+            'city': address.get('city') or address.get('town') or address.get('village', ''),
+            'country': address.get('country', ''),
+            'postcode': address.get('postcode', ''),
+            'road': address.get('road', ''),
+            'house_number': address.get('house_number', '')
+        }
+        
+        return True, "Reverse geocoding completato", data
     
     @staticmethod
     def search_address(query: str, limit: int = 5) -> Tuple[bool, str, Optional[List[Dict]]]:
         """
         Cerca indirizzi che corrispondono alla query (Autocomplete)
         
+        Con il provider offline cerca per prefisso di località o CAP.
+        
         Args:
             query: testo da cercare
             limit: numero massimo di risultati
@@ -209,59 +303,44 @@ class GeolocationService:
         Returns:
             tuple: (success, message, results)
                    results = [{'display_name': str, 'lat': float, 'lon': float}, ...]
-        """
-        try:
-            if not query or len(query.strip()) < 2:
-                return False, "Query troppo corta", None
-            
-            # Rate limiting
-            GeolocationService._wait_for_rate_limit()
-            
-            # Request a Nominatim
-            params = {
-                'q': query,
-                'format': 'json',
-                'limit': min(limit, 10),  # Max 10
-                'addressdetails': 1
-            }
-            
-            headers = {
-                'User-Agent': GeolocationService.USER_AGENT
-            }
-            
-            response = requests.get(
-                f"{GeolocationService.NOMINATIM_URL}/search",
-                params=params,
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code != 200:
-                return False, f"Errore servizio: {response.status_code}", None
-            
-            results = response.json()
-            
-            if not results:
-                return False, "Nessun risultato trovato", []
-            
-            # Formatta risultati
-            formatted_results = []
-            for result in results:
-                formatted_results.append({
-                    'display_name': result['display_name'],
-                    'latitude': float(result['lat']),
-                    'longitude': float(result['lon']),
-                    'address': result.get('address', {}),
-                    'type': result.get('type', ''),
-                    'importance': result.get('importance', 0)
-                })
-            
-            return True, f"{len(formatted_results)} risultati trovati", formatted_results
             
-        except requests.RequestException as e:
-            return False, f"Errore connessione: {str(e)}", None
-        except Exception as e:
-            return False, f"Errore: {str(e)}", None
+        Raises:
+            GeocodingBusy: Nominatim occupato (nessun turno entro MAX_QUEUE_WAIT)
+        """
+        if not query or len(query.strip()) < 2:
+            return False, "Query troppo corta", None
+        
+        limit = min(limit, 10)  # Max 10
+        
+        result = GeolocationService._offline_first(lambda geocoder: geocoder.search(query, limit))
+        if result is not None:
+            return result
+        
+        return GeolocationService._cached(
+            GeocodeCache.query_key('search', query, limit),
+            lambda: GeolocationService._fetch_search(query, limit)
+        )
+    
+    @staticmethod
+    def _fetch_search(query: str, limit: int) -> Tuple[bool, str, Optional[List[Dict]]]:
+        results = GeolocationService._request('search', {'q': query, 'limit': limit})
+        
+        if not results:
+            return False, "Nessun risultato trovato", []
+        
+        # Formatta risultati
+        formatted_results = []
+        for result in results:
+            formatted_results.append({
+                'display_name': result['display_name'],
+                'latitude': float(result['lat']),
+                'longitude': float(result['lon']),
+                'address': result.get('address', {}),
+                'type': result.get('type', ''),
+                'importance': result.get('importance', 0)
+            })
+        
+        return True, f"{len(formatted_results)} risultati trovati", formatted_results
     
     @staticmethod
     def find_nearby_coordinates(latitude: float, longitude: float, radius_km: float) -> Dict:
@@ -324,6 +403,9 @@ class GeolocationService:
             
         Returns:
             tuple: (success, message, data)
+            
+        Raises:
+            GeocodingBusy: Nominatim occupato (nessun turno entro MAX_QUEUE_WAIT)
         """
         query = f"{city_name}, {country}"
         return GeolocationService.geocode(query)
@@ -0,0 +1,300 @@
+"""
+2.6 - Item Geo Index
+Indice spaziale in memoria degli items attivi e non venduti, per le ricerche
+nelle vicinanze senza passare dal database
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+
+from models import db, Item
+from geo_distance import EARTH_RADIUS_KM, within_radius
+
+
+# Solo i campi serviti dalle API geografiche
+GeoItem = namedtuple('GeoItem', 'id latitude longitude title price seller_id created_at')
+
+
+class GeoGrid:
+    """
+    Griglia lat/lon a celle di CELL_DEG gradi: cella -> {id: GeoItem}
+
+    Inserimenti, spostamenti e rimozioni costano O(1); una ricerca visita le
+    sole celle del bounding box del raggio (o le celle occupate, se sono
+    meno) e calcola le distanze esatte sui candidati in una passata.
+    """
+
+    CELL_DEG = 0.25
+    COLUMNS = int(360 / CELL_DEG)
+
+    def __init__(self):
+        self._cells = {}
+        self._items = {}
+
+    @classmethod
+    def cell_of(cls, latitude: float, longitude: float) -> Tuple[int, int]:
+        row = math.floor((latitude + 90) / cls.CELL_DEG)
+        column = math.floor((longitude + 180) / cls.CELL_DEG) % cls.COLUMNS
+        return row, column
+
+    def upsert(self, item: GeoItem):
+        self.remove(item.id)
+        cell = self.cell_of(item.latitude, item.longitude)
+        self._cells.setdefault(cell, {})[item.id] = item
+        self._items[item.id] = (item, cell)
+
+    def remove(self, item_id: int):
+        current = self._items.pop(item_id, None)
+        if current is None:
+            return
+        cell = current[1]
+        bucket = self._cells[cell]
+        del bucket[item_id]
+        if not bucket:
+            del self._cells[cell]
+
+    def get(self, item_id: int) -> Optional[GeoItem]:
+        current = self._items.get(item_id)
+        return current[0] if current is not None else None
+
+    def __len__(self):
+        return len(self._items)
+
+    def candidates(self, latitude: float, longitude: float, radius_km: float) -> List[GeoItem]:
+        """Items delle celle che coprono il bounding box del raggio"""
+        angle = radius_km / EARTH_RADIUS_KM
+        min_row = math.floor((max(-90.0, latitude - math.degrees(angle)) + 90) / self.CELL_DEG)
+        max_row = math.floor((min(90.0, latitude + math.degrees(angle)) + 90) / self.CELL_DEG)
+
+        # Ampiezza in longitudine del bounding box; attorno ai poli tutte le colonne
+        cos_lat = math.cos(math.radians(latitude))
+        if latitude + math.degrees(angle) >= 90 or latitude - math.degrees(angle) <= -90 \
+                or math.sin(angle) >= cos_lat:
+            columns = None
+        else:
+            delta_lon = math.degrees(math.asin(math.sin(angle) / cos_lat))
+            first = math.floor((longitude - delta_lon + 180) / self.CELL_DEG)
+            last = math.floor((longitude + delta_lon + 180) / self.CELL_DEG)
+            columns = None if last - first + 1 >= self.COLUMNS else \
+                {column % self.COLUMNS for column in range(first, last + 1)}
+
+        width = self.COLUMNS if columns is None else len(columns)
+        if (max_row - min_row + 1) * width > len(self._cells):
+            # Bounding box più grande della griglia occupata: si scorrono le celle piene
+            cells = [bucket for (row, column), bucket in self._cells.items()
+                     if min_row <= row <= max_row and (columns is None or column in columns)]
+        else:
+            cells = [self._cells[(row, column)]
+                     for row in range(min_row, max_row + 1)
+                     for column in (columns if columns is not None else range(self.COLUMNS))
+                     if (row, column) in self._cells]
+
+        return [item for bucket in cells for item in bucket.values()]
+
+
+class ItemGeoIndex:
+    """
+    Indice degli items attivi, non venduti e con coordinate di un'app Flask
+    (uno per app, in app.extensions)
+
+    Tenuto aggiornato dai servizi dopo ogni commit (sync/remove: creazione,
+    modifica, eliminazione, vendita) e riallineato al database ogni
+    RECONCILE_INTERVAL secondi, per le modifiche fatte da altri processi o
+    fuori dai servizi. Il primo accesso carica l'indice in modo sincrono; i
+    riallineamenti successivi avvengono in background mentre si continua a
+    rispondere con l'indice corrente.
+    """
+
+    RECONCILE_INTERVAL = 300
+    EXTENSION_KEY = 'item_geo_index'
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, app=None):
+        self.app = app
+        self.reconciled_at = None
+        self._grid = GeoGrid()
+        self._lock = threading.Lock()
+        # Modifiche arrivate durante un riallineamento, riapplicate al nuovo indice
+        self._journal = None
+        self._future = None
+
+    @classmethod
+    def for_app(cls, app=None) -> 'ItemGeoIndex':
+        """Indice dell'app (quella corrente se non indicata), creato se manca"""
+        app = app or current_app._get_current_object()
+        index = app.extensions.get(cls.EXTENSION_KEY)
+        if index is None:
+            index = app.extensions.setdefault(cls.EXTENSION_KEY, cls(app))
+        return index
+
+    @classmethod
+    def _loaded(cls) -> Optional['ItemGeoIndex']:
+        if not has_app_context():
+            return None
+        index = current_app.extensions.get(cls.EXTENSION_KEY)
+        return index if index is not None and index.reconciled_at is not None else None
+
+    @staticmethod
+    def entry(item: Item) -> Optional[GeoItem]:
+        """Voce dell'indice per un item, None se non va indicizzato"""
+        if not item.is_active or item.is_sold or item.latitude is None or item.longitude is None:
+            return None
+        return GeoItem(item.id, item.latitude, item.longitude, item.title,
+                       item.price, item.seller_id, item.created_at)
+
+    @classmethod
+    def sync(cls, item: Item):
+        """
+        Aggiorna l'item nell'indice dell'app corrente (da chiamare dopo il commit)
+
+        Se l'indice non è ancora stato caricato non fa nulla: lo leggerà dal
+        database al primo accesso.
+        """
+        index = cls._loaded()
+        if index is not None:
+            index._apply(item.id, cls.entry(item))
+
+    @classmethod
+    def remove(cls, item_id: int):
+        """Toglie un item eliminato dall'indice dell'app corrente"""
+        index = cls._loaded()
+        if index is not None:
+            index._apply(item_id, None)
+
+    def _apply(self, item_id: int, entry: Optional[GeoItem]):
+        with self._lock:
+            self._put(self._grid, item_id, entry)
+            if self._journal is not None:
+                self._journal.append((item_id, entry))
+
+    @staticmethod
+    def _put(grid: GeoGrid, item_id: int, entry: Optional[GeoItem]):
+        if entry is None:
+            grid.remove(item_id)
+        else:
+            grid.upsert(entry)
+
+    def reconcile(self) -> int:
+        """
+        Ricostruisce l'indice dal database (sole colonne servite, senza
+        oggetti ORM) e lo sostituisce a quello corrente
+
+        Va chiamata dentro un app context.
+
+        Returns:
+            int: items indicizzati
+        """
+        with self._lock:
+            self._journal = []
+        try:
+            grid = GeoGrid()
+            for row in self._load_rows():
+                grid.upsert(GeoItem(*row))
+            with self._lock:
+                for item_id, entry in self._journal:
+                    self._put(grid, item_id, entry)
+                self._grid = grid
+                self.reconciled_at = time.monotonic()
+                return len(grid)
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def _load_rows(self):
+        return db.session.query(
+            Item.id, Item.latitude, Item.longitude, Item.title,
+            Item.price, Item.seller_id, Item.created_at
+        ).filter(
+            Item.is_active.is_(True),
+            Item.is_sold.is_(False),
+            Item.latitude.isnot(None),
+            Item.longitude.isnot(None)
+        ).yield_per(1000)
+
+    def ensure_current(self):
+        """Carica l'indice se serve e avvia il riallineamento periodico se scaduto"""
+        if self.reconciled_at is None:
+            self.reconcile()
+        elif time.monotonic() - self.reconciled_at > self.RECONCILE_INTERVAL:
+            self._reconcile_in_background()
+
+    def _reconcile_in_background(self):
+        def run():
+            with self.app.app_context():
+                self.reconcile()
+
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                return
+            self._future = self._get_executor().submit(run)
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geo-index')
+            return cls._executor
+
+    def wait(self, timeout: Optional[float] = None):
+        """Attende il riallineamento in background, se in corso"""
+        future = self._future
+        if future is not None:
+            future.result(timeout)
+
+    def __len__(self):
+        return len(self._grid)
+
+    def nearby(self, latitude: float, longitude: float,
+               radius_km: float) -> List[Tuple[GeoItem, float]]:
+        """
+        Items entro il raggio
+
+        Returns:
+            list: (GeoItem, distanza in km), ordinati per distanza
+        """
+        self.ensure_current()
+        return self._within(latitude, longitude, radius_km)
+
+    def nearest(self, latitude: float, longitude: float, k: int) -> List[Tuple[GeoItem, float]]:
+        """
+        I k items più vicini, a qualunque distanza
+
+        Il raggio parte da una cella e raddoppia finché contiene almeno k
+        items: quelli trovati nel raggio sono esatti, quindi i k più vicini
+        sono tra loro.
+
+        Returns:
+            list: (GeoItem, distanza in km), al massimo k, ordinati per distanza
+        """
+        self.ensure_current()
+        radius_km = math.radians(GeoGrid.CELL_DEG) * EARTH_RADIUS_KM
+        max_radius_km = math.pi * EARTH_RADIUS_KM
+        while True:
+            found = self._within(latitude, longitude, radius_km)
+            if len(found) >= k or radius_km >= max_radius_km or len(found) == len(self):
+                return found[:k]
+            radius_km *= 2
+
+    def _within(self, latitude, longitude, radius_km):
+        with self._lock:
+            candidates = self._grid.candidates(latitude, longitude, radius_km)
+        found = within_radius(
+            latitude, longitude,
+            [item.latitude for item in candidates],
+            [item.longitude for item in candidates],
+            radius_km
+        )
+        return sorted(((candidates[index], distance) for index, distance in found),
+                      key=lambda pair: pair[1])
@@ -0,0 +1,361 @@
+"""
+2.6 - Offline Geocoder
+Geocoding senza rete da un dump GeoNames di città e CAP
+(https://download.geonames.org/export/dump/ e /export/zip/)
+"""
+
+import bisect
+import heapq
+import io
+import math
+import re
+import unicodedata
+import zipfile
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+from country_names import COUNTRY_NAMES
+
+
+# Località del dizionario: kind = 'city' o 'postcode'
+Place = namedtuple('Place', 'name latitude longitude country_code admin population kind postcode')
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def fold(text: str) -> str:
+    """Forma di confronto di un nome: senza accenti, minuscola, spazi singoli"""
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return re.sub(r'\s+', ' ', stripped.casefold()).strip()
+
+
+# Nome di nazione ripiegato con fold() -> codice ISO
+COUNTRY_CODES = {fold(name): code for code, names in COUNTRY_NAMES.items() for name in names}
+
+
+def _to_xyz(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+class PrefixIndex:
+    """
+    Indice per prefisso dei nomi: array ordinato di (nome, località) in cui
+    le chiavi con un prefisso sono un intervallo contiguo trovato con bisect
+
+    Equivale a un trie ma occupa solo una tupla per nome. Per i prefissi di
+    1-2 caratteri, con intervalli di migliaia di nomi, i migliori risultati
+    sono calcolati una volta e tenuti in memoria.
+    """
+
+    SHORT_PREFIX = 2
+
+    def __init__(self, entries: List[Tuple[str, int]], ranks: List[int]):
+        """
+        Args:
+            entries: coppie (nome già passato da fold, indice della località)
+            ranks: importanza di ogni località (es. popolazione)
+        """
+        entries = sorted(set(entries))
+        self._keys = [key for key, _ in entries]
+        self._places = [place for _, place in entries]
+        self._ranks = ranks
+        self._short = {}
+
+    def exact(self, key: str) -> List[int]:
+        """Località con esattamente quel nome"""
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key)
+        return self._places[lo:hi]
+
+    def prefix(self, prefix: str, limit: int) -> List[int]:
+        """
+        Località con un nome che inizia per prefix, le più importanti prima
+        (a parità, i nomi uguali al prefisso)
+        """
+        if len(prefix) <= self.SHORT_PREFIX:
+            cached = self._short.get(prefix)
+            if cached is None or len(cached) < limit:
+                cached = self._short[prefix] = self._top(prefix, max(limit, 10))
+            return cached[:limit]
+        return self._top(prefix, limit)
+
+    def _top(self, prefix: str, limit: int) -> List[int]:
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + '\uffff')
+        best = {}
+        for position in range(lo, hi):
+            place = self._places[position]
+            score = (self._keys[position] == prefix, self._ranks[place])
+            if score > best.get(place, (False, -1)):
+                best[place] = score
+        return heapq.nlargest(limit, best, key=best.get)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class KDTree:
+    """
+    KD-tree implicito sui punti della sfera unitaria (x, y, z)
+
+    Nessun nodo allocato: l'albero è l'ordine di un array, con la mediana di
+    ogni intervallo come radice del sottoalbero. La distanza euclidea (corda)
+    è monotona rispetto a quella sulla superficie, quindi il punto più vicino
+    è lo stesso; non ci sono problemi all'antimeridiano né ai poli.
+    """
+
+    def __init__(self, points: List[Tuple[float, float]]):
+        """
+        Args:
+            points: coordinate (latitudine, longitudine) in gradi
+        """
+        self._xyz = [_to_xyz(lat, lon) for lat, lon in points]
+        self._order = list(range(len(points)))
+        stack = [(0, len(points), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= 1:
+                continue
+            axis = depth % 3
+            self._order[lo:hi] = sorted(self._order[lo:hi], key=lambda i: self._xyz[i][axis])
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid + 1, hi, depth + 1))
+
+    def nearest(self, latitude: float, longitude: float) -> Tuple[Optional[int], float]:
+        """
+        Punto più vicino
+
+        Returns:
+            tuple: (indice del punto, distanza in km), (None, inf) se vuoto
+        """
+        query = _to_xyz(latitude, longitude)
+        best_index, best_distance = None, float('inf')
+        stack = [(0, len(self._order), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            index = self._order[mid]
+            point = self._xyz[index]
+            distance = sum((q - p) ** 2 for q, p in zip(query, point))
+            if distance < best_distance:
+                best_index, best_distance = index, distance
+
+            axis = depth % 3
+            diff = query[axis] - point[axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # Il lato lontano solo se il piano di taglio è più vicino del migliore
+            if diff * diff < best_distance:
+                stack.append((*far, depth + 1))
+            stack.append((*near, depth + 1))
+
+        if best_index is None:
+            return None, float('inf')
+        chord = math.sqrt(best_distance)
+        return best_index, 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+    def __len__(self):
+        return len(self._order)
+
+
+class OfflineGeocoder:
+    """
+    Geocoding, reverse geocoding e autocomplete su un dizionario locale
+
+    I metodi restituiscono le stesse tuple (success, message, data) di
+    GeolocationService, con data nello stesso formato. Il geocoding riconosce
+    solo nomi di località e CAP: per indirizzi con via si ricade su Nominatim.
+    """
+
+    # Nomi alternativi (es. "Milan", "Mailand") solo per le località più
+    # grandi, per non moltiplicare le voci dell'indice
+    ALTERNATE_NAMES_MIN_POPULATION = 100000
+
+    # Oltre questa distanza il reverse geocoding non trova nulla
+    REVERSE_MAX_KM = 25.0
+
+    def __init__(self, places: List[Place], alternate_names: Optional[Dict[int, List[str]]] = None):
+        """
+        Args:
+            places: località (città e CAP)
+            alternate_names: altri nomi per indice di località
+        """
+        self.places = places
+        ranks = [place.population for place in places]
+
+        names = []
+        postcodes = []
+        for index, place in enumerate(places):
+            if place.kind == 'postcode':
+                postcodes.append((fold(place.postcode), index))
+            else:
+                names.append((fold(place.name), index))
+        for index, alternates in (alternate_names or {}).items():
+            names.extend((fold(name), index) for name in alternates)
+
+        self.names = PrefixIndex(names, ranks)
+        self.postcodes = PrefixIndex(postcodes, ranks)
+        self.countries = {place.country_code.casefold() for place in places}
+
+        self._cities = [index for index, place in enumerate(places) if place.kind == 'city']
+        self._postcode_places = [index for index, place in enumerate(places) if place.kind == 'postcode']
+        self._city_tree = KDTree([places[i][1:3] for i in self._cities])
+        self._postcode_tree = KDTree([places[i][1:3] for i in self._postcode_places])
+
+    @classmethod
+    def from_files(cls, cities_path: Optional[str] = None, postcodes_path: Optional[str] = None) -> 'OfflineGeocoder':
+        """
+        Carica i dump GeoNames (testo tab-separated o lo zip scaricato)
+
+        Args:
+            cities_path: dump delle località (es. IT.zip, cities500.zip)
+            postcodes_path: dump dei CAP (es. IT.zip da /export/zip/)
+        """
+        places = []
+        alternate_names = {}
+        if cities_path:
+            for row in _read_rows(cities_path):
+                # geonameid, name, asciiname, alternatenames, lat, lon, feature class, ...
+                if len(row) < 15 or row[6] != 'P':
+                    continue
+                population = int(row[14] or 0)
+                index = len(places)
+                places.append(Place(row[1], float(row[4]), float(row[5]), row[8], '',
+                                    population, 'city', ''))
+                alternates = {row[2]}
+                if population >= cls.ALTERNATE_NAMES_MIN_POPULATION and row[3]:
+                    alternates.update(row[3].split(','))
+                alternates.discard(row[1])
+                if alternates:
+                    alternate_names[index] = sorted(alternates)
+        if postcodes_path:
+            for row in _read_rows(postcodes_path):
+                # country, postal code, place name, admin name1, ..., lat, lon, accuracy
+                if len(row) < 11 or not row[9] or not row[10]:
+                    continue
+                places.append(Place(row[2], float(row[9]), float(row[10]), row[0], row[3],
+                                    0, 'postcode', row[1]))
+        return cls(places, alternate_names)
+
+    def _display_name(self, place: Place) -> str:
+        parts = [place.postcode, place.name, place.admin, place.country_code]
+        return ', '.join(part for part in parts if part)
+
+    def _address(self, place: Place) -> Dict:
+        address = {'city': place.name, 'country_code': place.country_code.lower()}
+        if place.postcode:
+            address['postcode'] = place.postcode
+        if place.admin:
+            address['state'] = place.admin
+        return address
+
+    def _importance(self, place: Place) -> float:
+        return round(min(1.0, math.log10(place.population + 1) / 7), 3)
+
+    def _result(self, index: int) -> Dict:
+        place = self.places[index]
+        return {
+            'display_name': self._display_name(place),
+            'latitude': place.latitude,
+            'longitude': place.longitude,
+            'address': self._address(place),
+            'type': place.kind,
+            'importance': self._importance(place)
+        }
+
+    def geocode(self, address: str) -> Tuple[bool, str, Optional[Dict]]:
+        """
+        Coordinate di "località[, ...]" o "CAP[, ...]"
+
+        Tra le località omonime vince la più popolosa, limitata alla nazione
+        indicata dall'ultima parte: il nome, in inglese o in italiano
+        (es. "Paris, France", "Parigi, Francia"), o il codice ISO (es.
+        "Paris, FR"). Un nome di nazione assente dal dizionario dà "non
+        trovato"; un codice che non lascia candidati è ignorato, perché le
+        sigle di provincia coincidono con codici ISO (es. "Torino, TO" con
+        TO di Tonga, "Genova, GE" con GE della Georgia).
+        """
+        parts = [fold(part) for part in address.split(',') if part.strip()]
+        if not parts:
+            return False, "Indirizzo non trovato", None
+
+        candidates = self.postcodes.exact(parts[0]) or self.names.exact(parts[0])
+        if len(parts) > 1:
+            last = parts[-1]
+            if last in COUNTRY_CODES:
+                country = COUNTRY_CODES[last].casefold()
+                candidates = [i for i in candidates if self.places[i].country_code.casefold() == country]
+            elif last in self.countries:
+                in_country = [i for i in candidates if self.places[i].country_code.casefold() == last]
+                candidates = in_country or candidates
+        if not candidates:
+            return False, "Indirizzo non trovato", None
+
+        best = max(candidates, key=lambda i: self.places[i].population)
+        data = self._result(best)
+        del data['type']
+        return True, "Geocoding completato", data
+
+    def search(self, query: str, limit: int = 5) -> Tuple[bool, str, List[Dict]]:
+        """Autocomplete per prefisso di nome o CAP"""
+        prefix = fold(query)
+        index = self.postcodes if prefix[:1].isdigit() else self.names
+        results = [self._result(i) for i in index.prefix(prefix, limit)]
+        if not results:
+            return False, "Nessun risultato trovato", []
+        return True, f"{len(results)} risultati trovati", results
+
+    def reverse(self, latitude: float, longitude: float) -> Tuple[bool, str, Optional[Dict]]:
+        """Località più vicina (entro REVERSE_MAX_KM) e, se caricati, il CAP più vicino"""
+        city, distance = self._city_tree.nearest(latitude, longitude)
+        postcode, postcode_distance = self._postcode_tree.nearest(latitude, longitude)
+        if min(distance, postcode_distance) > self.REVERSE_MAX_KM:
+            return False, "Coordinate non trovate", None
+
+        place = self.places[self._cities[city] if distance <= self.REVERSE_MAX_KM
+                            else self._postcode_places[postcode]]
+        address = self._address(place)
+        if postcode_distance <= self.REVERSE_MAX_KM:
+            nearest_postcode = self.places[self._postcode_places[postcode]]
+            address['postcode'] = nearest_postcode.postcode
+            if nearest_postcode.admin:
+                address.setdefault('state', nearest_postcode.admin)
+
+        data = {
+            'display_name': ', '.join(
+                part for part in [address.get('postcode'), place.name, address.get('state'), place.country_code] if part
+            ),
+            'address': address,
+            'city': place.name,
+            'country': place.country_code,
+            'postcode': address.get('postcode', ''),
+            'road': '',
+            'house_number': ''
+        }
+        return True, "Reverse geocoding completato", data
+
+    def __len__(self):
+        return len(self.places)
+
+
+def _read_rows(path: str):
+    """Righe tab-separated di un dump GeoNames, anche dentro lo zip"""
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            name = next(n for n in archive.namelist() if n.endswith('.txt') and 'readme' not in n.lower())
+            with archive.open(name) as raw:
+                yield from _split_lines(io.TextIOWrapper(raw, encoding='utf-8'))
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from _split_lines(f)
+
+
+def _split_lines(lines):
+    for line in lines:
+        if line.strip() and not line.startswith('#'):
+            yield line.rstrip('\n').split('\t')
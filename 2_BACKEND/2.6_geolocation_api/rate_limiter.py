@@ -0,0 +1,97 @@
+"""
+2.6 - Rate Limiter
+Token bucket condiviso tra thread e processi per le richieste a Nominatim
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class TokenBucket:
+    """
+    Token bucket con lo stato in un file, protetto da un lock del sistema
+    operativo: tutti i processi che usano lo stesso file condividono il limite
+
+    Chi non trova un token prenota il successivo (i token scendono sotto
+    zero) e attende il suo turno fuori dal lock: le richieste sono servite in
+    ordine di arrivo, senza polling. Se il turno arriverebbe oltre max_wait
+    la richiesta è rifiutata subito e non consuma nulla.
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float = 1.0):
+        """
+        Args:
+            path: file di stato (creato se manca)
+            rate: token al secondo
+            capacity: token accumulabili (1 = nessuna raffica)
+        """
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: Optional[float] = None) -> bool:
+        """
+        Prende un token, attendendo al massimo max_wait secondi
+
+        Args:
+            max_wait: attesa massima (None = senza limite, 0 = solo se subito)
+
+        Returns:
+            bool: True se il token è stato preso (dopo l'eventuale attesa),
+                  False se il limite non lo consente entro max_wait
+        """
+        with self._lock, open(self.path, 'a+') as f:
+            _lock_file(f)
+            try:
+                f.seek(0)
+                now = time.time()
+                tokens, updated_at = self._parse(f.read(), now)
+                tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+                wait = max(0.0, (1 - tokens) / self.rate)
+                if max_wait is not None and wait > max_wait:
+                    return False
+
+                f.seek(0)
+                f.truncate()
+                f.write(f"{tokens - 1!r} {now!r}")
+                f.flush()
+            finally:
+                _unlock_file(f)
+
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def _parse(self, content: str, now: float):
+        # File nuovo o illeggibile: bucket pieno
+        try:
+            tokens, updated_at = content.split()
+            return float(tokens), min(float(updated_at), now)
+        except ValueError:
+            return self.capacity, now
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
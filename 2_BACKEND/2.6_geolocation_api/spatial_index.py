@@ -0,0 +1,187 @@
+"""
+2.6 - Spatial Index
+Chiave spaziale (geohash) per ricerche geografiche indicizzate sugli items
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+
+class SpatialIndex:
+    """Codifica geohash e calcolo delle celle candidate per un bounding box"""
+
+    # Alfabeto base32 del geohash (senza a, i, l, o)
+    BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+    # Precisione salvata sugli items (9 caratteri = celle di ~5m)
+    STORED_PRECISION = 9
+
+    # Numero massimo di celle usate per coprire un bounding box
+    MAX_QUERY_CELLS = 16
+
+    @staticmethod
+    def encode(latitude: float, longitude: float, precision: int = STORED_PRECISION) -> str:
+        """
+        Calcola il geohash di un punto
+
+        Args:
+            latitude: latitudine (-90 a 90)
+            longitude: longitudine (-180 a 180)
+            precision: numero di caratteri del geohash
+
+        Returns:
+            str: geohash del punto
+        """
+        lat_range = [-90.0, 90.0]
+        lon_range = [-180.0, 180.0]
+        geohash = []
+        bits = 0
+        bit_count = 0
+        even = True
+
+        while len(geohash) < precision:
+            if even:
+                mid = (lon_range[0] + lon_range[1]) / 2
+                if longitude >= mid:
+                    bits = (bits << 1) | 1
+                    lon_range[0] = mid
+                else:
+                    bits = bits << 1
+                    lon_range[1] = mid
+            else:
+                mid = (lat_range[0] + lat_range[1]) / 2
+                if latitude >= mid:
+                    bits = (bits << 1) | 1
+                    lat_range[0] = mid
+                else:
+                    bits = bits << 1
+                    lat_range[1] = mid
+
+            even = not even
+            bit_count += 1
+
+            if bit_count == 5:
+                geohash.append(SpatialIndex.BASE32[bits])
+                bits = 0
+                bit_count = 0
+
+        return ''.join(geohash)
+
+    @staticmethod
+    def encode_optional(latitude: Optional[float], longitude: Optional[float]) -> Optional[str]:
+        """Geohash di un item, None se le coordinate mancano"""
+        if latitude is None or longitude is None:
+            return None
+        return SpatialIndex.encode(latitude, longitude)
+
+    @staticmethod
+    def cell_size(precision: int) -> Tuple[float, float]:
+        """
+        Dimensioni in gradi di una cella geohash
+
+        Returns:
+            tuple: (altezza_lat, larghezza_lon)
+        """
+        total_bits = precision * 5
+        lon_bits = (total_bits + 1) // 2
+        lat_bits = total_bits // 2
+        return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+    @staticmethod
+    def _cells_at_precision(bbox: Dict, precision: int, limit: int) -> Optional[List[str]]:
+        """Celle che coprono il bbox a una precisione, None se superano il limite"""
+        lat_step, lon_step = SpatialIndex.cell_size(precision)
+        lon_cells = int(round(360.0 / lon_step))
+
+        min_lat = max(bbox['min_lat'], -90.0)
+        max_lat = min(bbox['max_lat'], 90.0)
+
+        lat_start = math.floor((min_lat + 90.0) / lat_step)
+        lat_end = min(math.floor((max_lat + 90.0) / lat_step), int(round(180.0 / lat_step)) - 1)
+        lon_start = math.floor((bbox['min_lon'] + 180.0) / lon_step)
+        lon_end = math.floor((bbox['max_lon'] + 180.0) / lon_step)
+
+        # Un bbox più largo del globo copre tutte le colonne una sola volta
+        lon_indexes = range(lon_start, lon_end + 1)
+        if len(lon_indexes) > lon_cells:
+            lon_indexes = range(0, lon_cells)
+
+        count = (lat_end - lat_start + 1) * len(lon_indexes)
+        if count > limit:
+            return None
+
+        cells = set()
+        for lat_index in range(lat_start, lat_end + 1):
+            center_lat = -90.0 + (lat_index + 0.5) * lat_step
+            for lon_index in lon_indexes:
+                # Gestisce i bbox che attraversano l'antimeridiano
+                wrapped = lon_index % lon_cells
+                center_lon = -180.0 + (wrapped + 0.5) * lon_step
+                cells.add(SpatialIndex.encode(center_lat, center_lon, precision))
+
+        return sorted(cells)
+
+    @staticmethod
+    def covering_cells(bbox: Dict, max_cells: int = MAX_QUERY_CELLS) -> List[str]:
+        """
+        Prefissi geohash che coprono un bounding box
+
+        Sceglie la precisione più fine per cui bastano al massimo `max_cells`
+        celle, così la query legge solo le righe delle celle candidate.
+
+        Args:
+            bbox: dict con min_lat, max_lat, min_lon, max_lon
+            max_cells: numero massimo di celle
+
+        Returns:
+            list: prefissi geohash (lista vuota = nessun filtro possibile)
+        """
+        best: List[str] = []
+        for precision in range(1, SpatialIndex.STORED_PRECISION + 1):
+            cells = SpatialIndex._cells_at_precision(bbox, precision, max_cells)
+            if cells is None:
+                break
+            best = cells
+        return best
+
+    @staticmethod
+    def _next_prefix(prefix: str) -> Optional[str]:
+        """Primo geohash successivo a tutti quelli con il prefisso dato"""
+        chars = list(prefix)
+        while chars:
+            position = SpatialIndex.BASE32.index(chars[-1])
+            if position + 1 < len(SpatialIndex.BASE32):
+                chars[-1] = SpatialIndex.BASE32[position + 1]
+                return ''.join(chars)
+            chars.pop()
+        return None
+
+    @staticmethod
+    def prefix_filter(column, cells: List[str]):
+        """
+        Predicato SQL che limita una colonna geohash alle celle indicate
+
+        Usa range `>= prefisso AND < prefisso successivo` invece di LIKE, così
+        l'indice B-tree viene usato anche su SQLite e con collation locale.
+
+        Args:
+            column: colonna SQLAlchemy contenente il geohash
+            cells: prefissi geohash
+
+        Returns:
+            espressione SQLAlchemy o None se non ci sono celle
+        """
+        if not cells:
+            return None
+
+        conditions = []
+        for cell in cells:
+            upper = SpatialIndex._next_prefix(cell)
+            if upper is None:
+                conditions.append(column >= cell)
+            else:
+                conditions.append(and_(column >= cell, column < upper))
+
+        return or_(*conditions)
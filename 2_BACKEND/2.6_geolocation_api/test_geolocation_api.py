@@ -0,0 +1,669 @@
+"""
+Test per Geolocation API
+Verifica indice spaziale e ricerca items nelle vicinanze
+"""
+
+import sys
+import os
+import shutil
+import random
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from datetime import datetime
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.1_flask_setup'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.6_geolocation_api'))
+
+from app import FlaskApp
+from models import db, User, Item, GeocodeCacheEntry
+from geolocation_service import GeolocationService, GeocodingError, GeocodingBusy
+from geocode_cache import GeocodeCache
+from rate_limiter import TokenBucket
+from offline_geocoder import OfflineGeocoder, KDTree
+from item_geo_index import GeoGrid, GeoItem, ItemGeoIndex
+import geo_distance
+from spatial_index import SpatialIndex
+
+
+class TestSpatialIndex(unittest.TestCase):
+    """Test per la codifica geohash"""
+
+    def test_01_encode_known_values(self):
+        """Test geohash di riferimento"""
+        self.assertEqual(SpatialIndex.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(SpatialIndex.encode(45.4642, 9.1900, 5), 'u0nd9')
+        self.assertIsNone(SpatialIndex.encode_optional(None, 9.19))
+        print("✅ Test codifica geohash OK")
+
+    def test_02_covering_cells_contain_points(self):
+        """Test: le celle coprono tutti i punti del bounding box"""
+        bbox = GeolocationService.find_nearby_coordinates(45.4642, 9.1900, 20)
+        cells = SpatialIndex.covering_cells(bbox)
+
+        self.assertTrue(0 < len(cells) <= SpatialIndex.MAX_QUERY_CELLS)
+        for lat in (bbox['min_lat'], bbox['center_lat'], bbox['max_lat']):
+            for lon in (bbox['min_lon'], bbox['center_lon'], bbox['max_lon']):
+                geohash = SpatialIndex.encode(lat, lon)
+                self.assertTrue(any(geohash.startswith(cell) for cell in cells))
+        print("✅ Test copertura celle OK")
+
+
+class TestGeoDistance(unittest.TestCase):
+    """Test per le distanze in batch (NumPy se installato e Python puro)"""
+
+    def test_01_batch_matches_scalar(self):
+        """Test: stesse distanze e stesso filtro della formula scalare"""
+        sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.4_items_api'))
+        from items_service import ItemsService
+
+        rng = random.Random(3)
+        lats = [45.46 + rng.uniform(-1, 1) for _ in range(300)] + [-45.0, 89.9]
+        lons = [9.19 + rng.uniform(-1, 1) for _ in range(300)] + [-170.0, 9.19]
+        expected = [GeolocationService.calculate_distance(45.4642, 9.19, lat, lon) for lat, lon in zip(lats, lons)]
+
+        backends = [None] + ([geo_distance.np] if geo_distance.np is not None else [])
+        for backend in backends:
+            with mock.patch.object(geo_distance, 'np', backend):
+                distances = geo_distance.distances_km(45.4642, 9.19, lats, lons)
+                for distance, reference in zip(distances, expected):
+                    self.assertAlmostEqual(distance, reference, places=6)
+
+                nearby = geo_distance.within_radius(45.4642, 9.19, lats, lons, 50)
+                self.assertEqual([index for index, _ in nearby],
+                                 [i for i, distance in enumerate(expected) if distance <= 50])
+                self.assertEqual(geo_distance.within_radius(45.4642, 9.19, [], [], 50), [])
+        self.assertEqual(round(GeolocationService.calculate_distance(45.4642, 9.19, 45.0703, 7.6869), 2),
+                         ItemsService.calculate_distance(45.4642, 9.19, 45.0703, 7.6869))
+        print("✅ Test distanze in batch OK")
+
+    @unittest.skipUnless(geo_distance.np is not None, "NumPy non installato (vedi requirements.txt)")
+    def test_02_numpy_backend(self):
+        """Test: con NumPy il calcolo è vettoriale e restituisce tipi Python"""
+        lats, lons = [45.4642, 45.0703, -33.8688], [9.19, 7.6869, 151.2093]
+        self.assertIsInstance(geo_distance._distances(45.4642, 9.19, lats, lons), geo_distance.np.ndarray)
+
+        distances = geo_distance.distances_km(45.4642, 9.19, lats, lons)
+        self.assertEqual([type(distance) for distance in distances], [float] * 3)
+        for distance, (lat, lon) in zip(distances, zip(lats, lons)):
+            self.assertAlmostEqual(distance, geo_distance.haversine_km(45.4642, 9.19, lat, lon), places=6)
+
+        nearby = geo_distance.within_radius(45.4642, 9.19, lats, lons, 200)
+        self.assertEqual([(type(index), index) for index, _ in nearby], [(int, 0), (int, 1)])
+        print("✅ Test distanze con NumPy OK")
+
+
+class TestNearbyAPI(unittest.TestCase):
+    """Test per /api/geo/nearby"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(cls.tmp_dir, 'test.db'))
+        cls.app = cls.flask_app.get_app()
+        cls.client = cls.app.test_client()
+
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+        seller = User(username='geo_seller', email='geo@test.com', password_hash='x',
+                      first_name='Geo', last_name='Seller', phone='000')
+        db.session.add(seller)
+        db.session.commit()
+        cls.seller_id = seller.id
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        db.session.remove()
+        db.drop_all()
+        cls.app_context.pop()
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup prima di ogni test"""
+        Item.query.delete()
+        db.session.commit()
+
+    def _add_item(self, title, latitude, longitude):
+        item = Item(title=title, price=10.0, seller_id=self.seller_id,
+                    latitude=latitude, longitude=longitude,
+                    geohash=SpatialIndex.encode_optional(latitude, longitude))
+        db.session.add(item)
+        db.session.commit()
+        return item
+
+    def test_01_nearby_uses_geohash_cells(self):
+        """Test: solo gli items nel raggio vengono restituiti, ordinati per distanza"""
+        self._add_item('Duomo', 45.4642, 9.1900)
+        self._add_item('Navigli', 45.4520, 9.1760)
+        self._add_item('Torino', 45.0703, 7.6869)
+
+        response = self.client.get('/api/geo/nearby?lat=45.4642&lon=9.1900&radius=10')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([item['title'] for item in data['items']], ['Duomo', 'Navigli'])
+        print("✅ Test ricerca nelle vicinanze OK")
+
+    def test_02_backfill_geohashes(self):
+        """Test: gli items senza chiave spaziale vengono indicizzati"""
+        sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.4_items_api'))
+        from items_service import ItemsService
+
+        item = Item(title='Legacy', price=5.0, seller_id=self.seller_id,
+                    latitude=45.4642, longitude=9.1900)
+        db.session.add(item)
+        db.session.commit()
+
+        self.assertEqual(ItemsService.backfill_geohashes(), 1)
+        self.assertEqual(db.session.get(Item, item.id).geohash, SpatialIndex.encode(45.4642, 9.1900))
+        print("✅ Test backfill geohash OK")
+
+
+class TestItemGeoIndex(unittest.TestCase):
+    """Test per l'indice in memoria degli items"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.4_items_api'))
+        from items_service import ItemsService
+        cls.items_service = ItemsService
+
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(cls.tmp_dir, 'test.db'))
+        cls.app = cls.flask_app.get_app()
+        cls.client = cls.app.test_client()
+
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+        seller = User(username='index_seller', email='index@test.com', password_hash='x',
+                      first_name='Index', last_name='Seller', phone='000')
+        db.session.add(seller)
+        db.session.commit()
+        cls.seller_id = seller.id
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        db.session.remove()
+        db.drop_all()
+        cls.app_context.pop()
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup prima di ogni test"""
+        Item.query.delete()
+        db.session.commit()
+        self.index = ItemGeoIndex.for_app(self.app)
+        self.index.reconcile()
+
+    def _create(self, title, latitude, longitude):
+        success, message, item = self.items_service.create_item(
+            seller_id=self.seller_id, title=title, price=10.0,
+            latitude=latitude, longitude=longitude
+        )
+        self.assertTrue(success, message)
+        return item
+
+    def _titles(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.get_json()['items']]
+
+    def test_01_grid_matches_brute_force(self):
+        """Test: raggio e k più vicini uguali al calcolo su tutti i punti"""
+        rng = random.Random(7)
+        grid = GeoGrid()
+        points = []
+        for item_id in range(2000):
+            # Anche attorno all'antimeridiano e ai poli
+            latitude = rng.choice([rng.uniform(35, 48), rng.uniform(-90, 90), rng.uniform(80, 90)])
+            longitude = rng.choice([rng.uniform(6, 19), rng.uniform(-180, 180), rng.uniform(178, 180)])
+            points.append(GeoItem(item_id, latitude, longitude, str(item_id), 1.0, 1, None))
+            grid.upsert(points[-1])
+
+        index = ItemGeoIndex()
+        index._grid = grid
+        index.reconciled_at = time.monotonic()
+
+        for latitude, longitude, radius_km in [(45.46, 9.19, 150), (0.0, 179.9, 800),
+                                               (89.5, 0.0, 300), (-10.0, -60.0, 5000)]:
+            expected = sorted(item.id for item in points
+                              if geo_distance.haversine_km(latitude, longitude,
+                                                           item.latitude, item.longitude) <= radius_km)
+            found = index.nearby(latitude, longitude, radius_km)
+            self.assertEqual(sorted(item.id for item, _ in found), expected)
+            self.assertEqual([distance for _, distance in found], sorted(distance for _, distance in found))
+
+            nearest = index.nearest(latitude, longitude, 5)
+            brute = sorted(geo_distance.haversine_km(latitude, longitude, item.latitude, item.longitude)
+                           for item in points)[:5]
+            self.assertEqual([round(distance, 6) for _, distance in nearest],
+                             [round(distance, 6) for distance in brute])
+        print("✅ Test griglia vs forza bruta OK")
+
+    def test_02_grid_move_and_remove(self):
+        """Test: spostare e togliere un item aggiorna le celle"""
+        grid = GeoGrid()
+        grid.upsert(GeoItem(1, 45.4642, 9.19, 'Duomo', 1.0, 1, None))
+        grid.upsert(GeoItem(1, 41.9028, 12.4964, 'Duomo', 1.0, 1, None))
+        self.assertEqual(len(grid), 1)
+        self.assertEqual(grid.candidates(45.4642, 9.19, 10), [])
+        self.assertEqual(len(grid.candidates(41.9028, 12.4964, 10)), 1)
+
+        grid.remove(1)
+        grid.remove(1)
+        self.assertEqual(len(grid), 0)
+        self.assertEqual(grid._cells, {})
+        print("✅ Test spostamento nella griglia OK")
+
+    def test_03_service_hooks_update_index(self):
+        """Test: creazione, modifica, vendita ed eliminazione aggiornano l'indice"""
+        duomo = self._create('Duomo', 45.4642, 9.1900)
+        self._create('Navigli', 45.4520, 9.1760)
+        self.assertEqual(self._titles('/api/geo/nearby?lat=45.4642&lon=9.1900&radius=10'),
+                         ['Duomo', 'Navigli'])
+
+        # Spostato a Torino
+        success, message, _ = self.items_service.update_item(
+            duomo.id, self.seller_id, title='Mole', latitude=45.0690, longitude=7.6933)
+        self.assertTrue(success, message)
+        self.assertEqual(self._titles('/api/geo/nearby?lat=45.4642&lon=9.1900&radius=10'), ['Navigli'])
+        self.assertEqual(self._titles('/api/geo/nearest?lat=45.07&lon=7.69&k=1'), ['Mole'])
+
+        # Venduto (come dopo il commit di PaymentsService)
+        duomo.is_sold = True
+        db.session.commit()
+        ItemGeoIndex.sync(duomo)
+        self.assertEqual(self._titles('/api/geo/nearest?lat=45.07&lon=7.69&k=5'), ['Navigli'])
+
+        navigli = Item.query.filter_by(title='Navigli').first()
+        success, message = self.items_service.delete_item(navigli.id, self.seller_id)
+        self.assertTrue(success, message)
+        self.assertEqual(self._titles('/api/geo/nearest?lat=45.07&lon=7.69&k=5'), [])
+        print("✅ Test aggiornamento indice dai servizi OK")
+
+    def test_04_periodic_reconcile(self):
+        """Test: le modifiche fuori dai servizi arrivano con il riallineamento"""
+        db.session.add(Item(title='Esterno', price=1.0, seller_id=self.seller_id,
+                            latitude=45.4642, longitude=9.1900))
+        db.session.commit()
+        self.assertEqual(self._titles('/api/geo/nearby?lat=45.4642&lon=9.19&radius=5'), [])
+
+        # Indice scaduto: la richiesta avvia il riallineamento in background
+        self.index.reconciled_at -= ItemGeoIndex.RECONCILE_INTERVAL + 1
+        self._titles('/api/geo/nearby?lat=45.4642&lon=9.19&radius=5')
+        self.index.wait(timeout=10)
+        self.assertEqual(self._titles('/api/geo/nearby?lat=45.4642&lon=9.19&radius=5'), ['Esterno'])
+        print("✅ Test riallineamento periodico OK")
+
+    def test_05_changes_during_reconcile_are_kept(self):
+        """Test: un aggiornamento arrivato durante la ricostruzione non va perso"""
+        load_rows = self.index._load_rows
+
+        def slow_rows():
+            rows = list(load_rows())
+            # Item creato dopo la lettura del database, prima della sostituzione
+            self._create('Intermedio', 45.4642, 9.1900)
+            return rows
+
+        with mock.patch.object(self.index, '_load_rows', slow_rows):
+            self.index.reconcile()
+        self.assertEqual(self._titles('/api/geo/nearby?lat=45.4642&lon=9.19&radius=5'), ['Intermedio'])
+        print("✅ Test modifiche durante il riallineamento OK")
+
+
+class TestGeocodeCache(unittest.TestCase):
+    """Test per la cache del geocoding (Nominatim sostituito da un mock)"""
+
+    MILANO = [{'lat': '45.4642', 'lon': '9.1900', 'display_name': 'Milano, Lombardia, Italia'}]
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(cls.tmp_dir, 'test.db'))
+        cls.app = cls.flask_app.get_app()
+        cls.client = cls.app.test_client()
+
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        GeocodeCache.clear_memory()
+        db.session.remove()
+        db.drop_all()
+        cls.app_context.pop()
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup prima di ogni test: cache vuota"""
+        GeocodeCache.clear_memory()
+        GeocodeCacheEntry.query.delete()
+        db.session.commit()
+
+    def test_01_repeat_queries_hit_cache(self):
+        """Test: query equivalenti chiamano Nominatim una volta sola"""
+        with mock.patch.object(GeolocationService, '_request', return_value=self.MILANO) as request:
+            first = GeolocationService.geocode('Milano, Italy')
+            self.assertEqual(GeolocationService.geocode('  milano ,ITALY '), first)
+            self.assertEqual(GeolocationService.get_city_coordinates('Milano'), first)
+
+            # Nuovo processo (memoria vuota): dal database
+            GeocodeCache.clear_memory()
+            response = self.client.get('/api/geo/geocode?address=MILANO,   Italy')
+            self.assertEqual(response.get_json()['data']['latitude'], 45.4642)
+
+            # Reverse: coordinate arrotondate a ~11 m
+            request.return_value = {'display_name': 'Piazza del Duomo', 'address': {'city': 'Milano'}}
+            GeolocationService.reverse_geocode(45.46421, 9.19001)
+            success, _, data = GeolocationService.reverse_geocode(45.46419, 9.18999)
+        self.assertTrue(success)
+        self.assertEqual(data['city'], 'Milano')
+        self.assertEqual(request.call_count, 2)
+        print("✅ Test cache geocoding OK")
+
+    def test_02_negative_results_cached_errors_not(self):
+        """Test: i "non trovato" restano in cache, gli errori del servizio no"""
+        with mock.patch.object(GeolocationService, '_request', return_value=[]) as request:
+            for _ in range(3):
+                self.assertEqual(GeolocationService.geocode('Xyzzy, Italy'),
+                                 (False, "Indirizzo non trovato", None))
+        self.assertEqual(request.call_count, 1)
+
+        error = GeocodingError("Errore servizio: 503")
+        with mock.patch.object(GeolocationService, '_request', side_effect=error) as request:
+            for _ in range(2):
+                self.assertEqual(GeolocationService.search_address('Torino'),
+                                 (False, "Errore servizio: 503", None))
+        self.assertEqual(request.call_count, 2)
+        self.assertIsNone(GeocodeCacheEntry.query.filter_by(key=GeocodeCache.query_key('search', 'Torino', 5)).first())
+        print("✅ Test cache negativa OK")
+
+    def test_03_stale_while_revalidate(self):
+        """Test: un risultato scaduto è servito subito e aggiornato in background"""
+        key = GeocodeCache.query_key('geocode', 'Milano, Italy')
+        with mock.patch.object(GeolocationService, '_request', return_value=self.MILANO):
+            GeolocationService.geocode('Milano, Italy')
+
+        expired = datetime.utcnow() - GeocodeCache.FRESH_TTL - GeocodeCache.STALE_TTL / 2
+        GeocodeCacheEntry.query.filter_by(key=key).update({'fetched_at': expired})
+        db.session.commit()
+        GeocodeCache.clear_memory()
+
+        moved = [{**self.MILANO[0], 'lat': '45.4700'}]
+        with mock.patch.object(GeolocationService, '_request', return_value=moved) as request:
+            success, _, data = GeolocationService.geocode('Milano, Italy')
+            self.assertTrue(success)
+            self.assertEqual(data['latitude'], 45.4642)
+            GeocodeCache.wait(key, timeout=5)
+        self.assertEqual(request.call_count, 1)
+
+        db.session.expire_all()
+        row = GeocodeCacheEntry.query.filter_by(key=key).one()
+        self.assertEqual(row.data['latitude'], 45.47)
+        self.assertGreater(row.fetched_at, expired)
+
+        # Troppo vecchio anche per lo stale: Nominatim giù, si usa comunque
+        GeocodeCacheEntry.query.filter_by(key=key).update({'fetched_at': datetime(2000, 1, 1)})
+        db.session.commit()
+        GeocodeCache.clear_memory()
+        with mock.patch.object(GeolocationService, '_request', side_effect=GeocodingError("Errore connessione")):
+            self.assertTrue(GeolocationService.geocode('Milano, Italy')[0])
+        self.assertEqual(GeocodeCache.purge_expired(), 1)
+        print("✅ Test stale-while-revalidate OK")
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test per il token bucket di Nominatim"""
+
+    def setUp(self):
+        """Setup prima di ogni test: file di stato nuovo"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'nominatim.bucket')
+
+    def tearDown(self):
+        """Cleanup dopo ogni test"""
+        GeolocationService.RATE_LIMITER = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_01_concurrent_requests_are_spaced(self):
+        """Test: thread di "processi" diversi (stesso file) rispettano il limite"""
+        buckets = [TokenBucket(self.path, rate=20), TokenBucket(self.path, rate=20)]
+        granted = []
+        lock = threading.Lock()
+
+        def request(bucket):
+            self.assertTrue(bucket.acquire(max_wait=5))
+            with lock:
+                granted.append(time.monotonic())
+
+        threads = [threading.Thread(target=request, args=(buckets[i % 2],)) for i in range(6)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        granted.sort()
+        self.assertLess(granted[0] - start, 0.04)
+        for previous, current in zip(granted, granted[1:]):
+            self.assertGreater(current - previous, 0.04)
+        print("✅ Test rate limit condiviso OK")
+
+    def test_02_fail_fast_beyond_deadline(self):
+        """Test: oltre max_wait la richiesta è rifiutata subito senza consumare"""
+        bucket = TokenBucket(self.path, rate=2)
+        self.assertTrue(bucket.acquire(max_wait=0))
+
+        start = time.monotonic()
+        self.assertFalse(bucket.acquire(max_wait=0.1))
+        self.assertFalse(bucket.acquire(max_wait=0.1))
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        # I rifiuti non hanno prenotato turni: il prossimo token arriva dopo 0.5 s
+        self.assertTrue(bucket.acquire(max_wait=0.6))
+        print("✅ Test fail fast OK")
+
+    def test_03_busy_geocoder_returns_503(self):
+        """Test: senza turno entro MAX_QUEUE_WAIT le API rispondono 503"""
+        GeolocationService.RATE_LIMITER = TokenBucket(self.path, rate=0.01)
+        GeolocationService.RATE_LIMITER.acquire()
+
+        tmp_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        app = FlaskApp(db_type="sqlite", db_path=os.path.join(tmp_dir, 'test.db')).get_app()
+        with app.app_context():
+            start = time.monotonic()
+            response = app.test_client().get('/api/geo/geocode?address=Pavia, Italy')
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertEqual(response.get_json()['message'], GeolocationService.BUSY_MESSAGE)
+            with self.assertRaises(GeocodingBusy):
+                GeolocationService.reverse_geocode(45.18, 9.16)
+
+            # Il 503 dipende dal tipo di errore, non dal testo del messaggio
+            error = GeocodingError(GeolocationService.BUSY_MESSAGE)
+            with mock.patch.object(GeolocationService, '_request', side_effect=error):
+                response = app.test_client().get('/api/geo/search?q=Lodi')
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('Retry-After', response.headers)
+            db.session.remove()
+            db.drop_all()
+        print("✅ Test geocoder occupato OK")
+
+
+# Estratti nel formato dei dump GeoNames (località e CAP)
+CITIES_DUMP = '\n'.join('\t'.join(row) for row in [
+    ['3173435', 'Milano', 'Milano', 'Mailand,Milan,Milano', '45.46427', '9.18951', 'P', 'PPLA', 'IT',
+     '', '09', 'MI', '015146', '', '1371498', '', '122', 'Europe/Rome', '2024-01-01'],
+    ['3173529', 'Milazzo', 'Milazzo', '', '38.22008', '15.24023', 'P', 'PPL', 'IT',
+     '', '15', 'ME', '083049', '', '31791', '', '2', 'Europe/Rome', '2024-01-01'],
+    ['3172629', 'Monza', 'Monza', '', '45.58005', '9.27246', 'P', 'PPLA2', 'IT',
+     '', '09', 'MB', '108033', '', '120204', '', '162', 'Europe/Rome', '2024-01-01'],
+    ['3165524', 'Torino', 'Torino', 'Turin', '45.07049', '7.68682', 'P', 'PPLA', 'IT',
+     '', '12', 'TO', '001272', '', '870456', '', '239', 'Europe/Rome', '2024-01-01'],
+    ['3165185', 'Forlì', 'Forli', '', '44.22177', '12.04144', 'P', 'PPLA2', 'IT',
+     '', '05', 'FC', '040012', '', '116434', '', '34', 'Europe/Rome', '2024-01-01'],
+    ['3169070', 'Lago di Como', 'Lago di Como', '', '46.0', '9.27', 'H', 'LK', 'IT',
+     '', '09', '', '', '', '0', '', '198', 'Europe/Rome', '2024-01-01'],
+]) + '\n'
+
+# Località di altre nazioni, per il dump mondiale (cities500)
+WORLD_DUMP = '\n'.join('\t'.join(row) for row in [
+    ['3176219', 'Genova', 'Genova', 'Genoa,Genua', '44.40478', '8.94439', 'P', 'PPLA', 'IT',
+     '', '08', 'GE', '010025', '', '580097', '', '19', 'Europe/Rome', '2024-01-01'],
+    ['4032402', "Nuku'alofa", "Nuku'alofa", '', '-21.13938', '-175.2018', 'P', 'PPLC', 'TO',
+     '', '02', '', '', '', '22400', '', '', 'Pacific/Tongatapu', '2024-01-01'],
+    ['611717', 'Tbilisi', 'Tbilisi', 'Tiflis', '41.69411', '44.83368', 'P', 'PPLC', 'GE',
+     '', '51', '', '', '', '1049498', '', '', 'Asia/Tbilisi', '2024-01-01'],
+    ['2988507', 'Paris', 'Paris', 'Parigi', '48.85341', '2.3488', 'P', 'PPLC', 'FR',
+     '', '11', '75', '751', '', '2138551', '', '42', 'Europe/Paris', '2024-01-01'],
+    ['4717560', 'Paris', 'Paris', '', '33.66094', '-95.55551', 'P', 'PPLA2', 'US',
+     '', 'TX', '277', '', '', '24782', '', '180', 'America/Chicago', '2024-01-01'],
+]) + '\n'
+
+POSTCODES_DUMP = '\n'.join('\t'.join(row) for row in [
+    ['IT', '20121', 'Milano', 'Lombardia', '09', 'Milano', 'MI', '', '', '45.4707', '9.1867', '4'],
+    ['IT', '20900', 'Monza', 'Lombardia', '09', 'Monza e Brianza', 'MB', '', '', '45.5845', '9.2744', '4'],
+    ['IT', '10121', 'Torino', 'Piemonte', '12', 'Torino', 'TO', '', '', '45.0677', '7.6825', '4'],
+]) + '\n'
+
+
+class TestOfflineGeocoder(unittest.TestCase):
+    """Test per il geocoder offline su dump GeoNames"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cities = os.path.join(cls.tmp_dir, 'IT.zip')
+        with zipfile.ZipFile(cities, 'w') as archive:
+            archive.writestr('readme.txt', 'GeoNames')
+            archive.writestr('IT.txt', CITIES_DUMP)
+        postcodes = os.path.join(cls.tmp_dir, 'IT_postcodes.txt')
+        with open(postcodes, 'w', encoding='utf-8') as f:
+            f.write(POSTCODES_DUMP)
+        cls.geocoder = OfflineGeocoder.from_files(cities, postcodes)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def tearDown(self):
+        """Ripristina il provider di default"""
+        GeolocationService.PROVIDER = 'nominatim'
+        GeolocationService.OFFLINE_GEOCODER = None
+        GeolocationService.NOMINATIM_FALLBACK = True
+
+    def test_01_autocomplete_and_geocode(self):
+        """Test: prefissi ordinati per popolazione, nomi alternativi e CAP"""
+        self.assertEqual(len(self.geocoder), 8)  # il lago non è una località
+        names = lambda query: [r['display_name'] for r in self.geocoder.search(query, 5)[2]]
+        self.assertEqual(names('mi'), ['Milano, IT', 'Milazzo, IT'])
+        self.assertEqual(names('Mo'), ['Monza, IT'])
+        self.assertEqual(names('forli'), ['Forlì, IT'])
+        self.assertEqual(names('turi'), ['Torino, IT'])
+        self.assertEqual(names('201'), ['20121, Milano, Lombardia, IT'])
+        self.assertEqual(self.geocoder.search('xyz')[0:2], (False, "Nessun risultato trovato"))
+
+        success, _, data = self.geocoder.geocode('Milan, Italy')
+        self.assertTrue(success)
+        self.assertEqual((data['latitude'], data['longitude']), (45.46427, 9.18951))
+        self.assertEqual(self.geocoder.geocode('10121')[2]['address']['state'], 'Piemonte')
+        self.assertTrue(self.geocoder.geocode('Milano, IT')[0])
+        print("✅ Test autocomplete offline OK")
+
+    def test_02_reverse_with_kd_tree(self):
+        """Test: località e CAP più vicini, nulla in mezzo al mare"""
+        success, _, data = self.geocoder.reverse(45.5820, 9.2700)
+        self.assertTrue(success)
+        self.assertEqual((data['city'], data['postcode']), ('Monza', '20900'))
+        self.assertFalse(self.geocoder.reverse(40.0, 0.0)[0])
+
+        # Stesso risultato di una ricerca esaustiva, anche attorno all'antimeridiano
+        rng = random.Random(7)
+        points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+        tree = KDTree(points)
+        for _ in range(50):
+            lat, lon = rng.uniform(-90, 90), rng.choice([rng.uniform(-180, 180), 179.9, -179.9])
+            index, distance = tree.nearest(lat, lon)
+            expected = min(range(len(points)),
+                           key=lambda i: GeolocationService.calculate_distance(lat, lon, *points[i]))
+            self.assertEqual(index, expected)
+            self.assertAlmostEqual(distance, GeolocationService.calculate_distance(lat, lon, *points[index]), places=6)
+        print("✅ Test reverse offline OK")
+
+    def test_03_provider_with_nominatim_fallback(self):
+        """Test: con il provider offline Nominatim serve solo per ciò che manca"""
+        GeolocationService.PROVIDER = 'offline'
+        GeolocationService.OFFLINE_GEOCODER = self.geocoder
+        street = [{'lat': '45.46', 'lon': '9.19', 'display_name': 'Via Roma 1, Milano'}]
+        with mock.patch.object(GeolocationService, '_request', return_value=street) as request:
+            self.assertEqual(GeolocationService.get_city_coordinates('Torino')[2]['longitude'], 7.68682)
+            self.assertEqual(len(GeolocationService.search_address('Mil')[2]), 2)
+            self.assertEqual(GeolocationService.reverse_geocode(45.07, 7.69)[2]['city'], 'Torino')
+            self.assertEqual(request.call_count, 0)
+
+            with mock.patch.object(GeocodeCache, '_get', return_value=None), \
+                 mock.patch.object(GeocodeCache, '_put'):
+                self.assertEqual(GeolocationService.geocode('Via Roma 1, Milano')[2]['display_name'],
+                                 'Via Roma 1, Milano')
+            self.assertEqual(request.call_count, 1)
+
+            GeolocationService.NOMINATIM_FALLBACK = False
+            self.assertFalse(GeolocationService.geocode('Via Verdi 2, Milano')[0])
+            self.assertEqual(request.call_count, 1)
+        print("✅ Test provider offline OK")
+
+    def test_04_country_names(self):
+        """Test: il nome della nazione (inglese o italiano) limita le omonime"""
+        self.assertTrue(self.geocoder.geocode('Milano, Italia')[0])
+        self.assertTrue(self.geocoder.geocode('Forlì, ITALY')[0])
+        # Nazione non presente nel dizionario: non trovato (poi Nominatim)
+        self.assertFalse(self.geocoder.geocode('Milano, France')[0])
+        self.assertFalse(self.geocoder.geocode('Milano, Francia')[0])
+        # Le sigle di provincia non sono scambiate per codici ISO (TO = Tonga)
+        self.assertTrue(self.geocoder.geocode('Torino, TO')[0])
+
+        GeolocationService.PROVIDER = 'offline'
+        GeolocationService.OFFLINE_GEOCODER = self.geocoder
+        paris = [{'lat': '48.85', 'lon': '2.35', 'display_name': 'Paris, France'}]
+        with mock.patch.object(GeolocationService, '_request', return_value=paris) as request:
+            self.assertEqual(GeolocationService.get_city_coordinates('Milano', 'Italy')[2]['latitude'], 45.46427)
+            self.assertEqual(request.call_count, 0)
+            self.assertEqual(GeolocationService.get_city_coordinates('Milano', 'France')[2]['latitude'], 48.85)
+            self.assertEqual(request.call_count, 1)
+        print("✅ Test nomi delle nazioni offline OK")
+
+    def test_05_province_codes_in_world_dump(self):
+        """Test: con più nazioni le sigle di provincia non svuotano i candidati"""
+        world = os.path.join(self.tmp_dir, 'cities500.zip')
+        with zipfile.ZipFile(world, 'w') as archive:
+            archive.writestr('cities500.txt', CITIES_DUMP + WORLD_DUMP)
+        geocoder = OfflineGeocoder.from_files(world)
+
+        # TO (Tonga) e GE (Georgia) sono nel dump ma non hanno Torino e Genova
+        self.assertEqual(geocoder.geocode('Torino, TO')[2]['latitude'], 45.07049)
+        self.assertEqual(geocoder.geocode('Genova, GE')[2]['latitude'], 44.40478)
+        self.assertEqual(geocoder.geocode('Torino')[2]['latitude'], 45.07049)
+        # Un codice ISO con candidati resta un filtro
+        self.assertEqual(geocoder.geocode('Paris')[2]['latitude'], 48.85341)
+        self.assertEqual(geocoder.geocode('Paris, US')[2]['latitude'], 33.66094)
+        self.assertFalse(geocoder.geocode('Genova, France')[0])
+        print("✅ Test sigle di provincia con dump mondiale OK")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -11,8 +11,10 @@ import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.6_geolocation_api'))
 
 from models import db, Transaction, Item, User
+from item_geo_index import ItemGeoIndex
 
 class PaymentsService:
     """Servizio per gestione pagamenti"""
@@ -137,6 +139,8 @@ class PaymentsService:
                 item.is_sold = True
                 
                 db.session.commit()
+                # Venduto: fuori dalle ricerche nelle vicinanze
+                ItemGeoIndex.sync(item)
                 
                 return True, "Pagamento completato", {
                     'transaction_id': transaction.id,
@@ -287,6 +291,7 @@ class PaymentsService:
             item.is_sold = True
             
             db.session.commit()
+            ItemGeoIndex.sync(item)
             
             return True, "Pagamento in contanti confermato"
             
@@ -0,0 +1,317 @@
+"""
+2.8 - Image Jobs
+Coda in background per l'elaborazione delle immagini caricate
+"""
+
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+
+from models import db, ImageJob
+from images_service import ImagesService
+
+
+class ImageJobQueue:
+    """
+    Coda di job per generare le varianti delle immagini fuori dalla richiesta
+
+    Lo stato dei job è nella tabella image_jobs, quindi sopravvive al riavvio:
+    resume_pending() riaccoda i job rimasti pending e quelli processing il
+    cui processo (owner, host:pid) non è più in vita. Un job passa a
+    processing con un UPDATE condizionato sullo stato pending: se più
+    processi riaccodano lo stesso job lo elabora uno solo.
+    """
+
+    MAX_WORKERS = 2
+    # Job processing di un altro host: considerati interrotti dopo questo tempo
+    STALE_AFTER = timedelta(hours=1)
+
+    _executor = None
+    _futures = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=cls.MAX_WORKERS,
+                    thread_name_prefix='image-jobs'
+                )
+            return cls._executor
+
+    @classmethod
+    def _submit(cls, job_ids, fn, *args):
+        future = cls._get_executor().submit(fn, *args)
+        with cls._lock:
+            for job_id in job_ids:
+                cls._futures[job_id] = future
+        future.add_done_callback(lambda _: cls._forget(job_ids))
+
+    @classmethod
+    def _forget(cls, job_ids):
+        with cls._lock:
+            for job_id in job_ids:
+                cls._futures.pop(job_id, None)
+
+    @classmethod
+    def enqueue(cls, app, item_id, path):
+        """
+        Registra un job e lo avvia in background
+
+        Args:
+            app: applicazione Flask (i worker aprono il proprio app context)
+            item_id: ID dell'item
+            path: percorso relativo dell'originale già salvato
+
+        Returns:
+            ImageJob: job creato (status pending)
+        """
+        job = ImageJob(item_id=item_id, path=path, status='pending')
+        db.session.add(job)
+        db.session.commit()
+
+        cls._submit([job.id], cls._run, app, job.id)
+        return job
+
+    @classmethod
+    def enqueue_batch(cls, app, item_id, paths):
+        """
+        Registra più job e li elabora insieme su un pool di processi
+
+        Args:
+            app: applicazione Flask
+            item_id: ID dell'item
+            paths: percorsi relativi degli originali già salvati
+
+        Returns:
+            list: ImageJob creati (status pending)
+        """
+        jobs = [ImageJob(item_id=item_id, path=path, status='pending') for path in paths]
+        db.session.add_all(jobs)
+        db.session.commit()
+
+        job_ids = [job.id for job in jobs]
+        cls._submit(job_ids, cls._run_batch, app, job_ids)
+        return jobs
+
+    @classmethod
+    def _claim(cls, job_ids):
+        """Passa a processing i job ancora pending, con questo processo come owner"""
+        owner = current_owner()
+        ImageJob.query.filter(
+            ImageJob.id.in_(job_ids),
+            ImageJob.status == 'pending'
+        ).update({
+            'status': 'processing',
+            'owner': owner,
+            'started_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return ImageJob.query.filter(
+            ImageJob.id.in_(job_ids),
+            ImageJob.status == 'processing',
+            ImageJob.owner == owner
+        ).order_by(ImageJob.id).all()
+
+    @classmethod
+    def _run(cls, app, job_id):
+        """Esegue un job nel thread del worker"""
+        with app.app_context():
+            try:
+                jobs = cls._claim([job_id])
+                if not jobs:
+                    # Già completato o preso da un altro processo
+                    return
+
+                results = [(False, "Elaborazione interrotta")]
+                try:
+                    results = [ImagesService.generate_variants(jobs[0].path)]
+                except Exception as e:
+                    results = [(False, f"Errore elaborazione immagine: {str(e)}")]
+                finally:
+                    cls._finish([job_id], results)
+            finally:
+                db.session.remove()
+
+    @classmethod
+    def _run_batch(cls, app, job_ids):
+        """Esegue più job con ImagesService.generate_variants_batch"""
+        with app.app_context():
+            try:
+                jobs = cls._claim(job_ids)
+                if not jobs:
+                    return
+
+                claimed_ids = [job.id for job in jobs]
+                results = [(False, "Elaborazione interrotta")] * len(jobs)
+                try:
+                    results = ImagesService.generate_variants_batch([job.path for job in jobs])
+                except Exception as e:
+                    results = [(False, f"Errore elaborazione immagine: {str(e)}")] * len(jobs)
+                finally:
+                    cls._finish(claimed_ids, results)
+            finally:
+                db.session.remove()
+
+    @classmethod
+    def _finish(cls, job_ids, results):
+        """
+        Registra l'esito dei job presi da questo processo
+
+        Usa una sessione nuova: quella dell'elaborazione può essere rimasta
+        in errore (es. commit delle varianti fallito) e il job resterebbe
+        processing.
+        """
+        db.session.remove()
+        now = datetime.utcnow()
+        for job_id, (success, message) in zip(job_ids, results):
+            ImageJob.query.filter_by(
+                id=job_id, status='processing', owner=current_owner()
+            ).update({
+                'status': 'done' if success else 'failed',
+                'error': None if success else message,
+                'finished_at': now
+            }, synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def resume_pending(cls, app):
+        """
+        Riaccoda i job interrotti (es. riavvio durante l'elaborazione)
+
+        Non fa nulla nei processi figli di multiprocessing: con spawn
+        rieseguono il modulo principale (e quindi la creazione dell'app), ma
+        i job sono del processo padre.
+
+        Args:
+            app: applicazione Flask
+
+        Returns:
+            int: numero di job riaccodati
+        """
+        if multiprocessing.parent_process() is not None:
+            return 0
+
+        with app.app_context():
+            job_ids = []
+            jobs = ImageJob.query.filter(
+                ImageJob.status.in_(['pending', 'processing'])
+            ).order_by(ImageJob.id).all()
+            for job in jobs:
+                if job.status == 'processing':
+                    if cls._owner_alive(job.owner, job.started_at):
+                        continue
+                    # Owner terminato: di nuovo pending, se nessuno l'ha già ripreso
+                    reset = ImageJob.query.filter_by(
+                        id=job.id, status='processing', owner=job.owner
+                    ).update({'status': 'pending', 'owner': None}, synchronize_session=False)
+                    if not reset:
+                        continue
+                job_ids.append(job.id)
+            db.session.commit()
+            db.session.remove()
+
+        if len(job_ids) == 1:
+            cls._submit(job_ids, cls._run, app, job_ids[0])
+        elif job_ids:
+            cls._submit(job_ids, cls._run_batch, app, job_ids)
+        return len(job_ids)
+
+    @classmethod
+    def _owner_alive(cls, owner, started_at):
+        """True se il processo owner di un job processing può essere ancora al lavoro"""
+        if owner is None:
+            # Job precedenti alla colonna owner
+            return False
+        host, _, pid = owner.rpartition(':')
+        if host == socket.gethostname() and pid.isdigit():
+            return _pid_alive(int(pid))
+        # Altro host: non verificabile, vale solo il tempo trascorso
+        return started_at is not None and datetime.utcnow() - started_at < cls.STALE_AFTER
+
+    @classmethod
+    def wait(cls, job_id, timeout=None):
+        """
+        Attende la fine di un job avviato da questo processo
+
+        Args:
+            job_id: ID del job
+            timeout: secondi massimi di attesa (None = senza limite)
+        """
+        with cls._lock:
+            future = cls._futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    @staticmethod
+    def get_job(job_id):
+        """
+        Ottiene un job per ID
+
+        Args:
+            job_id: ID del job
+
+        Returns:
+            ImageJob o None
+        """
+        return db.session.get(ImageJob, job_id)
+
+    @staticmethod
+    def serialize_job(job):
+        """
+        Stato di un job per le risposte API
+
+        Args:
+            job: ImageJob
+
+        Returns:
+            dict: stato e, a job completato, i percorsi delle varianti
+        """
+        directory, filename = job.path.split('/', 1)
+        data = {
+            'id': job.id,
+            'item_id': job.item_id,
+            'path': job.path,
+            'status': job.status,
+            'error': job.error,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+        if job.status == 'done':
+            data['thumbnail'] = f"{directory}/thumb_{filename}"
+            data['medium'] = f"{directory}/medium_{filename}"
+        return data
+
+
+def current_owner():
+    """Owner dei job elaborati da questo processo (host:pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION: os.kill su Windows terminerebbe il processo
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Processo di un altro utente
+        return True
+    return True
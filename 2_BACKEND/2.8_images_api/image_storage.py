@@ -0,0 +1,285 @@
+"""
+2.8 - Image Storage
+Backend di salvataggio dei file immagine: disco locale (anche condiviso tra
+più nodi) o object storage S3 compatibile (AWS S3, MinIO, ...)
+"""
+
+import io
+import os
+import tempfile
+import uuid
+
+
+class ImageStorage:
+    """
+    Interfaccia dei backend di storage
+
+    I file sono identificati da una chiave piatta (es. "thumb_<hash>.jpg"),
+    mai da un percorso: dove e come vengono salvati è compito del backend.
+    I backend non elencano e non controllano l'esistenza dei file, quello
+    che esiste è registrato nel database (image_blobs).
+    """
+
+    def save(self, key, data, content_type=None):
+        """
+        Salva un file (sovrascrive se la chiave esiste già)
+
+        Args:
+            key: chiave del file
+            data: contenuto (bytes)
+            content_type: mimetype, usato dai backend che lo memorizzano
+        """
+        raise NotImplementedError
+
+    def save_stream(self, key, stream, content_type=None):
+        """Come save, leggendo il contenuto da un file aperto"""
+        self.save(key, stream.read(), content_type)
+
+    def begin_upload(self):
+        """
+        Inizia la scrittura a blocchi di un file di cui la chiave si conosce
+        solo alla fine (es. l'hash del contenuto)
+
+        Returns:
+            oggetto con write(chunk), commit(key, content_type) e abort()
+        """
+        return SpooledUpload(self)
+
+    def load(self, key):
+        """
+        Legge un file
+
+        Returns:
+            bytes: contenuto
+
+        Raises:
+            FileNotFoundError: se la chiave non esiste
+        """
+        raise NotImplementedError
+
+    def open(self, key):
+        """
+        Apre un file in lettura binaria (da passare a send_file)
+
+        Raises:
+            FileNotFoundError: se la chiave non esiste
+        """
+        return io.BytesIO(self.load(key))
+
+    def delete(self, key):
+        """
+        Elimina un file
+
+        Returns:
+            bool: True se il file esisteva
+        """
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Percorso su disco del file, o None se il backend non è locale"""
+        return None
+
+
+class SpooledUpload:
+    """
+    Upload generico: in memoria fino a SPOOL_MAX_SIZE, poi su un file
+    temporaneo; il contenuto va al backend con commit()
+    """
+
+    SPOOL_MAX_SIZE = 1024 * 1024
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.file = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_MAX_SIZE)
+
+    def write(self, chunk):
+        return self.file.write(chunk)
+
+    def commit(self, key, content_type=None):
+        self.file.seek(0)
+        self.storage.save_stream(key, self.file, content_type)
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class LocalUpload:
+    """
+    Upload su LocalStorage: scritto a blocchi in root/.incoming/ e spostato
+    con un rename nella cartella finale, senza copie né buffer in memoria
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        incoming = os.path.join(storage.root, '.incoming')
+        os.makedirs(incoming, exist_ok=True)
+        self.path = os.path.join(incoming, uuid.uuid4().hex)
+        self.file = open(self.path, 'wb')
+
+    def write(self, chunk):
+        return self.file.write(chunk)
+
+    def commit(self, key, content_type=None):
+        self.file.close()
+        target = self.storage.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self.path, target)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def shard_name(key):
+    """
+    Parte della chiave usata per lo sharding: l'hash senza prefisso di
+    variante, così originale e varianti finiscono nella stessa cartella
+    """
+    return key.rsplit('_', 1)[-1]
+
+
+class LocalStorage(ImageStorage):
+    """
+    File su disco in cartelle a due livelli ricavate dall'hash:
+    root/9f/86/9f86d081...jpg, root/9f/86/thumb_9f86d081...jpg
+
+    Con milioni di file nessuna cartella supera le poche centinaia di voci.
+    root può essere un volume condiviso (NFS, EFS, ...) montato da più nodi:
+    le scritture passano da un file temporaneo e os.replace, quindi un altro
+    nodo non legge mai un file scritto a metà.
+    """
+
+    def __init__(self, root, depth=2):
+        self.root = root
+        self.depth = depth
+
+    def path(self, key):
+        name = shard_name(key)
+        shards = [name[2 * level:2 * level + 2] for level in range(self.depth)]
+        return os.path.join(self.root, *shards, key)
+
+    def save(self, key, data, content_type=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp_{uuid.uuid4().hex}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def begin_upload(self):
+        return LocalUpload(self)
+
+    def load(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def local_path(self, key):
+        return self.path(key)
+
+
+class S3Storage(ImageStorage):
+    """
+    File in un bucket S3 compatibile (AWS S3, MinIO, Ceph, R2, ...)
+
+    Le chiavi hanno un prefisso di due caratteri dell'hash
+    (<prefix>9f/9f86d081...jpg) per distribuire il carico sulle partizioni
+    del bucket.
+
+    Richiede boto3 (pip install boto3), a meno di passare un client già
+    configurato con la stessa interfaccia (put_object, get_object,
+    delete_object).
+    """
+
+    def __init__(self, bucket, prefix='', client=None, endpoint_url=None, region_name=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("Storage S3 non disponibile: installa boto3") from None
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region_name)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client
+
+    def object_key(self, key):
+        return f"{self.prefix}{shard_name(key)[:2]}/{key}"
+
+    def save(self, key, data, content_type=None):
+        # data: bytes o file aperto
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.object_key(key),
+            Body=data,
+            ContentType=content_type or 'application/octet-stream'
+        )
+
+    def save_stream(self, key, stream, content_type=None):
+        # put_object accetta direttamente un file aperto
+        self.save(key, stream, content_type)
+
+    def load(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        except Exception as e:
+            if _is_missing_key(e):
+                raise FileNotFoundError(key) from None
+            raise
+        return response['Body'].read()
+
+    def delete(self, key):
+        # DELETE su S3 riesce anche se l'oggetto non esiste
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        return True
+
+
+def _is_missing_key(error):
+    """True per l'errore NoSuchKey di botocore (o di un client compatibile)"""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in ('NoSuchKey', '404')
+
+
+def storage_from_env(default_root):
+    """
+    Backend configurato dalle variabili d'ambiente
+
+    IMAGE_STORAGE=local (default): LocalStorage in IMAGE_STORAGE_PATH o in
+    default_root. Per più nodi IMAGE_STORAGE_PATH deve essere un volume
+    condiviso.
+
+    IMAGE_STORAGE=s3: S3Storage su IMAGE_S3_BUCKET, con IMAGE_S3_ENDPOINT_URL
+    (es. http://minio:9000), IMAGE_S3_PREFIX e IMAGE_S3_REGION opzionali; le
+    credenziali sono quelle standard di boto3 (AWS_ACCESS_KEY_ID, ...).
+
+    Args:
+        default_root: cartella dello storage locale se non configurata
+
+    Returns:
+        ImageStorage
+    """
+    backend = os.getenv('IMAGE_STORAGE', 'local').lower()
+    if backend == 's3':
+        return S3Storage(
+            os.environ['IMAGE_S3_BUCKET'],
+            prefix=os.getenv('IMAGE_S3_PREFIX', ''),
+            endpoint_url=os.getenv('IMAGE_S3_ENDPOINT_URL'),
+            region_name=os.getenv('IMAGE_S3_REGION')
+        )
+    if backend == 'local':
+        return LocalStorage(os.getenv('IMAGE_STORAGE_PATH', default_root))
+    raise ValueError(f"IMAGE_STORAGE non valido: {backend}")
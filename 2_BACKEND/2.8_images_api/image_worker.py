@@ -0,0 +1,17 @@
+"""
+2.8 - Image Worker
+Punto di ingresso dei processi del pool di ImagesService.generate_variants_batch
+"""
+
+from images_service import render_variants
+
+
+def _render_variants_worker(data, extension, specs, formats):
+    """
+    Varianti di un'immagine, eseguita in un processo del pool
+
+    I processi spawn importano questo modulo, che arriva solo alle funzioni
+    di rendering (Pillow e modelli) e mai ad app: non avviano l'applicazione
+    né riprendono i job.
+    """
+    return render_variants(data, extension, specs, None, formats)
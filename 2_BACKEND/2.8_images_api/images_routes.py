@@ -3,8 +3,12 @@
 API endpoints per gestione immagini degli oggetti
 """
 
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+import io
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from werkzeug.http import is_resource_modified
 import sys
 import os
 
@@ -13,12 +17,71 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.4_items_api'))
 
 from models import db, Item, User
-from images_service import ImagesService
+from images_service import ImagesService, UploadRejected
+from image_jobs import ImageJobQueue
 
 # Crea blueprint
 images_bp = Blueprint('images', __name__, url_prefix='/api/images')
 
 
+def _receive_uploads(field, max_files):
+    """
+    Legge il corpo multipart in streaming, un file alla volta
+    
+    Ogni file passa da ImagesService.begin_upload: estensione, formato
+    (primi byte) e dimensione sono controllati mentre arriva, e il contenuto
+    va direttamente nello storage invece che nel file temporaneo di
+    request.files. Il corpo della richiesta è limitato a max_files file
+    (Content-Length controllato prima di leggere).
+    
+    Args:
+        field: nome del campo dei file
+        max_files: numero massimo di file accettati
+        
+    Returns:
+        list: ImageUpload ricevuti nel campo (file con nome vuoto esclusi)
+        
+    Raises:
+        UploadRejected: file non valido o troppi file
+        RequestEntityTooLarge: richiesta oltre il limite
+    """
+    uploads = []
+    
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        if not filename:
+            return io.BytesIO()
+        if len(uploads) >= max_files:
+            raise UploadRejected(f"Limite massimo raggiunto ({ImagesService.MAX_IMAGES_PER_ITEM} immagini per oggetto)")
+        upload = ImagesService.begin_upload(filename)
+        uploads.append(upload)
+        return upload
+    
+    try:
+        _, _, files = parse_form_data(
+            request.environ,
+            stream_factory=stream_factory,
+            max_content_length=ImagesService.max_request_size(max_files),
+            silent=False
+        )
+    except Exception:
+        for upload in uploads:
+            upload.abort()
+        raise
+    
+    received = [file.stream for file in files.getlist(field) if file.filename]
+    for upload in uploads:
+        if upload not in received:
+            upload.abort()
+    return received
+
+
+def _too_large_response():
+    return jsonify({
+        "success": False,
+        "message": f"File troppo grande. Massimo {ImagesService.MAX_FILE_SIZE / (1024*1024):.1f}MB"
+    }), 413
+
+
 @images_bp.route('/upload/<int:item_id>', methods=['POST'])
 @jwt_required()
 def upload_image(item_id):
@@ -34,12 +97,19 @@ def upload_image(item_id):
         "image": <file>
     }
     
+    L'originale viene validato e salvato subito; thumbnail e medium sono
+    generati in background (stato in GET /api/images/jobs/<job_id>).
+    Se la stessa immagine è già salvata (anche per un altro oggetto) viene
+    solo aggiunto un riferimento, senza job.
+    
     Returns:
-        201: Immagine caricata
+        201: Immagine già presente, riferimento aggiunto
+        202: Immagine caricata, varianti in elaborazione
         400: Dati non validi
         401: Non autenticato
         403: Non autorizzato (non proprietario)
         404: Item non trovato
+        413: Richiesta oltre la dimensione massima
     """
     try:
         # Verifica autenticazione
@@ -68,23 +138,25 @@ def upload_image(item_id):
                 "message": limit_message
             }), 400
         
-        # Verifica presenza file
-        if 'image' not in request.files:
+        # Ricevi il file in streaming, validato mentre arriva
+        try:
+            uploads = _receive_uploads('image', max_files=1)
+        except UploadRejected as e:
             return jsonify({
                 "success": False,
-                "message": "Nessuna immagine fornita"
+                "message": str(e)
             }), 400
+        except RequestEntityTooLarge:
+            return _too_large_response()
         
-        file = request.files['image']
-        
-        if file.filename == '':
+        if not uploads:
             return jsonify({
                 "success": False,
-                "message": "Nessun file selezionato"
+                "message": "Nessuna immagine fornita"
             }), 400
         
-        # Salva immagine
-        success, message, data = ImagesService.save_image(file, item_id)
+        # Salva l'originale, le varianti arrivano dalla coda
+        success, message, data = ImagesService.store_upload(uploads[0], item_id)
         
         if not success:
             return jsonify({
@@ -98,6 +170,11 @@ def upload_image(item_id):
             item.image_url = data['path']
             db.session.commit()
         
+        # Varianti da generare solo per contenuti nuovi
+        job = None
+        if data['new_blob']:
+            job = ImageJobQueue.enqueue(current_app._get_current_object(), item_id, data['path'])
+        
         return jsonify({
             "success": True,
             "message": message,
@@ -108,9 +185,136 @@ def upload_image(item_id):
                 "thumbnail": data['thumbnail'],
                 "medium": data['medium'],
                 "size": data['size'],
-                "is_primary": not item.image_url or item.image_url == data['path']
+                "is_primary": not item.image_url or item.image_url == data['path'],
+                "duplicate": data['duplicate'],
+                "job": {
+                    "id": job.id,
+                    "status": job.status,
+                    "url": f"/api/images/jobs/{job.id}"
+                } if job else None
             }
-        }), 201
+        }), 202 if job else 201
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Errore server: {str(e)}"
+        }), 500
+
+
+@images_bp.route('/upload/<int:item_id>/batch', methods=['POST'])
+@jwt_required()
+def upload_images_batch(item_id):
+    """
+    Upload di più immagini insieme per un item (richiede autenticazione)
+    
+    Gli originali sono salvati subito; le varianti di tutto il lotto sono
+    generate da un unico job su un pool di processi.
+    
+    POST /api/images/upload/<item_id>/batch
+    Headers: {
+        "Authorization": "Bearer <access_token>",
+        "Content-Type": "multipart/form-data"
+    }
+    Form Data: {
+        "images": <file>, "images": <file>, ...
+    }
+    
+    Returns:
+        202: Immagini caricate, varianti in elaborazione
+        400: Dati non validi o limite superato
+        401: Non autenticato
+        403: Non autorizzato (non proprietario)
+        404: Item non trovato
+        413: Richiesta oltre la dimensione massima
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        
+        item = Item.query.get(item_id)
+        if not item:
+            return jsonify({
+                "success": False,
+                "message": "Oggetto non trovato"
+            }), 404
+        
+        if item.seller_id != current_user_id:
+            return jsonify({
+                "success": False,
+                "message": "Non sei autorizzato a caricare immagini per questo oggetto"
+            }), 403
+        
+        # Il lotto intero deve stare nel limite: la ricezione si ferma al
+        # primo file oltre i posti liberi
+        remaining = ImagesService.MAX_IMAGES_PER_ITEM - ImagesService.get_item_images_count(item_id)
+        if remaining <= 0:
+            return jsonify({
+                "success": False,
+                "message": f"Limite massimo raggiunto ({ImagesService.MAX_IMAGES_PER_ITEM} immagini per oggetto)"
+            }), 400
+        
+        try:
+            uploads = _receive_uploads('images', max_files=remaining)
+        except UploadRejected as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        except RequestEntityTooLarge:
+            return _too_large_response()
+        
+        if not uploads:
+            return jsonify({
+                "success": False,
+                "message": "Nessuna immagine fornita"
+            }), 400
+        
+        stored = []
+        for index, upload in enumerate(uploads):
+            success, message, data = ImagesService.store_upload(upload, item_id)
+            if not success:
+                # Lotto tutto o niente: rilascia solo i riferimenti creati da
+                # questa richiesta (le immagini che l'item aveva già restano)
+                for pending in uploads[index + 1:]:
+                    pending.abort()
+                for data in stored:
+                    if not data['duplicate']:
+                        ImagesService.delete_image(data['path'])
+                return jsonify({
+                    "success": False,
+                    "message": f"{upload.filename}: {message}"
+                }), 400
+            stored.append(data)
+        
+        if not item.image_url:
+            item.image_url = stored[0]['path']
+            db.session.commit()
+        
+        new_paths = [data['path'] for data in stored if data['new_blob']]
+        jobs = {}
+        if new_paths:
+            batch = ImageJobQueue.enqueue_batch(current_app._get_current_object(), item_id, new_paths)
+            jobs = {job.path: job for job in batch}
+        
+        return jsonify({
+            "success": True,
+            "message": f"{len(stored)} immagini caricate",
+            "data": [{
+                "item_id": item_id,
+                "filename": data['filename'],
+                "path": data['path'],
+                "thumbnail": data['thumbnail'],
+                "medium": data['medium'],
+                "size": data['size'],
+                "is_primary": item.image_url == data['path'],
+                "duplicate": data['duplicate'],
+                "job": {
+                    "id": jobs[data['path']].id,
+                    "status": jobs[data['path']].status,
+                    "url": f"/api/images/jobs/{jobs[data['path']].id}"
+                } if data['path'] in jobs else None
+            } for data in stored]
+        }), 202 if jobs else 201
         
     except Exception as e:
         return jsonify({
@@ -125,12 +329,33 @@ def get_image(item_id, filename):
     Recupera un'immagine
     
     GET /api/images/<item_id>/<filename>?size=original|medium|thumbnail
+    GET /api/images/<item_id>/<filename>?w=320&h=240&fit=contain|cover
+    
+    Con w e/o h l'immagine è ridimensionata su richiesta (lati tra
+    ImagesService.RESIZE_DIMENSIONS) e servita da una cache su disco.
+    
+    Per thumbnail e medium il formato è scelto dall'header Accept: AVIF o
+    WebP se il client li dichiara e sono stati generati, altrimenti quello
+    originale.
+    
+    Finché thumbnail e medium non sono pronti viene servito l'originale
+    come segnaposto (header X-Image-Placeholder, non cacheabile).
+    
+    I file non cambiano dopo il salvataggio: le risposte hanno ETag (sha256
+    del contenuto) e Cache-Control immutable. Formati ed ETag sono letti dal
+    database: una richiesta condizionale riceve 304 senza accedere allo
+    storage.
     
     Returns:
         200: File immagine
+        304: Non modificata (If-None-Match / If-Modified-Since)
+        400: Parametri di ridimensionamento non validi
         404: Immagine non trovata
     """
     try:
+        if 'w' in request.args or 'h' in request.args:
+            return _get_resized_image(item_id, filename)
+        
         # Query parameter per la dimensione
         size = request.args.get('size', 'original')
         
@@ -140,17 +365,138 @@ def get_image(item_id, filename):
         # Costruisci percorso relativo
         relative_path = f"item_{item_id}/{filename}"
         
-        # Ottieni percorso completo
-        full_path = ImagesService.get_image_path(relative_path, size)
+        # Formati dichiarati esplicitamente dal client (image/avif, image/webp)
+        accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+        
+        # File da servire nel formato migliore disponibile
+        image = ImagesService.select_variant(relative_path, size, accepted)
         
-        if not full_path:
+        # Variante ancora in elaborazione: segnaposto con l'originale
+        if not image and size != 'original':
+            image = ImagesService.select_variant(relative_path, 'original', accepted)
+            if image:
+                response = send_file(_open_image(image['key']), mimetype=image['mimetype'])
+                response.headers['Cache-Control'] = 'no-store'
+                response.headers['X-Image-Placeholder'] = '1'
+                return response
+        
+        if not image:
             return jsonify({
                 "success": False,
                 "message": "Immagine non trovata"
             }), 404
         
-        # Invia file
-        return send_file(full_path, mimetype='image/jpeg')
+        response = _send_cached(image, lambda: _open_image(image['key']))
+        if size != 'original':
+            response.vary.add('Accept')
+        return response
+        
+    except FileNotFoundError:
+        return jsonify({
+            "success": False,
+            "message": "Immagine non trovata"
+        }), 404
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Errore: {str(e)}"
+        }), 500
+
+
+def _get_resized_image(item_id, filename):
+    """Risposta di get_image con w/h: ridimensionamento su richiesta"""
+    success, message, params = ImagesService.parse_resize(
+        request.args.get('w'), request.args.get('h'), request.args.get('fit')
+    )
+    if not success:
+        return jsonify({
+            "success": False,
+            "message": message
+        }), 400
+    
+    accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+    image = ImagesService.select_resized(f"item_{item_id}/{filename}", *params, accepted)
+    if not image:
+        return jsonify({
+            "success": False,
+            "message": "Immagine non trovata"
+        }), 404
+    
+    response = _send_cached(image, lambda: ImagesService.open_resized(image))
+    response.vary.add('Accept')
+    return response
+
+
+def _send_cached(image, open_file):
+    """
+    Risposta per un file immutabile descritto da select_variant/select_resized
+    
+    Se il client ha già il file (If-None-Match / If-Modified-Since) risponde
+    304 senza chiamare open_file.
+    """
+    if is_resource_modified(request.environ, etag=image['etag'], last_modified=image['last_modified']):
+        # send_file gestisce anche le richieste Range
+        response = send_file(
+            open_file(),
+            mimetype=image['mimetype'],
+            etag=image['etag'],
+            last_modified=image['last_modified'],
+            conditional=True
+        )
+    else:
+        response = current_app.response_class(status=304)
+        response.set_etag(image['etag'])
+        response.last_modified = image['last_modified']
+    
+    response.headers['Cache-Control'] = f'public, max-age={ImagesService.CACHE_MAX_AGE}, immutable'
+    return response
+
+
+def _open_image(key):
+    """Percorso su disco se lo storage è locale, altrimenti uno stream"""
+    storage = ImagesService.get_storage()
+    return storage.local_path(key) or storage.open(key)
+
+
+@images_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_image_job(job_id):
+    """
+    Stato dell'elaborazione di un'immagine caricata (solo proprietario)
+    
+    GET /api/images/jobs/<job_id>
+    Headers: {
+        "Authorization": "Bearer <access_token>"
+    }
+    
+    Returns:
+        200: Stato job (pending, processing, done, failed)
+        401: Non autenticato
+        403: Non autorizzato (non proprietario)
+        404: Job non trovato
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        
+        job = ImageJobQueue.get_job(job_id)
+        if not job:
+            return jsonify({
+                "success": False,
+                "message": "Job non trovato"
+            }), 404
+        
+        # Verifica proprietà dell'item
+        item = Item.query.get(job.item_id)
+        if item is None or item.seller_id != current_user_id:
+            return jsonify({
+                "success": False,
+                "message": "Non autorizzato"
+            }), 403
+        
+        return jsonify({
+            "success": True,
+            "data": ImageJobQueue.serialize_job(job)
+        }), 200
         
     except Exception as e:
         return jsonify({
@@ -244,27 +590,10 @@ def get_item_images(item_id):
                 "message": "Oggetto non trovato"
             }), 404
         
-        # Cartella item
-        item_folder = os.path.join(ImagesService.UPLOAD_FOLDER, f"item_{item_id}")
-        
-        images = []
-        
-        if os.path.exists(item_folder):
-            # Lista file (esclusi thumbnail e medium)
-            files = [f for f in os.listdir(item_folder) 
-                    if os.path.isfile(os.path.join(item_folder, f))
-                    and not f.startswith('thumb_')
-                    and not f.startswith('medium_')]
-            
-            for filename in files:
-                relative_path = f"item_{item_id}/{filename}"
-                images.append({
-                    "filename": filename,
-                    "url": f"/api/images/{item_id}/{filename}",
-                    "thumbnail": f"/api/images/{item_id}/{filename}?size=thumbnail",
-                    "medium": f"/api/images/{item_id}/{filename}?size=medium",
-                    "is_primary": item.image_url == relative_path
-                })
+        images = [
+            ImagesService.serialize_item_image(image, item.image_url)
+            for image in ImagesService.get_item_images(item_id)
+        ]
         
         return jsonify({
             "success": True,
@@ -318,9 +647,8 @@ def set_primary_image(item_id, filename):
         
         # Verifica che l'immagine esista
         relative_path = f"item_{item_id}/{filename}"
-        full_path = ImagesService.get_image_path(relative_path)
         
-        if not full_path:
+        if not ImagesService.get_image_key(relative_path):
             return jsonify({
                 "success": False,
                 "message": "Immagine non trovata"
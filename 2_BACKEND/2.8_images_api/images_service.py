@@ -4,13 +4,336 @@ Servizio per la gestione delle immagini degli oggetti
 """
 
 import os
-import uuid
-import imghdr
-from datetime import datetime
+import io
+import re
+import sys
+import base64
+import shutil
+import hashlib
+import mimetypes
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
+from PIL import Image, ImageOps
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+from models import db, Item, ImageBlob, ItemImage
+from image_storage import storage_from_env
+from resize_cache import ResizeCache
+
+try:
+    import pillow_avif  # noqa: F401  Registra AVIF nelle versioni di Pillow senza supporto nativo
+except ImportError:
+    pass
+
+
+# Formati moderni generati accanto a ogni variante, in ordine di preferenza:
+# (estensione, mimetype, opzioni di salvataggio)
+MODERN_FORMATS = [
+    ('avif', 'image/avif', {'quality': 60}),
+    ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+]
+
+
+def available_modern_formats():
+    """Formati moderni che la build di Pillow installata sa codificare"""
+    extensions = Image.registered_extensions()
+    return [fmt for fmt in MODERN_FORMATS if f'.{fmt[0]}' in extensions]
+
+
+# Encoder condiviso: Pillow rilascia il GIL durante la codifica, quindi
+# le varianti di un'immagine si codificano in parallelo anche con i thread
+ENCODE_WORKERS = 4
+_encode_executor = None
+_encode_executor_lock = threading.Lock()
+
+
+def _get_encode_executor():
+    global _encode_executor
+    with _encode_executor_lock:
+        if _encode_executor is None:
+            _encode_executor = ThreadPoolExecutor(
+                max_workers=ENCODE_WORKERS,
+                thread_name_prefix='image-encode'
+            )
+        return _encode_executor
+
+
+def _to_rgb(img):
+    """Converte in RGB (RGBA e P con trasparenza su sfondo bianco)"""
+    if img.mode == 'RGB':
+        return img
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA'):
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        rgb_img.paste(img, mask=img.getchannel('A'))
+        return rgb_img
+    return img.convert('RGB')
+
+
+def _encode(img, extension, options):
+    buffer = io.BytesIO()
+    img.save(buffer, format=Image.registered_extensions()[f'.{extension}'], **options)
+    return buffer.getvalue()
+
+
+# Segnaposto (LQIP) incluso nelle risposte JSON: lato massimo in pixel.
+# In WebP un 16x12 pesa ~100 byte; JPEG se la build di Pillow non ha WebP
+PLACEHOLDER_SIZE = (16, 16)
+
+
+def render_placeholder(img):
+    """
+    Immagine minuscola da mostrare sfocata finché non arriva il thumbnail
+    
+    Args:
+        img: immagine RGB già ridotta (es. il thumbnail)
+        
+    Returns:
+        str: data URI (data:image/webp;base64,...)
+    """
+    tiny = img.copy()
+    tiny.thumbnail(PLACEHOLDER_SIZE, Image.Resampling.LANCZOS)
+    if '.webp' in Image.registered_extensions():
+        mimetype, data = 'image/webp', _encode(tiny, 'webp', {'quality': 50})
+    else:
+        mimetype, data = 'image/jpeg', _encode(tiny, 'jpg', {'quality': 50, 'optimize': True})
+    return f"data:{mimetype};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def render_variants(data, extension, specs, executor=None, formats=()):
+    """
+    Genera le varianti di un'immagine con una sola decodifica
+    
+    Per i JPEG draft() fa decodificare direttamente a una scala ridotta
+    (1/2, 1/4, 1/8) non inferiore alla variante più grande; ogni variante è
+    poi ricavata dalla precedente, non dall'originale. Le codifiche finali
+    vanno sull'executor se fornito.
+    
+    Per ogni formato in formats ogni variante è codificata anche in quel
+    formato (es. WebP accanto al JPEG). Dalla variante più piccola si ricava
+    anche il segnaposto (render_placeholder).
+    
+    Funzione di modulo (non metodo) senza accesso a storage e database, per
+    poter essere eseguita in un ProcessPoolExecutor: riceve e restituisce
+    bytes, il salvataggio è di chi la chiama.
+    
+    Args:
+        data: contenuto dell'originale
+        extension: estensione dell'originale (formato delle varianti base)
+        specs: tuple (dimensione, lato massimo, qualità), dalla più grande
+        executor: executor per le codifiche (None = nel thread corrente)
+        formats: formati moderni aggiuntivi, come in MODERN_FORMATS
+        
+    Returns:
+        tuple: (success, message, rendered, placeholder)
+               rendered = {dimensione: {estensione: bytes}}
+               placeholder = data URI del segnaposto
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft('RGB', specs[0][1])
+            source = _to_rgb(img)
+            source.load()
+        
+        jobs = []
+        for size_name, size, quality in specs:
+            # reduce() intero prima del LANCZOS finale
+            variant = source.copy()
+            variant.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            jobs.append((size_name, extension, variant, {'quality': quality, 'optimize': True}))
+            for modern_extension, _, options in formats:
+                if modern_extension != extension:
+                    jobs.append((size_name, modern_extension, variant, options))
+            source = variant
+        
+        if executor is None:
+            encoded = [_encode(img, ext, options) for _, ext, img, options in jobs]
+        else:
+            futures = [executor.submit(_encode, img, ext, options) for _, ext, img, options in jobs]
+            encoded = [future.result() for future in futures]
+        
+        rendered = {}
+        for (size_name, ext, _, _), content in zip(jobs, encoded):
+            rendered.setdefault(size_name, {})[ext] = content
+        return True, "Varianti create", rendered, render_placeholder(source)
+        
+    except Exception as e:
+        return False, f"Errore elaborazione immagine: {str(e)}", None, None
+
+
+def render_resized(data, extension, width, height, fit, quality, output=None):
+    """
+    Ridimensiona un'immagine a una dimensione richiesta dal client
+    
+    Con fit='contain' l'immagine sta nel riquadro width x height (uno dei
+    due può mancare); con fit='cover' lo riempie ed è ritagliata al centro.
+    Le immagini non vengono mai ingrandite. Come render_variants, per i
+    JPEG decodifica direttamente a scala ridotta.
+    
+    Args:
+        data: contenuto della sorgente (originale o medium)
+        extension: estensione della sorgente
+        width, height: riquadro in pixel (None = libero, solo per contain)
+        fit: 'contain' o 'cover'
+        quality: qualità per il formato della sorgente
+        output: formato moderno come in MODERN_FORMATS (None = come la sorgente)
+        
+    Returns:
+        bytes: immagine codificata
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        if fit == 'cover':
+            scale = max(width / img.width, height / img.height)
+            if scale > 1:
+                # Sorgente più piccola del riquadro: stesse proporzioni, senza ingrandire
+                width, height = round(width / scale), round(height / scale)
+                scale = 1
+            img.draft('RGB', (round(img.width * scale), round(img.height * scale)))
+            source = _to_rgb(img)
+            resized = ImageOps.fit(source, (width, height), Image.Resampling.LANCZOS)
+        else:
+            box = (width or img.width, height or img.height)
+            img.draft('RGB', box)
+            resized = _to_rgb(img)
+            resized.thumbnail(box, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    
+    if output is None:
+        return _encode(resized, extension, {'quality': quality, 'optimize': True})
+    output_extension, _, options = output
+    return _encode(resized, output_extension, options)
+
+
+# Byte iniziali necessari a riconoscere tutti i formati accettati
+SNIFF_BYTES = 12
+
+# Estensioni di ogni tipo riconosciuto da sniff_image_type (la prima è quella
+# usata quando l'estensione del client non corrisponde al contenuto)
+IMAGE_TYPE_EXTENSIONS = {
+    'png': ('png',),
+    'jpeg': ('jpg', 'jpeg'),
+    'gif': ('gif',),
+    'webp': ('webp',),
+}
+
+
+def sniff_image_type(head):
+    """
+    Tipo di immagine dai primi byte del file (magic number)
+    
+    Args:
+        head: almeno i primi SNIFF_BYTES byte
+        
+    Returns:
+        str: 'png', 'jpeg', 'gif', 'webp' o None
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class UploadRejected(Exception):
+    """Upload rifiutato durante la ricezione; il messaggio è per l'utente"""
+
+
+class ImageUpload:
+    """
+    File in arrivo, validato mentre viene scritto nello storage
+    
+    Il contenuto arriva a blocchi con write(): il formato è controllato sui
+    primi byte e la dimensione a ogni blocco, quindi un file non valido o
+    troppo grande viene fermato appena lo si capisce, senza riceverlo tutto.
+    Intanto si calcola lo sha256, che diventa la chiave del blob.
+    L'estensione è quella del nome del client solo se corrisponde al tipo
+    riconosciuto dai primi byte (un JPEG chiamato x.png è salvato come jpg).
+    
+    Ha l'interfaccia di file attesa dal parser multipart di Werkzeug
+    (write, seek): può essere restituito da uno stream_factory.
+    """
+    
+    # Inizio del file tenuto in memoria per leggere le dimensioni dall'header
+    HEAD_BYTES = 64 * 1024
+    
+    def __init__(self, filename, target, max_size):
+        self.filename = filename
+        self.extension = filename.rsplit('.', 1)[-1].lower()
+        self.size = 0
+        self.image_type = None
+        self._target = target
+        self._max_size = max_size
+        self._digest = hashlib.sha256()
+        self._head = bytearray()
+        self._open = True
+    
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self._max_size:
+            raise UploadRejected(f"File troppo grande. Massimo {self._max_size / (1024*1024):.1f}MB")
+        
+        if len(self._head) < self.HEAD_BYTES:
+            self._head += chunk[:self.HEAD_BYTES - len(self._head)]
+        if self.image_type is None and len(self._head) >= SNIFF_BYTES:
+            self._sniff()
+        
+        self._digest.update(chunk)
+        self._target.write(chunk)
+        return len(chunk)
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        # Werkzeug riavvolge il file a fine parte: qui non c'è nulla da rileggere
+        return 0
+    
+    def _sniff(self):
+        self.image_type = sniff_image_type(bytes(self._head[:SNIFF_BYTES]))
+        if self.image_type is None:
+            raise UploadRejected("Il file non è un'immagine valida")
+        extensions = IMAGE_TYPE_EXTENSIONS[self.image_type]
+        if self.extension not in extensions:
+            self.extension = extensions[0]
+    
+    def finish(self):
+        """
+        Conclude la ricezione (valida anche i file più corti di SNIFF_BYTES)
+        
+        Returns:
+            str: sha256 del contenuto
+        """
+        if self.image_type is None:
+            self._sniff()
+        return self._digest.hexdigest()
+    
+    def dimensions(self):
+        """(larghezza, altezza) dall'header, (None, None) se non è nei primi HEAD_BYTES"""
+        try:
+            with Image.open(io.BytesIO(bytes(self._head))) as img:
+                return img.size
+        except Exception:
+            return None, None
+    
+    def commit(self, key, content_type=None):
+        """Rende il file definitivo nello storage con la chiave data"""
+        self._target.commit(key, content_type)
+        self._open = False
+    
+    def abort(self):
+        """Scarta il file (nessun effetto dopo commit)"""
+        if self._open:
+            self._target.abort()
+            self._open = False
+
+
 class ImagesService:
     """Servizio per gestione upload e manipolazione immagini"""
     
@@ -19,11 +342,95 @@ class ImagesService:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
     MAX_IMAGES_PER_ITEM = 5
+    UPLOAD_CHUNK_SIZE = 64 * 1024
     
     # Dimensioni per resize
     THUMBNAIL_SIZE = (200, 200)
     MEDIUM_SIZE = (800, 800)
     
+    # I nomi file sono l'hash del contenuto, quindi un file non cambia mai:
+    # i client possono tenerlo in cache per sempre
+    CACHE_MAX_AGE = 365 * 24 * 3600
+    
+    # Prefisso dei file delle varianti per dimensione
+    SIZE_PREFIXES = {'original': '', 'medium': 'medium_', 'thumbnail': 'thumb_'}
+    
+    # Ridimensionamento su richiesta (?w=&h=&fit=): lati ammessi, per non
+    # riempire la cache con dimensioni arbitrarie, e modalità
+    RESIZE_DIMENSIONS = (64, 96, 128, 160, 200, 240, 320, 400, 480, 640, 800, 960, 1200, 1600)
+    RESIZE_FITS = ('contain', 'cover')
+    RESIZE_QUALITY = 85
+    
+    # Cache su disco dei ridimensionamenti (ResizeCache); None = creata al
+    # primo uso in IMAGE_RESIZE_CACHE_PATH, limite IMAGE_RESIZE_CACHE_MB
+    RESIZE_CACHE = None
+    RESIZE_CACHE_MAX_MB = 256
+    
+    # Backend dei file (ImageStorage); None = da variabili d'ambiente, vedi
+    # image_storage.storage_from_env (default: disco locale in blob_folder())
+    STORAGE = None
+    
+    @staticmethod
+    def get_storage():
+        """Backend di storage in uso, creato al primo accesso"""
+        if ImagesService.STORAGE is None:
+            ImagesService.STORAGE = storage_from_env(ImagesService.blob_folder())
+        return ImagesService.STORAGE
+    
+    @staticmethod
+    def get_resize_cache():
+        """Cache dei ridimensionamenti su richiesta, creata al primo accesso"""
+        if ImagesService.RESIZE_CACHE is None:
+            ImagesService.RESIZE_CACHE = ResizeCache(
+                os.getenv('IMAGE_RESIZE_CACHE_PATH', os.path.join(ImagesService.UPLOAD_FOLDER, 'resized')),
+                int(os.getenv('IMAGE_RESIZE_CACHE_MB', ImagesService.RESIZE_CACHE_MAX_MB)) * 1024 * 1024
+            )
+        return ImagesService.RESIZE_CACHE
+    
+    @staticmethod
+    def blob_folder():
+        """Cartella di default dello storage locale dei blob"""
+        return os.path.join(ImagesService.UPLOAD_FOLDER, 'blobs')
+    
+    @staticmethod
+    def variant_key(filename, size='original', extension=None):
+        """
+        Chiave nello storage di un blob o di una sua variante
+        
+        Args:
+            filename: nome del blob (<hash>.<estensione>)
+            size: 'original', 'medium', 'thumbnail'
+            extension: formato della variante se diverso da quello del blob
+            
+        Returns:
+            str: chiave (es. thumb_<hash>.jpg, thumb_<hash>.jpg.webp)
+        """
+        key = f"{ImagesService.SIZE_PREFIXES.get(size, '')}{filename}"
+        if extension and extension != filename.rsplit('.', 1)[-1]:
+            key = f"{key}.{extension}"
+        return key
+    
+    @staticmethod
+    def mimetype_for(extension):
+        """Mimetype di un'estensione (anche AVIF, sconosciuto a mimetypes)"""
+        for modern_extension, mimetype, _ in MODERN_FORMATS:
+            if extension == modern_extension:
+                return mimetype
+        return mimetypes.guess_type(f"file.{extension}")[0] or 'application/octet-stream'
+    
+    @staticmethod
+    def parse_path(filepath):
+        """
+        Scompone un percorso relativo "item_<id>/<filename>"
+        
+        Returns:
+            tuple: (item_id, filename) o (None, None) se non valido
+        """
+        match = re.fullmatch(r'item_(\d+)/([^/]+)', filepath or '')
+        if not match:
+            return None, None
+        return int(match.group(1)), match.group(2)
+    
     @staticmethod
     def validate_file_extension(filename):
         """
@@ -56,12 +463,12 @@ class ImagesService:
             position = file_stream.tell()
             
             # Verifica header immagine
-            image_type = imghdr.what(file_stream)
+            image_type = sniff_image_type(file_stream.read(SNIFF_BYTES))
             
             # Ripristina posizione
             file_stream.seek(position)
             
-            if image_type in ['png', 'jpeg', 'gif', 'webp']:
+            if image_type:
                 return True, image_type
             return False, None
             
@@ -70,123 +477,336 @@ class ImagesService:
             return False, None
     
     @staticmethod
-    def generate_unique_filename(original_filename):
+    def max_request_size(files=1):
+        """Byte massimi di una richiesta multipart con il numero di file dato"""
+        # Margine per intestazioni delle parti e campi di testo
+        return files * ImagesService.MAX_FILE_SIZE + 64 * 1024
+    
+    @staticmethod
+    def begin_upload(filename):
         """
-        Genera un nome file unico e sicuro
+        Inizia la ricezione di un file verso lo storage
         
         Args:
-            original_filename: nome file originale
+            filename: nome del file scelto dal client (solo per l'estensione)
             
         Returns:
-            str: nome file unico
+            ImageUpload
+            
+        Raises:
+            UploadRejected: estensione non permessa
         """
-        # Estrai estensione
-        ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'jpg'
+        if not ImagesService.validate_file_extension(filename):
+            raise UploadRejected("Formato file non supportato. Usa: PNG, JPG, JPEG, GIF, WEBP")
+        return ImageUpload(filename, ImagesService.get_storage().begin_upload(), ImagesService.MAX_FILE_SIZE)
+    
+    @staticmethod
+    def store_original(file, item_id):
+        """
+        Valida un upload e salva solo l'originale, senza elaborarlo
+        
+        Il file è copiato a blocchi attraverso un ImageUpload, con gli stessi
+        controlli dell'upload in streaming. Gli endpoint HTTP usano
+        direttamente store_upload sui file ricevuti in streaming.
         
-        # Genera UUID
-        unique_id = str(uuid.uuid4())
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        Args:
+            file: file upload (FileStorage)
+            item_id: ID dell'item a cui appartiene l'immagine
+            
+        Returns:
+            tuple: (success, message, data) come store_upload
+        """
+        try:
+            upload = ImagesService.begin_upload(file.filename)
+        except UploadRejected as e:
+            return False, str(e), None
         
-        return f"{timestamp}_{unique_id}.{ext}"
+        try:
+            for chunk in iter(lambda: file.stream.read(ImagesService.UPLOAD_CHUNK_SIZE), b''):
+                upload.write(chunk)
+        except UploadRejected as e:
+            upload.abort()
+            return False, str(e), None
+        
+        return ImagesService.store_upload(upload, item_id)
     
     @staticmethod
-    def save_image(file, item_id):
+    def store_upload(upload, item_id):
         """
-        Salva un'immagine e crea thumbnail e versione media
+        Registra un file ricevuto e salva solo l'originale, senza elaborarlo
+        
+        L'originale è salvato una sola volta nel blob store, con l'hash del
+        contenuto come nome: ricaricare la stessa foto (anche su un altro
+        item) aggiunge solo un riferimento. Le varianti vanno create dopo con
+        generate_variants (in background tramite ImageJobQueue, o subito con
+        save_image), e solo per blob nuovi.
         
         Args:
-            file: file upload da request.files
+            upload: ImageUpload con il contenuto già ricevuto
             item_id: ID dell'item a cui appartiene l'immagine
             
         Returns:
             tuple: (success, message, data)
                    data = {
-                       'filename': nome file originale,
+                       'filename': nome pubblico (<hash>.<estensione>),
                        'path': percorso file,
                        'thumbnail': percorso thumbnail,
-                       'medium': percorso versione media
+                       'medium': percorso versione media,
+                       'new_blob': True se il contenuto non era già salvato,
+                       'duplicate': True se l'item aveva già questa immagine
                    }
         """
         try:
-            # Validazione estensione
-            if not ImagesService.validate_file_extension(file.filename):
-                return False, "Formato file non supportato. Usa: PNG, JPG, JPEG, GIF, WEBP", None
-            
-            # Validazione contenuto
-            is_valid, image_type = ImagesService.validate_image_content(file.stream)
-            if not is_valid:
-                return False, "Il file non è un'immagine valida", None
-            
-            # Validazione dimensione (se disponibile)
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()
-            file.seek(0)
-            
-            if file_size > ImagesService.MAX_FILE_SIZE:
-                return False, f"File troppo grande. Massimo {ImagesService.MAX_FILE_SIZE / (1024*1024):.1f}MB", None
-            
-            # Crea cartella per l'item se non esiste
-            item_folder = os.path.join(ImagesService.UPLOAD_FOLDER, f"item_{item_id}")
-            os.makedirs(item_folder, exist_ok=True)
-            
-            # Genera nome file unico
-            filename = ImagesService.generate_unique_filename(file.filename)
+            key = upload.finish()
+            blob, new_blob = ImagesService._get_or_create_blob(key, upload)
             
-            # Percorsi
-            original_path = os.path.join(item_folder, filename)
-            thumbnail_filename = f"thumb_{filename}"
-            thumbnail_path = os.path.join(item_folder, thumbnail_filename)
-            medium_filename = f"medium_{filename}"
-            medium_path = os.path.join(item_folder, medium_filename)
-            
-            # Salva originale
-            file.save(original_path)
-            
-            # Crea versioni ridimensionate
-            try:
-                with Image.open(original_path) as img:
-                    # Converti RGBA in RGB se necessario
-                    if img.mode == 'RGBA':
-                        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                        rgb_img.paste(img, mask=img.split()[3])
-                        img = rgb_img
-                    
-                    # Thumbnail
-                    img_thumb = img.copy()
-                    img_thumb.thumbnail(ImagesService.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                    img_thumb.save(thumbnail_path, quality=85, optimize=True)
-                    
-                    # Medium
-                    img_medium = img.copy()
-                    img_medium.thumbnail(ImagesService.MEDIUM_SIZE, Image.Resampling.LANCZOS)
-                    img_medium.save(medium_path, quality=90, optimize=True)
-                    
-            except Exception as e:
-                # Se fallisce il resize, rimuovi file originale
-                if os.path.exists(original_path):
-                    os.remove(original_path)
-                return False, f"Errore elaborazione immagine: {str(e)}", None
+            # Riferimento dell'item al blob
+            duplicate = ItemImage.query.filter_by(item_id=item_id, filename=blob.filename).first() is not None
+            if not duplicate:
+                ImagesService._add_item_image(item_id, blob)
+            db.session.commit()
             
             # Percorsi relativi per il database
-            relative_path = f"item_{item_id}/{filename}"
-            relative_thumb = f"item_{item_id}/{thumbnail_filename}"
-            relative_medium = f"item_{item_id}/{medium_filename}"
-            
             return True, "Immagine caricata con successo", {
-                'filename': filename,
-                'path': relative_path,
-                'thumbnail': relative_thumb,
-                'medium': relative_medium,
-                'size': file_size
+                'filename': blob.filename,
+                'path': f"item_{item_id}/{blob.filename}",
+                'thumbnail': f"item_{item_id}/thumb_{blob.filename}",
+                'medium': f"item_{item_id}/medium_{blob.filename}",
+                'size': upload.size,
+                'new_blob': new_blob,
+                'duplicate': duplicate
             }
             
+        except UploadRejected as e:
+            upload.abort()
+            return False, str(e), None
+        
         except Exception as e:
+            upload.abort()
+            db.session.rollback()
             return False, f"Errore durante il salvataggio: {str(e)}", None
     
+    @staticmethod
+    def _get_or_create_blob(key, upload):
+        """
+        Blob con l'hash dato; se non esiste il file ricevuto diventa il blob,
+        altrimenti viene scartato
+        
+        Returns:
+            tuple: (ImageBlob, creato)
+        """
+        blob = ImageBlob.query.filter_by(key=key).first()
+        if blob is not None:
+            upload.abort()
+            return blob, False
+        
+        filename = f"{key}.{upload.extension}"
+        width, height = upload.dimensions()
+        upload.commit(filename, ImagesService.mimetype_for(upload.extension))
+        
+        try:
+            with db.session.begin_nested():
+                blob = ImageBlob(key=key, extension=upload.extension, size=upload.size,
+                                 width=width, height=height, ref_count=0)
+                db.session.add(blob)
+            return blob, True
+        except IntegrityError:
+            # Stesso contenuto salvato nel frattempo da una richiesta concorrente
+            blob = ImageBlob.query.filter_by(key=key).first()
+            if blob.filename != filename:
+                ImagesService.get_storage().delete(filename)
+            return blob, False
+    
+    @staticmethod
+    def _add_item_image(item_id, blob):
+        """Aggiunge il blob in fondo alla galleria dell'item (senza commit)"""
+        position = db.session.query(
+            func.coalesce(func.max(ItemImage.position) + 1, 0)
+        ).filter(ItemImage.item_id == item_id).scalar()
+        db.session.add(ItemImage(item_id=item_id, blob_id=blob.id, filename=blob.filename, position=position))
+        ImageBlob.query.filter_by(id=blob.id).update({ImageBlob.ref_count: ImageBlob.ref_count + 1})
+    
+    @staticmethod
+    def _find_blob(filepath):
+        """
+        Blob di un percorso relativo "item_<id>/<filename>", se l'item ha
+        un riferimento a quell'immagine
+        
+        Returns:
+            ImageBlob o None
+        """
+        item_id, filename = ImagesService.parse_path(filepath)
+        if item_id is None:
+            return None
+        return ImageBlob.query.join(ItemImage, ItemImage.blob_id == ImageBlob.id).filter(
+            ItemImage.item_id == item_id,
+            ItemImage.filename == filename
+        ).first()
+    
+    @staticmethod
+    def _blob_by_filename(filename):
+        """Blob dal nome <hash>.<estensione>, senza controllare i riferimenti"""
+        return ImageBlob.query.filter_by(key=filename.rsplit('.', 1)[0]).first()
+    
+    @staticmethod
+    def variant_specs():
+        """
+        Varianti da generare, dalla più grande alla più piccola
+        
+        Returns:
+            list: tuple (dimensione, lato massimo, qualità JPEG)
+        """
+        return [
+            ('medium', ImagesService.MEDIUM_SIZE, 90),
+            ('thumbnail', ImagesService.THUMBNAIL_SIZE, 85),
+        ]
+    
+    @staticmethod
+    def _fill_dimensions(blob, data):
+        """Dimensioni del blob se l'upload non le ha trovate nell'header"""
+        if blob.width is None:
+            with Image.open(io.BytesIO(data)) as img:
+                blob.width, blob.height = img.size
+    
+    @staticmethod
+    def _store_variants(blob, rendered, placeholder):
+        """
+        Salva nello storage le varianti prodotte da render_variants e
+        registra nel blob formati ed ETag (sha256) di ognuna e il segnaposto
+        """
+        storage = ImagesService.get_storage()
+        variants = {}
+        for size, encoded in rendered.items():
+            for extension, data in encoded.items():
+                key = ImagesService.variant_key(blob.filename, size, extension)
+                storage.save(key, data, ImagesService.mimetype_for(extension))
+                variants.setdefault(size, {})[extension] = hashlib.sha256(data).hexdigest()
+        
+        blob.variants = variants
+        blob.placeholder = placeholder
+        db.session.commit()
+    
+    @staticmethod
+    def generate_variants(filepath):
+        """
+        Crea thumbnail e versione media di un originale già salvato
+        
+        Args:
+            filepath: percorso relativo dell'originale
+            
+        Returns:
+            tuple: (success, message)
+        """
+        blob = ImagesService._blob_by_filename(os.path.basename(filepath))
+        if blob is None:
+            return False, "File non trovato"
+        
+        try:
+            data = ImagesService.get_storage().load(blob.filename)
+        except FileNotFoundError:
+            return False, "File non trovato"
+        
+        success, message, rendered, placeholder = render_variants(
+            data,
+            blob.extension,
+            ImagesService.variant_specs(),
+            _get_encode_executor(),
+            available_modern_formats()
+        )
+        if success:
+            ImagesService._fill_dimensions(blob, data)
+            ImagesService._store_variants(blob, rendered, placeholder)
+        return success, message
+    
+    @staticmethod
+    def generate_variants_batch(filepaths, max_workers=None):
+        """
+        Crea le varianti di molti originali in parallelo su più processi
+        
+        Ogni processo decodifica e ridimensiona un'immagine per intero, senza
+        contendersi il GIL con le richieste servite da questo processo. Letture
+        e scritture sullo storage restano in questo processo.
+        
+        Args:
+            filepaths: percorsi relativi degli originali
+            max_workers: numero di processi (None = CPU, al più uno per immagine)
+            
+        Returns:
+            list: (success, message) per ogni percorso, nello stesso ordine
+        """
+        storage = ImagesService.get_storage()
+        results = [None] * len(filepaths)
+        pending = []
+        for index, filepath in enumerate(filepaths):
+            blob = ImagesService._blob_by_filename(os.path.basename(filepath))
+            if blob is None:
+                results[index] = (False, "File non trovato")
+                continue
+            try:
+                pending.append((index, blob, storage.load(blob.filename)))
+            except FileNotFoundError:
+                results[index] = (False, "File non trovato")
+        
+        if pending:
+            # Import locale: image_worker importa questo modulo
+            from image_worker import _render_variants_worker
+            
+            specs = ImagesService.variant_specs()
+            formats = available_modern_formats()
+            # spawn: il processo Flask ha thread attivi, fork non è sicuro
+            context = multiprocessing.get_context('spawn')
+            workers = max_workers or min(len(pending), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = [
+                    (index, blob, data, pool.submit(_render_variants_worker, data, blob.extension, specs, formats))
+                    for index, blob, data in pending
+                ]
+                for index, blob, data, future in futures:
+                    try:
+                        success, message, rendered, placeholder = future.result()
+                        if success:
+                            ImagesService._fill_dimensions(blob, data)
+                            ImagesService._store_variants(blob, rendered, placeholder)
+                        results[index] = (success, message)
+                    except Exception as e:
+                        results[index] = (False, f"Errore elaborazione immagine: {str(e)}")
+        
+        return results
+    
+    @staticmethod
+    def save_image(file, item_id):
+        """
+        Salva un'immagine e crea subito thumbnail e versione media
+        
+        Versione sincrona di store_original + generate_variants; l'endpoint
+        di upload usa invece la coda in background.
+        
+        Args:
+            file: file upload da request.files
+            item_id: ID dell'item a cui appartiene l'immagine
+            
+        Returns:
+            tuple: (success, message, data) come store_original
+        """
+        success, message, data = ImagesService.store_original(file, item_id)
+        if not success or not data['new_blob']:
+            return success, message, data
+        
+        variants_ok, variants_message = ImagesService.generate_variants(data['path'])
+        if not variants_ok:
+            # Se fallisce il resize, rimuovi file originale
+            ImagesService.delete_image(data['path'])
+            return False, variants_message, None
+        
+        return True, message, data
+    
     @staticmethod
     def delete_image(filepath):
         """
-        Elimina un'immagine e le sue versioni ridimensionate
+        Elimina un'immagine di un item
+        
+        Rimuove il riferimento dell'item; il blob e le sue varianti vengono
+        cancellati solo quando nessun altro item lo usa più.
         
         Args:
             filepath: percorso relativo del file
@@ -195,67 +815,218 @@ class ImagesService:
             tuple: (success, message)
         """
         try:
-            # Percorso completo
-            full_path = os.path.join(ImagesService.UPLOAD_FOLDER, filepath)
+            item_id, filename = ImagesService.parse_path(filepath)
+            item_image = ItemImage.query.filter_by(item_id=item_id, filename=filename).first()
+            if item_image is None:
+                return False, "File non trovato"
             
-            # Estrai directory e nome file
-            directory = os.path.dirname(full_path)
-            filename = os.path.basename(full_path)
+            blob_id = item_image.blob_id
+            variants = item_image.blob.variants or {}
+            db.session.delete(item_image)
             
-            # Percorsi thumbnail e medium
-            thumbnail_path = os.path.join(directory, f"thumb_{filename}")
-            medium_path = os.path.join(directory, f"medium_{filename}")
+            # Le immagini successive salgono di una posizione
+            if item_image.position is not None:
+                ItemImage.query.filter(
+                    ItemImage.item_id == item_id,
+                    ItemImage.position > item_image.position
+                ).update({ItemImage.position: ItemImage.position - 1}, synchronize_session=False)
             
-            # Elimina file
-            files_deleted = 0
-            for path in [full_path, thumbnail_path, medium_path]:
-                if os.path.exists(path):
-                    os.remove(path)
-                    files_deleted += 1
+            ImageBlob.query.filter_by(id=blob_id).update({ImageBlob.ref_count: ImageBlob.ref_count - 1})
             
-            # Se la cartella è vuota, rimuovila
-            if os.path.exists(directory) and not os.listdir(directory):
-                os.rmdir(directory)
+            # Ultimo riferimento: elimina il blob (condizione nello stesso DELETE)
+            orphaned = ImageBlob.query.filter(
+                ImageBlob.id == blob_id,
+                ImageBlob.ref_count <= 0
+            ).delete(synchronize_session=False)
+            db.session.commit()
             
-            if files_deleted > 0:
-                return True, f"{files_deleted} file eliminati"
-            else:
-                return False, "File non trovato"
+            if not orphaned:
+                return True, "Immagine rimossa (file condiviso con altri oggetti)"
+            
+            files_deleted = ImagesService._delete_blob_files(filename, variants)
+            return True, f"{files_deleted} file eliminati"
                 
         except Exception as e:
+            db.session.rollback()
             return False, f"Errore durante l'eliminazione: {str(e)}"
     
     @staticmethod
-    def get_image_path(filepath, size='original'):
+    def _delete_blob_files(filename, variants):
+        """Elimina dallo storage un blob e le varianti registrate nel database"""
+        keys = [filename] + [
+            ImagesService.variant_key(filename, size, extension)
+            for size, formats in variants.items()
+            for extension in formats
+        ]
+        storage = ImagesService.get_storage()
+        return sum(1 for key in keys if storage.delete(key))
+    
+    @staticmethod
+    def select_variant(filepath, size, accepted_mimetypes):
         """
-        Ottiene il percorso completo di un'immagine
+        Sceglie il file da servire in base ai formati accettati dal client
+        
+        Per thumbnail e medium preferisce, nell'ordine di MODERN_FORMATS, un
+        formato moderno già generato e presente in accepted_mimetypes;
+        altrimenti usa la variante nel formato originale. Legge solo il
+        database (image_blobs.variants), nessun accesso allo storage.
         
         Args:
-            filepath: percorso relativo
+            filepath: percorso relativo dell'originale
             size: 'original', 'medium', 'thumbnail'
+            accepted_mimetypes: mimetype elencati esplicitamente nell'Accept
             
         Returns:
-            str: percorso completo o None se non esiste
+            dict: {'key', 'mimetype', 'etag', 'last_modified'} o None se
+                  l'immagine (o la variante) non esiste
         """
-        try:
-            if size == 'thumbnail':
-                directory = os.path.dirname(filepath)
-                filename = os.path.basename(filepath)
-                filepath = os.path.join(directory, f"thumb_{filename}")
-            elif size == 'medium':
-                directory = os.path.dirname(filepath)
-                filename = os.path.basename(filepath)
-                filepath = os.path.join(directory, f"medium_{filename}")
-            
-            full_path = os.path.join(ImagesService.UPLOAD_FOLDER, filepath)
-            
-            if os.path.exists(full_path):
-                return full_path
+        blob = ImagesService._find_blob(filepath)
+        if blob is None:
             return None
+        
+        if size == 'original':
+            extension, etag = blob.extension, blob.key
+        else:
+            formats = (blob.variants or {}).get(size)
+            if not formats:
+                return None
+            extension = next(
+                (ext for ext, mimetype, _ in MODERN_FORMATS if mimetype in accepted_mimetypes and ext in formats),
+                blob.extension
+            )
+            etag = formats[extension]
+        
+        return {
+            'key': ImagesService.variant_key(blob.filename, size, extension),
+            'mimetype': ImagesService.mimetype_for(extension),
+            'etag': etag,
+            # I file non cambiano: la data del blob vale anche per le varianti
+            'last_modified': blob.created_at
+        }
+    
+    @staticmethod
+    def parse_resize(width, height, fit):
+        """
+        Valida i parametri di ridimensionamento della query string
+        
+        Args:
+            width, height: valori di w e h (stringhe o None)
+            fit: valore di fit (None = 'contain')
             
-        except Exception as e:
-            print(f"Errore get_image_path: {str(e)}")
+        Returns:
+            tuple: (success, message, (width, height, fit))
+        """
+        fit = fit or 'contain'
+        if fit not in ImagesService.RESIZE_FITS:
+            return False, f"fit non valido, valori ammessi: {', '.join(ImagesService.RESIZE_FITS)}", None
+        
+        dimensions = []
+        for value in (width, height):
+            if value is None:
+                dimensions.append(None)
+            elif value.isdigit() and int(value) in ImagesService.RESIZE_DIMENSIONS:
+                dimensions.append(int(value))
+            else:
+                allowed = ', '.join(str(d) for d in ImagesService.RESIZE_DIMENSIONS)
+                return False, f"Dimensione non ammessa, valori ammessi: {allowed}", None
+        width, height = dimensions
+        
+        if width is None and height is None:
+            return False, "Indicare w, h o entrambi", None
+        if fit == 'cover' and (width is None or height is None):
+            return False, "fit=cover richiede sia w che h", None
+        return True, "Parametri validi", (width, height, fit)
+    
+    @staticmethod
+    def _scaled_size(blob, box):
+        """Dimensioni del blob ridotto a stare in box (come Image.thumbnail)"""
+        ratio = min(1, box[0] / blob.width, box[1] / blob.height)
+        return int(blob.width * ratio), int(blob.height * ratio)
+    
+    @staticmethod
+    def select_resized(filepath, width, height, fit, accepted_mimetypes):
+        """
+        Descrive l'immagine ridimensionata da servire, senza generarla
+        
+        Il formato è scelto come in select_variant. La sorgente è il medium
+        se basta per la dimensione richiesta, altrimenti l'originale. La
+        chiave dipende solo da blob e parametri, quindi fa anche da ETag: una
+        richiesta condizionale riceve 304 senza ridimensionare.
+        
+        Args:
+            filepath: percorso relativo dell'originale
+            width, height, fit: parametri validati da parse_resize
+            accepted_mimetypes: mimetype elencati esplicitamente nell'Accept
+            
+        Returns:
+            dict: {'key', 'mimetype', 'etag', 'last_modified', 'render'} o
+                  None se l'immagine non esiste; render() genera i bytes
+        """
+        blob = ImagesService._find_blob(filepath)
+        if blob is None:
             return None
+        
+        output = next(
+            (fmt for fmt in available_modern_formats() if fmt[1] in accepted_mimetypes),
+            None
+        )
+        extension = output[0] if output else blob.extension
+        key = f"{blob.key}_{width or 0}x{height or 0}_{fit}.{extension}"
+        
+        source = ImagesService.variant_key(blob.filename)
+        if blob.width and blob.extension in (blob.variants or {}).get('medium', {}):
+            if fit == 'cover':
+                needed = (width, height)
+            else:
+                needed = ImagesService._scaled_size(blob, (width or blob.width, height or blob.height))
+            medium = ImagesService._scaled_size(blob, ImagesService.MEDIUM_SIZE)
+            if needed[0] <= medium[0] and needed[1] <= medium[1]:
+                source = ImagesService.variant_key(blob.filename, 'medium')
+        
+        storage = ImagesService.get_storage()
+        source_extension = blob.extension
+        
+        def render():
+            return render_resized(
+                storage.load(source), source_extension, width, height, fit,
+                ImagesService.RESIZE_QUALITY, output
+            )
+        
+        return {
+            'key': key,
+            'mimetype': ImagesService.mimetype_for(extension),
+            'etag': key,
+            'last_modified': blob.created_at,
+            'render': render
+        }
+    
+    @staticmethod
+    def open_resized(image):
+        """
+        File dell'immagine ridimensionata descritta da select_resized
+        
+        Generato al primo accesso e poi servito dalla cache su disco; le
+        richieste concorrenti della stessa immagine attendono un solo resize.
+        
+        Returns:
+            file aperto in lettura binaria
+        """
+        return ImagesService.get_resize_cache().get_or_create(image['key'], image['render'])
+    
+    @staticmethod
+    def get_image_key(filepath, size='original'):
+        """
+        Chiave nello storage di un'immagine nel formato originale
+        
+        Args:
+            filepath: percorso relativo
+            size: 'original', 'medium', 'thumbnail'
+            
+        Returns:
+            str: chiave o None se l'immagine (o la variante) non esiste
+        """
+        image = ImagesService.select_variant(filepath, size, ())
+        return image['key'] if image else None
     
     @staticmethod
     def get_item_images_count(item_id):
@@ -268,23 +1039,115 @@ class ImagesService:
         Returns:
             int: numero di immagini
         """
-        try:
-            item_folder = os.path.join(ImagesService.UPLOAD_FOLDER, f"item_{item_id}")
-            
-            if not os.path.exists(item_folder):
-                return 0
+        return ItemImage.query.filter_by(item_id=item_id).count()
+    
+    @staticmethod
+    def get_item_images(item_id):
+        """
+        Immagini di un item in ordine di galleria, con i blob
+        
+        Args:
+            item_id: ID dell'item
             
-            # Conta solo file originali (non thumb_ o medium_)
-            files = [f for f in os.listdir(item_folder) 
-                    if os.path.isfile(os.path.join(item_folder, f)) 
-                    and not f.startswith('thumb_') 
-                    and not f.startswith('medium_')]
+        Returns:
+            list: ItemImage
+        """
+        return ItemImage.query.options(joinedload(ItemImage.blob)).filter_by(
+            item_id=item_id
+        ).order_by(ItemImage.position, ItemImage.id).all()
+    
+    @staticmethod
+    def serialize_item_image(image, primary_path=None):
+        """
+        Immagine di un item per le risposte API (blob già caricato)
+        
+        Args:
+            image: ItemImage
+            primary_path: Item.image_url, per is_primary
             
-            return len(files)
+        Returns:
+            dict: URL, dimensioni, byte, segnaposto e formati delle varianti già pronte
+        """
+        blob = image.blob
+        url = f"/api/images/{image.item_id}/{image.filename}"
+        return {
+            'filename': image.filename,
+            'path': f"item_{image.item_id}/{image.filename}",
+            'url': url,
+            'thumbnail': f"{url}?size=thumbnail",
+            'medium': f"{url}?size=medium",
+            'width': blob.width,
+            'height': blob.height,
+            'bytes': blob.size,
+            'variants': {size: sorted(formats) for size, formats in (blob.variants or {}).items()},
+            'placeholder': blob.placeholder,
+            'position': image.position,
+            'is_primary': primary_path == f"item_{image.item_id}/{image.filename}"
+        }
+    
+    @staticmethod
+    def release_item_images(item_id):
+        """
+        Rimuove tutte le immagini di un item (prima di eliminarlo)
+        
+        I blob non più usati da altri item vengono cancellati dallo storage.
+        
+        Args:
+            item_id: ID dell'item
             
-        except Exception as e:
-            print(f"Errore conteggio immagini: {str(e)}")
-            return 0
+        Returns:
+            int: immagini rimosse
+        """
+        filenames = [filename for (filename,) in db.session.query(ItemImage.filename).filter_by(item_id=item_id)]
+        for filename in filenames:
+            ImagesService.delete_image(f"item_{item_id}/{filename}")
+        return len(filenames)
+    
+    @staticmethod
+    def backfill_metadata():
+        """
+        Completa i metadati delle immagini salvate prima delle gallerie:
+        posizione in galleria, dimensioni e segnaposto del blob
+        
+        Va chiamata dentro un app context.
+        
+        Returns:
+            int: righe aggiornate
+        """
+        updated = 0
+        
+        item_ids = [item_id for (item_id,) in db.session.query(ItemImage.item_id).filter(
+            ItemImage.position.is_(None)
+        ).distinct()]
+        for item_id in item_ids:
+            images = ItemImage.query.filter_by(item_id=item_id).order_by(ItemImage.position, ItemImage.id).all()
+            for position, image in enumerate(images):
+                image.position = position
+            updated += len(images)
+        db.session.commit()
+        
+        storage = ImagesService.get_storage()
+        for blob in ImageBlob.query.filter(ImageBlob.width.is_(None)).all():
+            try:
+                with storage.open(blob.filename) as f, Image.open(f) as img:
+                    blob.width, blob.height = img.size
+            except (FileNotFoundError, OSError):
+                continue
+            db.session.commit()
+            updated += 1
+        
+        # Segnaposto ricavato dal thumbnail già salvato, senza rielaborare l'originale
+        for blob in ImageBlob.query.filter(ImageBlob.placeholder.is_(None)).all():
+            key = ImagesService.variant_key(blob.filename, 'thumbnail')
+            try:
+                with storage.open(key) as f, Image.open(f) as img:
+                    blob.placeholder = render_placeholder(_to_rgb(img))
+            except (FileNotFoundError, OSError):
+                continue
+            db.session.commit()
+            updated += 1
+        
+        return updated
     
     @staticmethod
     def validate_upload_limit(item_id):
@@ -303,3 +1166,78 @@ class ImagesService:
             return False, f"Limite massimo raggiunto ({ImagesService.MAX_IMAGES_PER_ITEM} immagini per oggetto)"
         
         return True, f"Puoi caricare ancora {ImagesService.MAX_IMAGES_PER_ITEM - current_count} immagini"
+    
+    @staticmethod
+    def migrate_legacy_uploads():
+        """
+        Porta nello storage configurato le immagini delle vecchie cartelle
+        item_<id>/
+        
+        Ogni originale diventa un blob (o un riferimento a un blob già
+        presente con lo stesso contenuto) e Item.image_url è aggiornato al
+        nuovo nome. Le vecchie thumb_/medium_ vengono eliminate: varianti,
+        formati moderni e segnaposto sono rigenerati per i blob nuovi.
+        Idempotente: i file migrati vengono rimossi.
+        
+        Va chiamata dentro un app context.
+        
+        Returns:
+            int: numero di immagini migrate
+        """
+        if not os.path.isdir(ImagesService.UPLOAD_FOLDER):
+            return 0
+        
+        migrated = 0
+        
+        for folder in sorted(os.listdir(ImagesService.UPLOAD_FOLDER)):
+            match = re.fullmatch(r'item_(\d+)', folder)
+            item_folder = os.path.join(ImagesService.UPLOAD_FOLDER, folder)
+            if not match or not os.path.isdir(item_folder):
+                continue
+            
+            item = db.session.get(Item, int(match.group(1)))
+            if item is None:
+                continue
+            
+            originals = [f for f in os.listdir(item_folder)
+                         if os.path.isfile(os.path.join(item_folder, f))
+                         and not f.startswith(('thumb_', 'medium_'))]
+            
+            for old_name in originals:
+                old_path = os.path.join(item_folder, old_name)
+                # Non è un'immagine accettata: resta nella cartella
+                try:
+                    upload = ImagesService.begin_upload(old_name)
+                except UploadRejected:
+                    continue
+                try:
+                    with open(old_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(ImagesService.UPLOAD_CHUNK_SIZE), b''):
+                            upload.write(chunk)
+                    key = upload.finish()
+                except UploadRejected:
+                    upload.abort()
+                    continue
+                blob, new_blob = ImagesService._get_or_create_blob(key, upload)
+                os.remove(old_path)
+                
+                if ItemImage.query.filter_by(item_id=item.id, filename=blob.filename).first() is None:
+                    ImagesService._add_item_image(item.id, blob)
+                
+                if item.image_url == f"{folder}/{old_name}":
+                    item.image_url = f"{folder}/{blob.filename}"
+                
+                db.session.commit()
+                if new_blob:
+                    ImagesService.generate_variants(blob.filename)
+                migrated += 1
+            
+            # Vecchie varianti e cartella vuota dell'item
+            for name in os.listdir(item_folder):
+                path = os.path.join(item_folder, name)
+                if os.path.isfile(path) and name.startswith(('thumb_', 'medium_')):
+                    os.remove(path)
+            if not os.listdir(item_folder):
+                os.rmdir(item_folder)
+        
+        return migrated
@@ -0,0 +1,157 @@
+"""
+2.8 - Resize Cache
+Cache su disco delle immagini ridimensionate su richiesta (?w=&h=&fit=)
+"""
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class ResizeCache:
+    """
+    Cache LRU su disco con limite in byte
+
+    I file sono in root/<2 caratteri>/<chiave>; l'indice (chiave -> byte) è
+    in memoria in ordine di ultimo uso e all'avvio viene ricostruito dalla
+    cartella, in ordine di mtime (aggiornata a ogni lettura). Superato
+    max_bytes si eliminano i file usati meno di recente.
+
+    Le richieste concorrenti della stessa chiave sono accorpate: il primo
+    thread genera il file, gli altri ne attendono il risultato.
+
+    Più processi possono usare la stessa cartella: le scritture passano da un
+    file temporaneo e os.replace, e un file eliminato da un altro processo
+    viene rigenerato. Ogni processo però applica max_bytes solo ai file che
+    conosce.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _load_index(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if '.tmp_' in filename:
+                    # Scrittura in corso (o interrotta) di un altro processo
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                files.append((stat.st_mtime, filename, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+        self._evict()
+
+    def get_or_create(self, key, render):
+        """
+        File della cache aperto in lettura, generato se manca
+
+        Il file è aperto sotto lock: resta leggibile anche se un'altra
+        richiesta lo elimina subito dopo per fare spazio.
+
+        Args:
+            key: nome del file (univoco per contenuto)
+            render: funzione senza argomenti che restituisce i bytes
+
+        Returns:
+            file aperto in lettura binaria
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    try:
+                        f = open(self.path(key), 'rb')
+                    except FileNotFoundError:
+                        # Eliminato da un altro processo
+                        self._total -= self._entries.pop(key)
+                    else:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        os.utime(self.path(key))
+                        return f
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = _PendingRender()
+                    self.misses += 1
+                    break
+            # Un altro thread sta generando lo stesso file
+            pending.wait()
+
+        try:
+            data = render()
+            self._write(key, data)
+            with self._lock:
+                # Registrato prima di liberare le attese: chi arriva ora lo trova
+                if key in self._entries:
+                    self._total -= self._entries.pop(key)
+                self._entries[key] = len(data)
+                self._total += len(data)
+                f = open(self.path(key), 'rb')
+                self._evict(keep=key)
+            return f
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def _write(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp_{uuid.uuid4().hex}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self, keep=None):
+        # Da chiamare con il lock: elimina i file meno usati oltre max_bytes
+        while self._total > self.max_bytes and self._entries:
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            del self._entries[key]
+            self._total -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    @property
+    def size(self):
+        """Byte occupati dai file nell'indice"""
+        return self._total
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _PendingRender:
+    """Generazione in corso di una chiave, attesa dalle richieste concorrenti"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,730 @@
+"""
+Test per l'API Immagini
+Verifica upload, elaborazione in background e download delle varianti
+"""
+
+import sys
+import os
+import io
+import base64
+import itertools
+import hashlib
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.1_flask_setup'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.2_models'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '2.8_images_api'))
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from flask_jwt_extended import create_access_token
+from app import FlaskApp
+from models import db, User, Item, ImageJob, ImageBlob, ItemImage
+from images_service import ImagesService, available_modern_formats
+from image_storage import S3Storage
+from resize_cache import ResizeCache
+from image_jobs import ImageJobQueue, current_owner
+
+
+_colors = itertools.count()
+
+
+def make_image(size=(1200, 900), fmt='JPEG', color=None):
+    """Crea un'immagine in memoria (colore diverso a ogni chiamata se non indicato)"""
+    if color is None:
+        index = next(_colors)
+        color = (index % 256, (index * 7) % 256, 40)
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=fmt)
+    buffer.seek(0)
+    return buffer
+
+
+class MemoryS3Client:
+    """Stand-in di un server S3 compatibile (MinIO): oggetti in un dict"""
+
+    class NoSuchKey(Exception):
+        response = {'Error': {'Code': 'NoSuchKey'}}
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        # Come boto3: bytes o file aperto
+        data = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        self.objects[(Bucket, Key)] = (data, ContentType)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.NoSuchKey(Key)
+        body, content_type = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(body), 'ContentType': content_type}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+class TestImagesAPI(unittest.TestCase):
+    """Test per ImagesService e images_routes"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup eseguito una volta prima di tutti i test"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.original_upload_folder = ImagesService.UPLOAD_FOLDER
+        ImagesService.UPLOAD_FOLDER = os.path.join(cls.tmp_dir, 'uploads')
+
+        cls.flask_app = FlaskApp(db_type="sqlite", db_path=os.path.join(cls.tmp_dir, 'test.db'))
+        cls.app = cls.flask_app.get_app()
+        cls.client = cls.app.test_client()
+
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+        seller = User(username='seller', email='seller@test.com', password_hash='x',
+                      first_name='Seller', last_name='Test', phone='000')
+        db.session.add(seller)
+        db.session.commit()
+        cls.seller_id = seller.id
+        cls.headers = {'Authorization': f'Bearer {create_access_token(identity=str(seller.id))}'}
+
+    @classmethod
+    def tearDownClass(cls):
+        """Cleanup dopo tutti i test"""
+        db.session.remove()
+        db.drop_all()
+        cls.app_context.pop()
+        ImagesService.UPLOAD_FOLDER = cls.original_upload_folder
+        ImagesService.STORAGE = None
+        ImagesService.RESIZE_CACHE = None
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup prima di ogni test: un item nuovo senza immagini"""
+        item = Item(title='Bici', price=100.0, seller_id=self.seller_id)
+        db.session.add(item)
+        db.session.commit()
+        self.item_id = item.id
+
+    def _load(self, path, size='original'):
+        """Contenuto di un'immagine letto dallo storage"""
+        return ImagesService.get_storage().load(ImagesService.get_image_key(path, size))
+
+    def _stored_files(self, name):
+        """File dello storage locale che contengono name"""
+        return [f for _, _, files in os.walk(ImagesService.blob_folder()) for f in files if name in f]
+
+    def _upload(self, image=None, filename='photo.jpg'):
+        return self.client.post(
+            f'/api/images/upload/{self.item_id}',
+            data={'image': (image or make_image(), filename)},
+            headers=self.headers,
+            content_type='multipart/form-data'
+        )
+
+    def test_01_upload_returns_202_and_processes_in_background(self):
+        """Test: l'upload risponde 202 e il job genera le varianti"""
+        response = self._upload()
+        self.assertEqual(response.status_code, 202)
+        data = response.get_json()['data']
+        job_id = data['job']['id']
+
+        ImageJobQueue.wait(job_id, timeout=30)
+
+        body = self.client.get(f'/api/images/jobs/{job_id}', headers=self.headers).get_json()
+        self.assertEqual(body['data']['status'], 'done')
+        self.assertEqual(body['data']['thumbnail'], data['thumbnail'])
+
+        response = self.client.get(f"/api/images/{self.item_id}/{data['filename']}?size=thumbnail")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Image-Placeholder', response.headers)
+        with Image.open(io.BytesIO(response.data)) as thumb:
+            self.assertLessEqual(max(thumb.size), max(ImagesService.THUMBNAIL_SIZE))
+        print("✅ Test upload asincrono OK")
+
+    def test_02_placeholder_until_variants_ready(self):
+        """Test: senza varianti viene servito l'originale come segnaposto"""
+        success, _, data = ImagesService.store_original(
+            FileStorage(make_image(), 'photo.jpg'), self.item_id
+        )
+        self.assertTrue(success)
+
+        response = self.client.get(f"/api/images/{self.item_id}/{data['filename']}?size=medium")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Image-Placeholder'], '1')
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        print("✅ Test segnaposto OK")
+
+    def test_03_resume_pending_jobs(self):
+        """Test: i job rimasti pending vengono ripresi all'avvio"""
+        success, _, data = ImagesService.store_original(
+            FileStorage(make_image(), 'photo.jpg'), self.item_id
+        )
+        job = ImageJob(item_id=self.item_id, path=data['path'], status='processing')
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+        self.assertGreaterEqual(ImageJobQueue.resume_pending(self.app), 1)
+        ImageJobQueue.wait(job_id, timeout=30)
+
+        db.session.expire_all()
+        self.assertEqual(ImageJobQueue.get_job(job_id).status, 'done')
+        self.assertIsNotNone(ImagesService.get_image_key(data['path'], 'medium'))
+        print("✅ Test ripresa job OK")
+
+    def test_04_rejects_non_images(self):
+        """Test: un file che non è un'immagine viene rifiutato"""
+        response = self._upload(io.BytesIO(b'not an image at all'), 'fake.jpg')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ImageJob.query.filter_by(item_id=self.item_id).count(), 0)
+        print("✅ Test file non valido OK")
+
+    def test_05_variants_single_decode(self):
+        """Test: le varianti rispettano le dimensioni anche con decodifica ridotta"""
+        success, _, data = ImagesService.store_original(
+            FileStorage(make_image(size=(4000, 3000)), 'big.jpg'), self.item_id
+        )
+        self.assertEqual(ImagesService.generate_variants(data['path']), (True, "Varianti create"))
+
+        with Image.open(io.BytesIO(self._load(data['path'], 'medium'))) as medium:
+            self.assertEqual(medium.size, (800, 600))
+        with Image.open(io.BytesIO(self._load(data['path'], 'thumbnail'))) as thumb:
+            self.assertEqual(thumb.size, (200, 150))
+        print("✅ Test varianti con una decodifica OK")
+
+    def test_06_batch_upload(self):
+        """Test: il caricamento in blocco elabora tutte le immagini in un job"""
+        response = self.client.post(
+            f'/api/images/upload/{self.item_id}/batch',
+            data={'images': [
+                (make_image(), 'one.jpg'),
+                (make_image(size=(640, 480), fmt='PNG'), 'two.png'),
+                (make_image(size=(300, 300)), 'three.jpg'),
+            ]},
+            headers=self.headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 202)
+        images = response.get_json()['data']
+        self.assertEqual(len(images), 3)
+
+        for image in images:
+            ImageJobQueue.wait(image['job']['id'], timeout=60)
+        db.session.expire_all()
+        for image in images:
+            self.assertEqual(ImageJobQueue.get_job(image['job']['id']).status, 'done')
+            self.assertIsNotNone(ImagesService.get_image_key(image['path'], 'thumbnail'))
+        print("✅ Test caricamento in blocco OK")
+
+    def test_07_batch_upload_respects_limit(self):
+        """Test: un lotto oltre il limite di immagini viene rifiutato"""
+        response = self.client.post(
+            f'/api/images/upload/{self.item_id}/batch',
+            data={'images': [(make_image(), f'{index}.jpg')
+                             for index in range(ImagesService.MAX_IMAGES_PER_ITEM + 1)]},
+            headers=self.headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ImagesService.get_item_images_count(self.item_id), 0)
+        print("✅ Test limite lotto OK")
+
+    def test_08_content_negotiation(self):
+        """Test: thumbnail in WebP solo se il client lo accetta"""
+        response = self._upload()
+        data = response.get_json()['data']
+        ImageJobQueue.wait(data['job']['id'], timeout=30)
+        url = f"/api/images/{self.item_id}/{data['filename']}?size=thumbnail"
+
+        response = self.client.get(url, headers={'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8'})
+        expected = 'image/avif' if 'avif' in [fmt[0] for fmt in available_modern_formats()] else 'image/webp'
+        self.assertEqual(response.mimetype, expected)
+        self.assertIn('Accept', response.headers['Vary'])
+        with Image.open(io.BytesIO(response.data)) as thumb:
+            self.assertEqual(thumb.format, expected.split('/')[1].upper())
+
+        response = self.client.get(url, headers={'Accept': '*/*'})
+        self.assertEqual(response.mimetype, 'image/jpeg')
+
+        response = self.client.delete(f"/api/images/{self.item_id}/{data['filename']}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._stored_files(data['filename']), [])
+        print("✅ Test negoziazione formato OK")
+
+    def test_09_etag_and_conditional_requests(self):
+        """Test: ETag dal contenuto, 304 sulle richieste condizionali"""
+        response = self._upload()
+        data = response.get_json()['data']
+        ImageJobQueue.wait(data['job']['id'], timeout=30)
+        url = f"/api/images/{self.item_id}/{data['filename']}?size=medium"
+
+        response = self.client.get(url)
+        etag = response.headers['ETag'].strip('"')
+        last_modified = response.headers['Last-Modified']
+        self.assertEqual(etag, hashlib.sha256(response.data).hexdigest())
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        response = self.client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(f"/api/images/{self.item_id}/{data['filename']}")
+        self.assertEqual(response.headers['ETag'].strip('"'), hashlib.sha256(response.data).hexdigest())
+        self.assertEqual(ImagesService.get_item_images_count(self.item_id), 1)
+        print("✅ Test ETag e richieste condizionali OK")
+
+    def _new_item(self):
+        item = Item(title='Altra bici', price=90.0, seller_id=self.seller_id)
+        db.session.add(item)
+        db.session.commit()
+        return item.id
+
+    def test_10_deduplicated_blobs(self):
+        """Test: la stessa foto su due item è salvata una volta sola"""
+        photo = make_image().getvalue()
+        other_item_id = self._new_item()
+
+        first = self._upload(io.BytesIO(photo)).get_json()['data']
+        ImageJobQueue.wait(first['job']['id'], timeout=30)
+
+        response = self.client.post(
+            f'/api/images/upload/{other_item_id}',
+            data={'image': (io.BytesIO(photo), 'copy.jpg')},
+            headers=self.headers,
+            content_type='multipart/form-data'
+        )
+        second = response.get_json()['data']
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(second['job'])
+        self.assertEqual(second['filename'], first['filename'])
+        self.assertEqual(first['filename'], f"{hashlib.sha256(photo).hexdigest()}.jpg")
+
+        again = self._upload(io.BytesIO(photo)).get_json()['data']
+        self.assertTrue(again['duplicate'])
+        self.assertEqual(ImagesService.get_item_images_count(self.item_id), 1)
+
+        key = hashlib.sha256(photo).hexdigest()
+        self.assertEqual(ImageBlob.query.filter_by(key=key).one().ref_count, 2)
+        response = self.client.get(f"/api/images/{other_item_id}/{second['filename']}?size=thumbnail")
+        self.assertNotIn('X-Image-Placeholder', response.headers)
+
+        # Primo riferimento rimosso: i file restano per l'altro item
+        self.assertTrue(ImagesService.delete_image(first['path'])[0])
+        self.assertIsNone(ImagesService.get_image_key(first['path']))
+        self.assertIsNotNone(ImagesService.get_image_key(second['path'], 'medium'))
+
+        # Ultimo riferimento: blob e varianti eliminati
+        success, message = ImagesService.delete_image(second['path'])
+        self.assertTrue(success)
+        self.assertIn('file eliminati', message)
+        self.assertIsNone(ImageBlob.query.filter_by(key=key).first())
+        self.assertEqual(self._stored_files(key), [])
+        print("✅ Test deduplicazione blob OK")
+
+    def test_11_migrate_legacy_uploads(self):
+        """Test: le immagini nelle vecchie cartelle item_<id>/ passano al blob store"""
+        item_folder = os.path.join(ImagesService.UPLOAD_FOLDER, f'item_{self.item_id}')
+        os.makedirs(item_folder, exist_ok=True)
+        photo = make_image().getvalue()
+        with open(os.path.join(item_folder, '20251028_old.jpg'), 'wb') as f:
+            f.write(photo)
+        with open(os.path.join(item_folder, 'thumb_20251028_old.jpg'), 'wb') as f:
+            f.write(make_image(size=(200, 150)).getvalue())
+        item = db.session.get(Item, self.item_id)
+        item.image_url = f'item_{self.item_id}/20251028_old.jpg'
+        db.session.commit()
+
+        self.assertEqual(ImagesService.migrate_legacy_uploads(), 1)
+        self.assertFalse(os.path.exists(item_folder))
+
+        filename = f"{hashlib.sha256(photo).hexdigest()}.jpg"
+        self.assertEqual(db.session.get(Item, self.item_id).image_url, f'item_{self.item_id}/{filename}')
+        self.assertIsNotNone(ImagesService.get_image_key(f'item_{self.item_id}/{filename}', 'thumbnail'))
+        self.assertEqual(ImagesService.migrate_legacy_uploads(), 0)
+        print("✅ Test migrazione vecchie cartelle OK")
+
+    def test_12_sharded_local_storage(self):
+        """Test: originale e varianti nella stessa cartella a due livelli dell'hash"""
+        photo = make_image().getvalue()
+        key = hashlib.sha256(photo).hexdigest()
+        success, _, data = ImagesService.save_image(FileStorage(io.BytesIO(photo), 'photo.jpg'), self.item_id)
+        self.assertTrue(success)
+
+        shard = os.path.join(ImagesService.blob_folder(), key[:2], key[2:4])
+        self.assertIn(f"{key}.jpg", os.listdir(shard))
+        self.assertIn(f"thumb_{key}.jpg", os.listdir(shard))
+
+        # Metadati nel database: formati ed ETag delle varianti
+        blob = ImageBlob.query.filter_by(key=key).one()
+        self.assertEqual(set(blob.variants), {'medium', 'thumbnail'})
+        self.assertEqual(blob.variants['thumbnail']['jpg'],
+                         hashlib.sha256(self._load(data['path'], 'thumbnail')).hexdigest())
+        print("✅ Test storage locale a cartelle OK")
+
+    def test_13_s3_storage(self):
+        """Test: upload, download e cancellazione su uno storage S3 compatibile"""
+        client = MemoryS3Client()
+        ImagesService.STORAGE = S3Storage('images', prefix='autonomia/', client=client)
+        try:
+            photo = make_image().getvalue()
+            key = hashlib.sha256(photo).hexdigest()
+            success, _, data = ImagesService.save_image(FileStorage(io.BytesIO(photo), 'photo.jpg'), self.item_id)
+            self.assertTrue(success)
+            self.assertIn(('images', f"autonomia/{key[:2]}/{key}.jpg"), client.objects)
+            self.assertEqual(self._stored_files(key), [])
+
+            url = f"/api/images/{self.item_id}/{data['filename']}?size=thumbnail"
+            response = self.client.get(url, headers={'Accept': 'image/webp'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/webp')
+            etag = response.headers['ETag']
+
+            # 304 senza leggere dal bucket
+            client.objects.clear()
+            response = self.client.get(url, headers={'Accept': 'image/webp', 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+            # Oggetto sparito dal bucket: 404, non 500
+            response = self.client.get(url, headers={'Accept': 'image/webp'})
+            self.assertEqual(response.status_code, 404)
+        finally:
+            ImagesService.STORAGE = None
+        print("✅ Test storage S3 OK")
+
+    def test_15_gallery_metadata(self):
+        """Test: galleria ordinata con dimensioni e formati in serialize_item"""
+        uploaded = [
+            ImagesService.save_image(FileStorage(make_image(size=size), 'photo.jpg'), self.item_id)[2]
+            for size in [(1200, 900), (640, 480), (300, 400)]
+        ]
+        item = db.session.get(Item, self.item_id)
+        item.image_url = uploaded[0]['path']
+        db.session.commit()
+
+        response = self.client.get(f'/api/items/{self.item_id}')
+        images = response.get_json()['data']['images']
+        self.assertEqual([image['position'] for image in images], [0, 1, 2])
+        self.assertEqual([(image['width'], image['height']) for image in images],
+                         [(1200, 900), (640, 480), (300, 400)])
+        self.assertTrue(images[0]['is_primary'])
+        self.assertIn('jpg', images[0]['variants']['thumbnail'])
+        self.assertEqual(images[1]['bytes'], ImageBlob.query.filter_by(
+            key=uploaded[1]['filename'].split('.')[0]).one().size)
+
+        # Le immagini successive salgono di posizione
+        ImagesService.delete_image(uploaded[0]['path'])
+        gallery = ImagesService.get_item_images(self.item_id)
+        self.assertEqual([(image.filename, image.position) for image in gallery],
+                         [(uploaded[1]['filename'], 0), (uploaded[2]['filename'], 1)])
+
+        # Eliminare l'item rilascia i blob
+        response = self.client.delete(f'/api/items/{self.item_id}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        for data in uploaded[1:]:
+            self.assertIsNone(ImageBlob.query.filter_by(key=data['filename'].split('.')[0]).first())
+            self.assertEqual(self._stored_files(data['filename']), [])
+        print("✅ Test metadati galleria OK")
+
+    def test_16_streaming_upload_limits(self):
+        """Test: file troppo grandi o non immagini fermati durante la ricezione"""
+        incoming = os.path.join(ImagesService.blob_folder(), '.incoming')
+
+        def noise_png(side):
+            buffer = io.BytesIO()
+            Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(buffer, format='PNG')
+            return buffer.getvalue()
+
+        original_max = ImagesService.MAX_FILE_SIZE
+        ImagesService.MAX_FILE_SIZE = 100 * 1024
+        try:
+            # Oltre MAX_FILE_SIZE ma entro il limite della richiesta: fermato a blocchi
+            photo = noise_png(200)
+            self.assertTrue(ImagesService.MAX_FILE_SIZE < len(photo) < ImagesService.max_request_size())
+            response = self._upload(io.BytesIO(photo), 'noise.png')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('troppo grande', response.get_json()['message'])
+
+            # Content-Length oltre il limite: rifiutato prima di leggere il corpo
+            response = self._upload(io.BytesIO(noise_png(400)), 'noise.png')
+            self.assertEqual(response.status_code, 413)
+        finally:
+            ImagesService.MAX_FILE_SIZE = original_max
+
+        # Estensione valida ma contenuto non immagine: fermato al primo blocco
+        response = self._upload(io.BytesIO(b'<?php echo 1; ?>' * 1000), 'shell.jpg')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['message'], "Il file non è un'immagine valida")
+
+        # Nessun file parziale rimasto nello storage
+        self.assertEqual(os.listdir(incoming), [])
+        self.assertEqual(ImagesService.get_item_images_count(self.item_id), 0)
+
+        response = self._upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(os.listdir(incoming), [])
+        print("✅ Test limiti upload in streaming OK")
+
+    def test_17_placeholder(self):
+        """Test: segnaposto sfocato salvato all'upload e incluso nell'item"""
+        success, _, data = ImagesService.save_image(
+            FileStorage(make_image(size=(1200, 900), color=(200, 40, 40)), 'photo.jpg'), self.item_id
+        )
+        self.assertTrue(success)
+        item = db.session.get(Item, self.item_id)
+        item.image_url = data['path']
+        db.session.commit()
+
+        blob = ImageBlob.query.filter_by(key=data['filename'].split('.')[0]).one()
+        header, encoded = blob.placeholder.split(',', 1)
+        self.assertIn(header, ('data:image/webp;base64', 'data:image/jpeg;base64'))
+        self.assertLess(len(blob.placeholder), 1000)
+        with Image.open(io.BytesIO(base64.b64decode(encoded))) as tiny:
+            self.assertEqual(tiny.size, (16, 12))
+            red, green, _ = tiny.convert('RGB').getpixel((8, 6))
+            self.assertGreater(red, green)
+
+        response = self.client.get(f'/api/items/{self.item_id}')
+        item_data = response.get_json()['data']
+        self.assertEqual(item_data['image_placeholder'], blob.placeholder)
+        self.assertEqual(item_data['images'][0]['placeholder'], blob.placeholder)
+
+        # Blob salvati prima dei segnaposto: ricavato dal thumbnail
+        blob.placeholder = None
+        db.session.commit()
+        self.assertGreaterEqual(ImagesService.backfill_metadata(), 1)
+        self.assertTrue(db.session.get(ImageBlob, blob.id).placeholder.startswith('data:image/'))
+        print("✅ Test segnaposto LQIP OK")
+
+    def test_18_resize_on_demand(self):
+        """Test: ?w=&h=&fit= ridimensiona su richiesta e serve dalla cache"""
+        data = ImagesService.save_image(FileStorage(make_image(size=(1200, 900)), 'photo.jpg'), self.item_id)[2]
+        url = f"/api/images/{self.item_id}/{data['filename']}"
+        cache = ImagesService.get_resize_cache()
+        misses = cache.misses
+
+        response = self.client.get(f'{url}?w=320')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        with Image.open(io.BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (320, 240))
+        etag = response.headers['ETag']
+
+        response = self.client.get(f'{url}?w=200&h=200&fit=cover')
+        with Image.open(io.BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (200, 200))
+        self.assertEqual(cache.misses, misses + 2)
+
+        # Stessa richiesta: dalla cache, e 304 senza ridimensionare
+        self.assertEqual(self.client.get(f'{url}?w=320').headers['ETag'], etag)
+        response = self.client.get(f'{url}?w=320', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(cache.misses, misses + 2)
+        self.assertGreaterEqual(cache.hits, 1)
+
+        # Mai ingrandite
+        response = self.client.get(f'{url}?w=1600&h=1600&fit=cover')
+        with Image.open(io.BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (900, 900))
+
+        if 'webp' in [fmt[0] for fmt in available_modern_formats()]:
+            response = self.client.get(f'{url}?h=240', headers={'Accept': 'image/webp,*/*'})
+            self.assertEqual(response.mimetype, 'image/webp')
+            self.assertIn('Accept', response.headers['Vary'])
+
+        for query in ['w=123', 'w=320&fit=cover', 'w=320&fit=stretch', 'w=abc']:
+            self.assertEqual(self.client.get(f'{url}?{query}').status_code, 400, query)
+        self.assertEqual(self.client.get(f'/api/images/{self.item_id}/missing.jpg?w=320').status_code, 404)
+        print("✅ Test ridimensionamento su richiesta OK")
+
+    def test_19_resize_cache(self):
+        """Test: cache LRU limitata in byte e richieste concorrenti accorpate"""
+        root = os.path.join(self.tmp_dir, 'resize_cache')
+        cache = ResizeCache(root, max_bytes=250)
+        renders = []
+
+        def slow_render():
+            renders.append(1)
+            time.sleep(0.2)
+            return b'x' * 100
+
+        def read(key, render):
+            with cache.get_or_create(key, render) as f:
+                return f.read()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(read('aa_one', slow_render))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(results, [b'x' * 100] * 8)
+
+        read('bb_two', lambda: b'y' * 100)
+        read('aa_one', slow_render)  # ora il più recente
+        read('cc_three', lambda: b'z' * 100)
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(cache.size, 200)
+        self.assertFalse(os.path.exists(cache.path('bb_two')))
+        self.assertTrue(os.path.exists(cache.path('aa_one')))
+
+        # Indice ricostruito dalla cartella al riavvio
+        reopened = ResizeCache(root, max_bytes=250)
+        self.assertEqual((len(reopened), reopened.size), (2, 200))
+
+        # Un errore arriva a chi ha chiesto il file e non resta in cache
+        with self.assertRaises(ValueError):
+            read('dd_four', lambda: int('x'))
+        self.assertEqual(read('dd_four', lambda: b'w'), b'w')
+        print("✅ Test cache ridimensionamenti OK")
+
+    def test_20_resume_skips_live_owners(self):
+        """Test: non si riprendono i job di un processo ancora in vita né da un processo figlio"""
+        success, _, data = ImagesService.store_original(
+            FileStorage(make_image(), 'photo.jpg'), self.item_id
+        )
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                  capture_output=True, text=True)
+        dead_owner = f"{socket.gethostname()}:{finished.stdout.strip()}"
+
+        live = ImageJob(item_id=self.item_id, path=data['path'], status='processing',
+                        owner=current_owner())
+        orphan = ImageJob(item_id=self.item_id, path=data['path'], status='processing',
+                          owner=dead_owner)
+        db.session.add_all([live, orphan])
+        db.session.commit()
+        live_id, orphan_id = live.id, orphan.id
+
+        # Processo del pool (spawn riesegue la creazione dell'app): nessuna ripresa
+        with mock.patch('image_jobs.multiprocessing.parent_process', return_value=object()):
+            self.assertEqual(ImageJobQueue.resume_pending(self.app), 0)
+
+        self.assertEqual(ImageJobQueue.resume_pending(self.app), 1)
+        ImageJobQueue.wait(orphan_id, timeout=30)
+
+        db.session.expire_all()
+        self.assertEqual(ImageJobQueue.get_job(orphan_id).status, 'done')
+        self.assertEqual(ImageJobQueue.get_job(orphan_id).owner, current_owner())
+        self.assertEqual(ImageJobQueue.get_job(live_id).status, 'processing')
+        print("✅ Test ripresa solo dei job orfani OK")
+
+    def test_21_batch_rollback_keeps_existing_images(self):
+        """Test: un lotto rifiutato non tocca le immagini che l'item aveva già"""
+        photo = make_image().getvalue()
+        existing = self._upload(io.BytesIO(photo)).get_json()['data']
+        ImageJobQueue.wait(existing['job']['id'], timeout=30)
+
+        response = self.client.post(
+            f'/api/images/upload/{self.item_id}/batch',
+            data={'images': [
+                (io.BytesIO(photo), 'again.jpg'),
+                (make_image(), 'new.jpg'),
+                (io.BytesIO(b'tiny'), 'broken.jpg'),
+            ]},
+            headers=self.headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        db.session.expire_all()
+        self.assertEqual(ImagesService.get_item_images_count(self.item_id), 1)
+        self.assertEqual(self._load(existing['path']), photo)
+        self.assertIsNotNone(ImagesService.get_image_key(existing['path'], 'thumbnail'))
+        print("✅ Test annullamento lotto con immagine già presente OK")
+
+    def test_22_job_status_requires_owner(self):
+        """Test: lo stato di un job è visibile solo al venditore dell'oggetto"""
+        job_id = self._upload().get_json()['data']['job']['id']
+        ImageJobQueue.wait(job_id, timeout=30)
+
+        self.assertEqual(self.client.get(f'/api/images/jobs/{job_id}').status_code, 401)
+
+        other = User(username=f'other_{job_id}', email=f'other_{job_id}@test.com', password_hash='x',
+                     first_name='Altro', last_name='Utente', phone='000')
+        db.session.add(other)
+        db.session.commit()
+        other_headers = {'Authorization': f'Bearer {create_access_token(identity=str(other.id))}'}
+        self.assertEqual(self.client.get(f'/api/images/jobs/{job_id}', headers=other_headers).status_code, 403)
+        self.assertEqual(self.client.get(f'/api/images/jobs/{job_id}', headers=self.headers).status_code, 200)
+        print("✅ Test stato job solo al proprietario OK")
+
+    def test_23_job_fails_when_session_breaks(self):
+        """Test: un errore del database durante l'elaborazione non lascia il job processing"""
+        success, _, data = ImagesService.store_original(
+            FileStorage(make_image(), 'photo.jpg'), self.item_id
+        )
+
+        def broken_session(path):
+            # Flush fallito: la sessione resta da annullare
+            db.session.add(ImageJob(item_id=self.item_id, path=None))
+            db.session.flush()
+
+        with mock.patch.object(ImagesService, 'generate_variants', side_effect=broken_session):
+            job = ImageJobQueue.enqueue(self.app, self.item_id, data['path'])
+            ImageJobQueue.wait(job.id, timeout=30)
+
+        db.session.expire_all()
+        job = ImageJobQueue.get_job(job.id)
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('Errore elaborazione immagine', job.error)
+        print("✅ Test job fallito con sessione in errore OK")
+
+    def test_24_jobs_resumed_only_on_startup(self):
+        """Test: creare l'app non riprende i job, resume_image_jobs sì"""
+        success, _, data = ImagesService.store_original(
+            FileStorage(make_image(), 'photo.jpg'), self.item_id
+        )
+        job = ImageJob(item_id=self.item_id, path=data['path'], status='pending')
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+        with mock.patch.object(ImageJobQueue, '_submit') as submit:
+            FlaskApp(db_type="sqlite", db_path=os.path.join(self.tmp_dir, 'test.db'))
+        submit.assert_not_called()
+        db.session.expire_all()
+        self.assertEqual(ImageJobQueue.get_job(job_id).status, 'pending')
+
+        self.assertGreaterEqual(self.flask_app.resume_image_jobs(), 1)
+        ImageJobQueue.wait(job_id, timeout=30)
+        db.session.expire_all()
+        self.assertEqual(ImageJobQueue.get_job(job_id).status, 'done')
+        print("✅ Test ripresa job solo all'avvio OK")
+
+    def test_25_extension_follows_content(self):
+        """Test: l'estensione del blob segue il contenuto, non il nome del client"""
+        response = self._upload(make_image(), 'photo.png')
+        self.assertEqual(response.status_code, 202)
+        data = response.get_json()['data']
+        self.assertTrue(data['filename'].endswith('.jpg'))
+        ImageJobQueue.wait(data['job']['id'], timeout=30)
+
+        blob = ImageBlob.query.filter_by(key=data['filename'].rsplit('.', 1)[0]).first()
+        self.assertEqual(blob.extension, 'jpg')
+        response = self.client.get(f"/api/images/{self.item_id}/{data['filename']}")
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        response = self.client.get(f"/api/images/{self.item_id}/{data['filename']}?size=medium",
+                                   headers={'Accept': '*/*'})
+        with Image.open(io.BytesIO(response.data)) as medium:
+            self.assertEqual(medium.format, 'JPEG')
+
+        # Estensione coerente con il contenuto: resta quella del client
+        data = self._upload(make_image(), 'photo.jpeg').get_json()['data']
+        self.assertTrue(data['filename'].endswith('.jpeg'))
+        ImageJobQueue.wait(data['job']['id'], timeout=30)
+        print("✅ Test estensione dal contenuto OK")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)